@@ -0,0 +1,44 @@
+"""activity keyset pagination indexes
+
+Revision ID: 0002_activity_keyset_indexes
+Revises: 0001_initial
+Create Date: 2026-02-09
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0002_activity_keyset_indexes"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Each page of GET /activities is a range scan on one of these, depending on the filters used
+    op.create_index(
+        "ix_activities_start_time_id",
+        "activities",
+        [sa.text("start_time DESC"), sa.text("id DESC")],
+    )
+    op.create_index(
+        "ix_activities_user_start_time_id",
+        "activities",
+        ["user_id", sa.text("start_time DESC"), sa.text("id DESC")],
+    )
+    op.create_index(
+        "ix_activities_source_start_time_id",
+        "activities",
+        ["source", sa.text("start_time DESC"), sa.text("id DESC")],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_activities_source_start_time_id", table_name="activities")
+    op.drop_index("ix_activities_user_start_time_id", table_name="activities")
+    op.drop_index("ix_activities_start_time_id", table_name="activities")
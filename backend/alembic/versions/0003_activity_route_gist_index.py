@@ -0,0 +1,29 @@
+"""activity route GiST index
+
+Revision ID: 0003_activity_route_gist
+Revises: 0002_activity_keyset_indexes
+Create Date: 2026-02-09
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "0003_activity_route_gist"
+down_revision = "0002_activity_keyset_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Backs the && bounding-box prefilter, ST_DWithin and <-> KNN ordering in nearby search.
+    # IF NOT EXISTS because GeoAlchemy2 may already have created it alongside the table.
+    op.execute("CREATE INDEX IF NOT EXISTS idx_activities_route ON activities USING gist (route)")
+    op.execute("ANALYZE activities")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_activities_route")
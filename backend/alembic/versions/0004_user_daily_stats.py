@@ -0,0 +1,56 @@
+"""per-user daily activity rollups
+
+Revision ID: 0004_user_daily_stats
+Revises: 0003_activity_route_gist
+Create Date: 2026-02-16
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0004_user_daily_stats"
+down_revision = "0003_activity_route_gist"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_daily_stats",
+        sa.Column("user_id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("activity_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("distance_meters", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("duration_seconds", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("heart_rate_sum", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("heart_rate_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("user_id", "day"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+    )
+
+    # Backfill from the activities already stored; from here on the upsert path keeps it current
+    op.execute(
+        """
+        INSERT INTO user_daily_stats
+            (user_id, day, activity_count, distance_meters, duration_seconds, heart_rate_sum, heart_rate_count)
+        SELECT
+            user_id,
+            start_time::date,
+            count(*),
+            sum(distance_meters),
+            sum(duration_seconds),
+            coalesce(sum(avg_heart_rate), 0),
+            count(avg_heart_rate)
+        FROM activities
+        GROUP BY user_id, start_time::date
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_daily_stats")
@@ -0,0 +1,58 @@
+"""single-flight insight reports and input hashes
+
+Revision ID: 0005_insight_dedup
+Revises: 0004_user_daily_stats
+Create Date: 2026-02-16
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0005_insight_dedup"
+down_revision = "0004_user_daily_stats"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("insight_reports", sa.Column("input_hash", sa.String(length=64), nullable=True))
+
+    # Keep only the newest in-flight report per activity so the unique index can be built
+    op.execute(
+        """
+        UPDATE insight_reports r
+        SET status = 'failed'
+        WHERE r.status IN ('pending', 'processing')
+          AND EXISTS (
+              SELECT 1 FROM insight_reports newer
+              WHERE newer.activity_id = r.activity_id
+                AND newer.status IN ('pending', 'processing')
+                AND (newer.created_at, newer.id) > (r.created_at, r.id)
+          )
+        """
+    )
+
+    op.create_index(
+        "uq_insight_reports_in_flight_activity",
+        "insight_reports",
+        ["activity_id"],
+        unique=True,
+        postgresql_where=sa.text("status IN ('pending', 'processing')"),
+    )
+    op.create_index(
+        "ix_insight_reports_done_input_hash",
+        "insight_reports",
+        ["input_hash"],
+        postgresql_where=sa.text("status = 'done'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_insight_reports_done_input_hash", table_name="insight_reports")
+    op.drop_index("uq_insight_reports_in_flight_activity", table_name="insight_reports")
+    op.drop_column("insight_reports", "input_hash")
@@ -0,0 +1,27 @@
+"""strava account sync watermark
+
+Revision ID: 0006_strava_sync_watermark
+Revises: 0005_insight_dedup
+Create Date: 2026-02-23
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0006_strava_sync_watermark"
+down_revision = "0005_insight_dedup"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("strava_accounts", sa.Column("activities_synced_until", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("strava_accounts", "activities_synced_until")
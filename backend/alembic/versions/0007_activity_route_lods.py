@@ -0,0 +1,57 @@
+"""simplified route levels of detail
+
+Revision ID: 0007_activity_route_lods
+Revises: 0006_strava_sync_watermark
+Create Date: 2026-03-02
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+
+
+# revision identifiers, used by Alembic.
+revision = "0007_activity_route_lods"
+down_revision = "0006_strava_sync_watermark"
+branch_labels = None
+depends_on = None
+
+
+# Must match app.geo.simplify.ROUTE_LODS
+LOD_TOLERANCES = {
+    "route_lod_low": 1e-3,
+    "route_lod_medium": 1e-4,
+    "route_lod_high": 1e-5,
+}
+
+
+def upgrade() -> None:
+    for column in LOD_TOLERANCES:
+        op.add_column(
+            "activities",
+            sa.Column(
+                column,
+                geoalchemy2.types.Geography(geometry_type="LINESTRING", srid=4326, spatial_index=False),
+                nullable=True,
+            ),
+        )
+
+    # ST_Simplify is Douglas–Peucker, the same algorithm shapely uses at ingest; true keeps collapsed lines
+    op.execute(
+        "UPDATE activities SET "
+        + ", ".join(
+            f"{column} = ST_Simplify(route::geometry, {tolerance}, true)::geography"
+            for column, tolerance in LOD_TOLERANCES.items()
+        )
+    )
+
+    for column in LOD_TOLERANCES:
+        op.alter_column("activities", column, nullable=False)
+
+
+def downgrade() -> None:
+    for column in LOD_TOLERANCES:
+        op.drop_column("activities", column)
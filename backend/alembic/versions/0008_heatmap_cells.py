@@ -0,0 +1,117 @@
+"""precomputed activity heatmap grid
+
+Revision ID: 0008_heatmap_cells
+Revises: 0007_activity_route_lods
+Create Date: 2026-03-09
+
+"""
+
+from __future__ import annotations
+
+import math
+
+from alembic import op
+import numpy as np
+import shapely
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0008_heatmap_cells"
+down_revision = "0007_activity_route_lods"
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Snapshot of app.geo.heatmap as of this revision. The backfill has to sample routes exactly like
+# ingest did then, since later updates subtract cells computed the same way, but it must not change
+# when the app's code does.
+HEATMAP_ZOOMS = (10, 13, 16)
+HEATMAP_ROUTE_LOD = "high"
+_SAMPLE_STEP = 0.5
+_MAX_LATITUDE = 85.0511287798
+
+_APPLY_SQL = sa.text(
+    """
+    INSERT INTO heatmap_cells (user_id, zoom, x, y, visits)
+    SELECT * FROM unnest(
+        CAST(:user_ids AS uuid[]),
+        CAST(:zooms AS smallint[]),
+        CAST(:xs AS integer[]),
+        CAST(:ys AS integer[]),
+        CAST(:visits AS integer[])
+    )
+    ON CONFLICT (user_id, zoom, x, y) DO UPDATE SET visits = heatmap_cells.visits + excluded.visits
+    """
+)
+
+
+def _route_cells(coords: np.ndarray) -> dict:
+    """Distinct (x, y) cells per grid level of a (N, 2) lon/lat route."""
+
+    finest = max(HEATMAP_ZOOMS)
+    n = 2**finest
+    lat_rad = np.radians(np.clip(coords[:, 1], -_MAX_LATITUDE, _MAX_LATITUDE))
+    x = (coords[:, 0].astype(np.float64) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * n
+
+    dx, dy = np.diff(x), np.diff(y)
+    steps = np.maximum(np.ceil(np.hypot(dx, dy) / _SAMPLE_STEP), 1).astype(np.int64)
+    steps[np.abs(dx) > n / 2] = 1
+
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = offsets / steps[segment]
+    xs = np.concatenate([x[segment] + dx[segment] * fraction, x[-1:]])
+    ys = np.concatenate([y[segment] + dy[segment] * fraction, y[-1:]])
+
+    cells = np.stack([np.clip(np.floor(xs), 0, n - 1), np.clip(np.floor(ys), 0, n - 1)], axis=1).astype(np.int64)
+    cells = np.unique(cells, axis=0)
+    return {zoom: np.unique(cells >> (finest - zoom), axis=0) for zoom in HEATMAP_ZOOMS}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "heatmap_cells",
+        sa.Column("user_id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("zoom", sa.SmallInteger(), nullable=False),
+        sa.Column("x", sa.Integer(), nullable=False),
+        sa.Column("y", sa.Integer(), nullable=False),
+        sa.Column("visits", sa.Integer(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("user_id", "zoom", "x", "y"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+    )
+    op.create_index("ix_heatmap_cells_zoom_x_y", "heatmap_cells", ["zoom", "x", "y"])
+
+    bind = op.get_bind()
+    result = bind.execute(
+        sa.text(f"SELECT user_id, ST_AsBinary(route_lod_{HEATMAP_ROUTE_LOD}) FROM activities").execution_options(
+            yield_per=BACKFILL_BATCH_SIZE
+        )
+    )
+    for batch in result.partitions():
+        visits = {}
+        for user_id, route in batch:
+            for zoom, cells in _route_cells(shapely.get_coordinates(shapely.from_wkb(route))).items():
+                for x, y in cells.tolist():
+                    key = (str(user_id), zoom, x, y)
+                    visits[key] = visits.get(key, 0) + 1
+        # Sorted so the upsert takes row locks in a stable order
+        keys = sorted(visits)
+        bind.execute(
+            _APPLY_SQL,
+            {
+                "user_ids": [key[0] for key in keys],
+                "zooms": [key[1] for key in keys],
+                "xs": [key[2] for key in keys],
+                "ys": [key[3] for key in keys],
+                "visits": [visits[key] for key in keys],
+            },
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_heatmap_cells_zoom_x_y", table_name="heatmap_cells")
+    op.drop_table("heatmap_cells")
@@ -0,0 +1,147 @@
+"""monthly range partitions for activities
+
+Revision ID: 0009_activity_partitions
+Revises: 0008_heatmap_cells
+Create Date: 2026-03-16
+
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+
+
+# revision identifiers, used by Alembic.
+revision = "0009_activity_partitions"
+down_revision = "0008_heatmap_cells"
+branch_labels = None
+depends_on = None
+
+
+# Partitions created past the current month; ingest adds any other month on demand
+MONTHS_AHEAD = 3
+
+def _month_of(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partition(month: date) -> None:
+    # Same naming as app.db.partitions.partition_name, which ingest relies on to find existing months
+    op.execute(
+        f"CREATE TABLE activities_y{month.year:04d}m{month.month:02d} PARTITION OF activities "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    )
+
+
+_COLUMNS = (
+    "id, user_id, external_id, source, start_time, duration_seconds, distance_meters, avg_heart_rate, "
+    "route, route_lod_low, route_lod_medium, route_lod_high"
+)
+
+
+def _activity_columns() -> list:
+    # spatial_index=False everywhere: the route GiST index is created explicitly once the old table is gone
+    return [
+        sa.Column("id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("user_id", sa.dialects.postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("external_id", sa.String(), nullable=False),
+        sa.Column("source", sa.String(), nullable=False),
+        sa.Column("start_time", sa.DateTime(), nullable=False),
+        sa.Column("duration_seconds", sa.Integer(), nullable=False),
+        sa.Column("distance_meters", sa.Integer(), nullable=False),
+        sa.Column("avg_heart_rate", sa.Integer(), nullable=True),
+        *(
+            sa.Column(
+                name,
+                geoalchemy2.types.Geography(geometry_type="LINESTRING", srid=4326, spatial_index=False),
+                nullable=False,
+            )
+            for name in ("route", "route_lod_low", "route_lod_medium", "route_lod_high")
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+    ]
+
+
+def _create_activity_indexes(unique_external_id: bool) -> None:
+    op.create_index("ix_activities_user_id", "activities", ["user_id"])
+    op.create_index("ix_activities_external_id", "activities", ["external_id"], unique=unique_external_id)
+    op.create_index("ix_activities_start_time_id", "activities", [sa.text("start_time DESC"), sa.text("id DESC")])
+    op.create_index(
+        "ix_activities_user_start_time_id", "activities", ["user_id", sa.text("start_time DESC"), sa.text("id DESC")]
+    )
+    op.create_index(
+        "ix_activities_source_start_time_id", "activities", ["source", sa.text("start_time DESC"), sa.text("id DESC")]
+    )
+    op.execute("CREATE INDEX idx_activities_route ON activities USING gist (route)")
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # Partitioned tables can only enforce uniqueness together with start_time, so
+    # ids and external_ids are registered here and insight reports point at this
+    op.create_table(
+        "activity_keys",
+        sa.Column("id", sa.dialects.postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("external_id", sa.String(), nullable=False, unique=True),
+        sa.Column("start_time", sa.DateTime(), nullable=False),
+    )
+    op.execute(
+        "INSERT INTO activity_keys (id, external_id, start_time) SELECT id, external_id, start_time FROM activities"
+    )
+
+    op.drop_constraint("insight_reports_activity_id_fkey", "insight_reports", type_="foreignkey")
+    op.rename_table("activities", "activities_unpartitioned")
+    op.execute("ALTER INDEX activities_pkey RENAME TO activities_unpartitioned_pkey")
+    op.create_table(
+        "activities",
+        *_activity_columns(),
+        sa.PrimaryKeyConstraint("id", "start_time"),
+        postgresql_partition_by="RANGE (start_time)",
+    )
+
+    months = {
+        _month_of(start_time)
+        for start_time in bind.scalars(
+            sa.text("SELECT DISTINCT date_trunc('month', start_time) FROM activities_unpartitioned")
+        )
+    }
+    this_month = _month_of(datetime.now())
+    months.update(_add_months(this_month, offset) for offset in range(MONTHS_AHEAD + 1))
+    for month in sorted(months):
+        _create_partition(month)
+
+    op.execute(f"INSERT INTO activities ({_COLUMNS}) SELECT {_COLUMNS} FROM activities_unpartitioned")
+    op.drop_table("activities_unpartitioned")
+
+    # Indexes on the parent are created on every partition, current and future
+    _create_activity_indexes(unique_external_id=False)
+    op.create_index("ix_activities_start_time_brin", "activities", ["start_time"], postgresql_using="brin")
+    op.create_foreign_key(
+        "insight_reports_activity_id_fkey", "insight_reports", "activity_keys", ["activity_id"], ["id"]
+    )
+    op.execute("ANALYZE activities")
+    op.execute("ANALYZE activity_keys")
+
+
+def downgrade() -> None:
+    op.drop_constraint("insight_reports_activity_id_fkey", "insight_reports", type_="foreignkey")
+    op.rename_table("activities", "activities_partitioned")
+    op.execute("ALTER INDEX activities_pkey RENAME TO activities_partitioned_pkey")
+    op.create_table("activities", *_activity_columns(), sa.PrimaryKeyConstraint("id"))
+    op.execute(f"INSERT INTO activities ({_COLUMNS}) SELECT {_COLUMNS} FROM activities_partitioned")
+    # Attached partitions go with it; detached ones are independent tables and are left alone
+    op.drop_table("activities_partitioned")
+
+    _create_activity_indexes(unique_external_id=True)
+    op.create_foreign_key("insight_reports_activity_id_fkey", "insight_reports", "activities", ["activity_id"], ["id"])
+    op.drop_table("activity_keys")
@@ -0,0 +1,117 @@
+"""route fingerprints for similar-route lookup
+
+Revision ID: 0010_route_fingerprints
+Revises: 0009_activity_partitions
+Create Date: 2026-03-18
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+
+from alembic import op
+import numpy as np
+import shapely
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "0010_route_fingerprints"
+down_revision = "0009_activity_partitions"
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Snapshot of app.geo.fingerprint (and the cell sampling of app.geo.heatmap) as of this revision.
+# Backfilled fingerprints must match what ingest computed then, but must not change when the
+# app's code does.
+FINGERPRINT_ZOOM = 16
+LSH_BANDS = 10
+LSH_ROWS = 3
+MINHASH_SIZE = LSH_BANDS * LSH_ROWS
+_SAMPLE_STEP = 0.5
+_MAX_LATITUDE = 85.0511287798
+_SEEDS = np.random.default_rng(0x5EED_F1A9).integers(0, 2**64, size=MINHASH_SIZE, dtype=np.uint64)
+
+
+def _route_cells(coords: np.ndarray) -> np.ndarray:
+    """Distinct (x, y) cells at FINGERPRINT_ZOOM of a (N, 2) lon/lat route."""
+
+    n = 2**FINGERPRINT_ZOOM
+    lat_rad = np.radians(np.clip(coords[:, 1], -_MAX_LATITUDE, _MAX_LATITUDE))
+    x = (coords[:, 0].astype(np.float64) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * n
+
+    dx, dy = np.diff(x), np.diff(y)
+    steps = np.maximum(np.ceil(np.hypot(dx, dy) / _SAMPLE_STEP), 1).astype(np.int64)
+    steps[np.abs(dx) > n / 2] = 1
+
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = offsets / steps[segment]
+    xs = np.concatenate([x[segment] + dx[segment] * fraction, x[-1:]])
+    ys = np.concatenate([y[segment] + dy[segment] * fraction, y[-1:]])
+
+    cells = np.stack([np.clip(np.floor(xs), 0, n - 1), np.clip(np.floor(ys), 0, n - 1)], axis=1).astype(np.int64)
+    return np.unique(cells, axis=0)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _route_fingerprint(coords: np.ndarray) -> tuple:
+    """(MinHash signature, LSH band hashes) of a (N, 2) lon/lat route."""
+
+    cells = _route_cells(coords)
+    keys = (cells[:, 0].astype(np.uint64) << np.uint64(32)) | cells[:, 1].astype(np.uint64)
+    hashes = _mix(keys[np.newaxis, :] ^ _SEEDS[:, np.newaxis])
+    signature = (hashes.min(axis=1) >> np.uint64(32)).astype(np.int64).tolist()
+
+    bands = []
+    for band in range(LSH_BANDS):
+        values = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(repr((band, *values)).encode(), digest_size=8).digest()
+        bands.append(int.from_bytes(digest, "big", signed=True))
+    return signature, bands
+
+
+def upgrade() -> None:
+    op.add_column("activities", sa.Column("route_minhash", postgresql.ARRAY(sa.BigInteger()), nullable=True))
+    op.add_column("activities", sa.Column("route_bands", postgresql.ARRAY(sa.BigInteger()), nullable=True))
+
+    bind = op.get_bind()
+    result = bind.execute(
+        sa.text("SELECT id, start_time, ST_AsBinary(route) FROM activities").execution_options(
+            yield_per=BACKFILL_BATCH_SIZE
+        )
+    )
+    update = sa.text(
+        "UPDATE activities SET route_minhash = :route_minhash, route_bands = :route_bands "
+        "WHERE id = :id AND start_time = :start_time"
+    )
+    for batch in result.partitions():
+        values = []
+        for activity_id, start_time, route in batch:
+            route_minhash, route_bands = _route_fingerprint(shapely.get_coordinates(shapely.from_wkb(route)))
+            values.append(
+                {"id": activity_id, "start_time": start_time, "route_minhash": route_minhash, "route_bands": route_bands}
+            )
+        bind.execute(update, values)
+
+    op.alter_column("activities", "route_minhash", nullable=False)
+    op.alter_column("activities", "route_bands", nullable=False)
+    op.create_index("ix_activities_route_bands", "activities", ["route_bands"], postgresql_using="gin")
+
+
+def downgrade() -> None:
+    op.drop_index("ix_activities_route_bands", table_name="activities")
+    op.drop_column("activities", "route_bands")
+    op.drop_column("activities", "route_minhash")
@@ -0,0 +1,28 @@
+"""content hash of the payload each activity was written from
+
+Revision ID: 0011_activity_content_hash
+Revises: 0010_route_fingerprints
+Create Date: 2026-03-20
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0011_activity_content_hash"
+down_revision = "0010_route_fingerprints"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # No backfill: the payloads aren't stored, so existing activities get a hash the next time they are written
+    op.add_column("activity_keys", sa.Column("content_hash", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("activity_keys", "content_hash")
@@ -0,0 +1,41 @@
+"""all-users heatmap totals
+
+Revision ID: 0012_heatmap_total_cells
+Revises: 0011_activity_content_hash
+Create Date: 2026-03-23
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0012_heatmap_total_cells"
+down_revision = "0011_activity_content_hash"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "heatmap_total_cells",
+        sa.Column("zoom", sa.SmallInteger(), nullable=False),
+        sa.Column("x", sa.Integer(), nullable=False),
+        sa.Column("y", sa.Integer(), nullable=False),
+        sa.Column("visits", sa.Integer(), nullable=False, server_default="0"),
+        sa.PrimaryKeyConstraint("zoom", "x", "y"),
+    )
+    op.execute(
+        "INSERT INTO heatmap_total_cells (zoom, x, y, visits) "
+        "SELECT zoom, x, y, sum(visits) FROM heatmap_cells GROUP BY zoom, x, y HAVING sum(visits) <> 0"
+    )
+    # Only the summed all-users read used this; per-user reads go through the primary key
+    op.drop_index("ix_heatmap_cells_zoom_x_y", table_name="heatmap_cells")
+
+
+def downgrade() -> None:
+    op.create_index("ix_heatmap_cells_zoom_x_y", "heatmap_cells", ["zoom", "x", "y"])
+    op.drop_table("heatmap_total_cells")
@@ -0,0 +1,35 @@
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request, Response, status
+
+from app.services.cache_service import CacheEntry
+
+
+def not_modified(request: Request, entry: CacheEntry) -> bool:
+    # If-None-Match wins over If-Modified-Since when a client sends both (RFC 9110 13.2.2)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return entry.modified_at <= since.timestamp()
+
+
+def cached_response(request: Request, entry: CacheEntry, media_type: str = "application/json") -> Response:
+    """Serve a cached body with ETag and Last-Modified, or a bodiless 304 if the client's copy is current."""
+
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": formatdate(entry.modified_at, usegmt=True),
+        "Cache-Control": f"max-age={entry.max_age}, immutable" if entry.max_age else "no-cache",
+    }
+    if not_modified(request, entry):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type=media_type, headers=headers)
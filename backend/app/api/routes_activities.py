@@ -1,43 +1,148 @@
-from typing import List
+import json
+from datetime import datetime
+from typing import List, Literal, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.db.models import Activity
+from app.api.http_cache import cached_response
 from app.db.session import get_db
-from app.schemas.activity import ActivityNearbyQuery, ActivityRead
+from app.schemas.activity import (
+    ActivityListQuery,
+    ActivityNearbyQuery,
+    ActivityPage,
+    ActivityRead,
+    ActivitySimilarQuery,
+    SimilarActivityRead,
+)
 from app.schemas.insight import InsightRead
-from app.services.activity_service import create_insight_report, find_activities_nearby, list_activities
-from app.services.insight_service import enqueue_insight_job
+from app.services.activity_service import (
+    find_activities_nearby,
+    find_similar_activities,
+    get_activity,
+    get_activity_page,
+    get_activity_route_geojson,
+)
+from app.services.export_service import EXPORT_MEDIA_TYPES, stream_activity_export
+from app.services.insight_service import enqueue_insight_job, request_insight_report
 
 router = APIRouter(prefix="/activities", tags=["activities"])
 
 
-@router.get("/", response_model=List[ActivityRead])
-def get_activities(db: Session = Depends(get_db)):
-    activities = list_activities(db)
-    return activities
+@router.get("/", response_model=ActivityPage)
+def get_activities(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="Opaque cursor returned as next_cursor by the previous page"),
+    user_id: Optional[UUID] = Query(None),
+    source: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+):
+    query = ActivityListQuery(limit=limit, cursor=cursor, user_id=user_id, source=source, since=since, until=until)
+    try:
+        entry = get_activity_page(db, query)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return cached_response(request, entry)
 
 
 @router.get("/nearby", response_model=List[ActivityRead])
 def get_activities_nearby(
-    lat: float = Query(...),
-    lon: float = Query(...),
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
     radius_meters: int = Query(1000, ge=1),
+    limit: int = Query(100, ge=1, le=1000),
+    user_id: Optional[UUID] = Query(None),
+    order: Literal["recent", "nearest"] = Query("recent", description="'nearest' orders by distance to the point"),
     db: Session = Depends(get_db),
 ):
-    query = ActivityNearbyQuery(lat=lat, lon=lon, radius_meters=radius_meters)
-    activities = find_activities_nearby(db, query.lat, query.lon, query.radius_meters)
+    query = ActivityNearbyQuery(
+        lat=lat, lon=lon, radius_meters=radius_meters, limit=limit, user_id=user_id, order=order
+    )
+    activities = find_activities_nearby(
+        db,
+        query.lat,
+        query.lon,
+        query.radius_meters,
+        limit=query.limit,
+        user_id=query.user_id,
+        order=query.order,
+    )
     return activities
 
 
+@router.get("/export")
+def export_activities(
+    format: Literal["ndjson", "geojson", "gpx"] = Query("ndjson"),
+    user_id: Optional[UUID] = Query(None),
+    source: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+):
+    """Stream every matching activity with its full route, newest first."""
+
+    return StreamingResponse(
+        stream_activity_export(format, user_id=user_id, source=source, since=since, until=until),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="activities.{format}"'},
+    )
+
+
+@router.get("/{activity_id}/route")
+def get_activity_route(
+    activity_id: UUID,
+    zoom: Optional[int] = Query(None, ge=0, le=24, description="Map zoom; picks a matching simplified copy"),
+    db: Session = Depends(get_db),
+):
+    """Return the route as a GeoJSON Feature at the level of detail suited to ``zoom``."""
+
+    found = get_activity_route_geojson(db, activity_id, zoom)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Activity not found")
+
+    lod, geometry = found
+    properties = json.dumps({"id": str(activity_id), "lod": lod})
+    # The geometry is already GeoJSON from PostGIS; splice it in rather than parsing and re-encoding it
+    content = f'{{"type":"Feature","geometry":{geometry},"properties":{properties}}}'
+    return Response(content=content, media_type="application/geo+json")
+
+
+@router.get("/{activity_id}/similar", response_model=List[SimilarActivityRead])
+def get_similar_activities(
+    activity_id: UUID,
+    limit: int = Query(10, ge=1, le=50),
+    max_hausdorff_meters: int = Query(200, ge=1, le=5000, description="How far the routes may stray from each other"),
+    user_id: Optional[UUID] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """Return activities that follow the same route, closest first."""
+
+    query = ActivitySimilarQuery(limit=limit, max_hausdorff_meters=max_hausdorff_meters, user_id=user_id)
+    similar = find_similar_activities(db, activity_id, query)
+    if similar is None:
+        raise HTTPException(status_code=404, detail="Activity not found")
+    return similar
+
+
 @router.post("/{activity_id}/generate-insight", response_model=InsightRead, status_code=status.HTTP_201_CREATED)
-def generate_insight_for_activity(activity_id: UUID, db: Session = Depends(get_db)):
-    activity = db.get(Activity, activity_id)
+def generate_insight_for_activity(activity_id: UUID, response: Response, db: Session = Depends(get_db)):
+    """Request an insight for an activity.
+
+    Returns 201 with a new PENDING report, or 200 with the report already in
+    flight for this activity or a DONE report generated from identical inputs.
+    """
+
+    activity = get_activity(db, activity_id)
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
 
-    report = create_insight_report(db, activity_id)
-    enqueue_insight_job(report.id)
+    report, created = request_insight_report(db, activity)
+    if created:
+        enqueue_insight_job(report.id)
+    else:
+        response.status_code = status.HTTP_200_OK
     return report
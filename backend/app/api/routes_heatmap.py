@@ -0,0 +1,29 @@
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.schemas.heatmap import HeatmapRead
+from app.services.heatmap_service import get_heatmap
+
+router = APIRouter(prefix="/heatmap", tags=["heatmap"])
+
+
+@router.get("/", response_model=HeatmapRead)
+def get_activity_heatmap(
+    zoom: int = Query(..., ge=0, le=22, description="Map zoom; served from the finest stored grid not deeper than it"),
+    min_lon: float = Query(..., ge=-180, le=180),
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    user_id: Optional[UUID] = Query(None, description="Only this user's activities; all users when omitted"),
+    db: Session = Depends(get_db),
+):
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    try:
+        return get_heatmap(db, zoom, (min_lon, min_lat, max_lon, max_lat), user_id=user_id)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
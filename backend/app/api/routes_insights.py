@@ -1,18 +1,114 @@
+import asyncio
+from typing import AsyncIterator
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.api.http_cache import cached_response, not_modified
 from app.db.session import get_db
 from app.schemas.insight import InsightRead
-from app.services.insight_service import get_insight
+from app.services.insight_service import (
+    FINAL_STATUSES,
+    INSIGHT_EVENTS_HEARTBEAT_SECONDS,
+    INSIGHT_EVENTS_MAX_SECONDS,
+    entry_status,
+    get_insight_entry,
+    insight_status_listener,
+    read_insight_entry,
+)
 
 router = APIRouter(prefix="/insights", tags=["insights"])
 
+# How long an EventSource waits before reconnecting after a stream ends
+_SSE_RETRY_MILLISECONDS = 3000
+
 
 @router.get("/{insight_id}", response_model=InsightRead)
-def get_insight_by_id(insight_id: UUID, db: Session = Depends(get_db)):
-    insight = get_insight(db, insight_id)
-    if not insight:
+def get_insight_by_id(insight_id: UUID, request: Request, db: Session = Depends(get_db)):
+    entry = get_insight_entry(db, insight_id)
+    if entry is None:
         raise HTTPException(status_code=404, detail="Insight not found")
-    return insight
+    return cached_response(request, entry)
+
+
+async def _insight_events(insight_id: UUID, request: Request) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + INSIGHT_EVENTS_MAX_SECONDS
+    # A reconnecting EventSource sends the id of the last event it saw, so it isn't sent again
+    last_etag = request.headers.get("last-event-id")
+
+    yield f"retry: {_SSE_RETRY_MILLISECONDS}\n\n"
+    async with insight_status_listener.watch(insight_id) as changed:
+        while True:
+            changed.clear()
+            entry = await read_insight_entry(insight_id)
+            if entry is None:
+                return
+            if entry.etag != last_etag:
+                last_etag = entry.etag
+                yield f"event: insight\nid: {entry.etag}\ndata: {entry.body.decode()}\n\n"
+            if entry_status(entry) in FINAL_STATUSES:
+                return
+
+            remaining = deadline - loop.time()
+            if remaining <= 0 or await request.is_disconnected():
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(INSIGHT_EVENTS_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+
+@router.get("/{insight_id}/events")
+async def stream_insight_events(insight_id: UUID, request: Request):
+    """Server-Sent Events: an ``insight`` event with the report now and after every status change.
+
+    The stream ends once the report is done or failed. Waiting clients share
+    the process's single Redis subscription rather than polling the database.
+    """
+
+    entry = await read_insight_entry(insight_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Insight not found")
+    if entry_status(entry) in FINAL_STATUSES and request.headers.get("last-event-id") == entry.etag:
+        # The client already has the final report; 204 stops EventSource from reconnecting
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    return StreamingResponse(
+        _insight_events(insight_id, request),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{insight_id}/wait", response_model=InsightRead)
+async def wait_for_insight(
+    insight_id: UUID,
+    request: Request,
+    timeout: float = Query(25, gt=0, le=60, description="Seconds to hold the request open"),
+):
+    """Long-poll variant of ``GET /insights/{id}``.
+
+    Answers as soon as the report no longer matches the client's
+    ``If-None-Match`` or is done or failed; otherwise answers 304 after
+    ``timeout`` seconds. Without ``If-None-Match`` it answers immediately.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with insight_status_listener.watch(insight_id) as changed:
+        while True:
+            changed.clear()
+            entry = await read_insight_entry(insight_id)
+            if entry is None:
+                raise HTTPException(status_code=404, detail="Insight not found")
+
+            remaining = deadline - loop.time()
+            if not not_modified(request, entry) or entry_status(entry) in FINAL_STATUSES or remaining <= 0:
+                return cached_response(request, entry)
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
@@ -1,16 +1,22 @@
 import os
 
-import httpx
 from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models import StravaAccount
-from app.db.session import get_db
-from app.services.strava_service import import_recent_activities, upsert_strava_account
+from app.db.session import get_async_db
+from app.services.strava_service import (
+    STRAVA_OAUTH_TOKEN_URL,
+    StravaRateLimitExceeded,
+    import_recent_activities,
+    strava_request,
+    sync_activity_history,
+    upsert_strava_account_async,
+)
 
 router = APIRouter(tags=["strava-oauth"])
 
@@ -46,7 +52,7 @@ class StravaCodePayload(BaseModel):
 
 
 @router.post("/strava/oauth/exchange")
-async def strava_oauth_exchange(payload: StravaCodePayload, db: Session = Depends(get_db)):
+async def strava_oauth_exchange(payload: StravaCodePayload, db: AsyncSession = Depends(get_async_db)):
     """Exchange a Strava authorization code for an access/refresh token.
 
     Expects STRAVA_CLIENT_ID and STRAVA_CLIENT_SECRET in the environment.
@@ -69,8 +75,7 @@ async def strava_oauth_exchange(payload: StravaCodePayload, db: Session = Depend
         "grant_type": "authorization_code",
     }
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post("https://www.strava.com/oauth/token", data=data)
+    resp = await strava_request("POST", STRAVA_OAUTH_TOKEN_URL, data=data)
 
     if resp.status_code != 200:
         raise HTTPException(
@@ -79,27 +84,67 @@ async def strava_oauth_exchange(payload: StravaCodePayload, db: Session = Depend
         )
 
     token_payload = resp.json()
-    account = upsert_strava_account(db, token_payload)
+    account = await upsert_strava_account_async(db, token_payload)
 
     return {"account_id": str(account.id), "athlete_id": account.athlete_id, "token": token_payload}
 
 
+def _rate_limited(exc: StravaRateLimitExceeded) -> HTTPException:
+    # Progress is committed as it goes, so a retry after the reset picks up where this request stopped
+    return HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+
+
 class StravaImportRequest(BaseModel):
     athlete_id: int | None = None
     per_page: int = 10
 
 
 @router.post("/strava/import-activities")
-async def strava_import_activities(payload: StravaImportRequest, db: Session = Depends(get_db)):
+async def strava_import_activities(payload: StravaImportRequest, db: AsyncSession = Depends(get_async_db)):
     """Import recent activities from Strava into the local Activity table."""
 
     stmt = select(StravaAccount)
     if payload.athlete_id is not None:
         stmt = stmt.where(StravaAccount.athlete_id == payload.athlete_id)
 
-    account = db.scalars(stmt).one_or_none()
+    account = (await db.scalars(stmt)).one_or_none()
     if not account:
         raise HTTPException(status_code=404, detail="Strava account not found")
 
-    imported = await import_recent_activities(db, account, per_page=payload.per_page)
+    try:
+        imported = await import_recent_activities(db, account, per_page=payload.per_page)
+    except StravaRateLimitExceeded as exc:
+        raise _rate_limited(exc)
     return {"imported": imported}
+
+
+class StravaSyncRequest(BaseModel):
+    athlete_id: int | None = None
+    full_history: bool = False
+    per_page: int = Field(200, ge=1, le=200)
+    concurrency: int = Field(4, ge=1, le=8)
+
+
+@router.post("/strava/sync-activities")
+async def strava_sync_activities(payload: StravaSyncRequest, db: AsyncSession = Depends(get_async_db)):
+    """Import all Strava activities since the account's last sync (or everything with full_history)."""
+
+    stmt = select(StravaAccount)
+    if payload.athlete_id is not None:
+        stmt = stmt.where(StravaAccount.athlete_id == payload.athlete_id)
+
+    account = (await db.scalars(stmt)).one_or_none()
+    if not account:
+        raise HTTPException(status_code=404, detail="Strava account not found")
+
+    try:
+        imported = await sync_activity_history(
+            db,
+            account,
+            full_history=payload.full_history,
+            per_page=payload.per_page,
+            concurrency=payload.concurrency,
+        )
+    except StravaRateLimitExceeded as exc:
+        raise _rate_limited(exc)
+    return {"imported": imported, "synced_until": account.activities_synced_until}
@@ -0,0 +1,33 @@
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Response
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.services.tile_service import get_tile
+
+router = APIRouter(prefix="/tiles", tags=["tiles"])
+
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+@router.get("/{z}/{x}/{y}.mvt")
+def get_activity_tile(
+    z: int = Path(..., ge=0, le=22),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0),
+    user_id: Optional[UUID] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+):
+    if x >= 2**z or y >= 2**z:
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    tile = get_tile(db, z, x, y, user_id=user_id, since=since, until=until)
+    # Empty tiles are valid and common; 204 lets map clients skip them without decoding
+    if not tile:
+        return Response(status_code=204)
+    return Response(content=tile, media_type=MVT_MEDIA_TYPE)
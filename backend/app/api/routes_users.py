@@ -0,0 +1,20 @@
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from app.db.session import get_db
+from app.schemas.stats import UserStatsRead
+from app.services.stats_service import get_user_stats
+
+router = APIRouter(prefix="/users", tags=["users"])
+
+
+@router.get("/{user_id}/stats", response_model=UserStatsRead)
+def get_user_stats_by_id(
+    user_id: UUID,
+    days: int = Query(7, ge=1, le=366),
+    daily: bool = Query(False, description="Include the per-day breakdown"),
+    db: Session = Depends(get_db),
+):
+    return get_user_stats(db, user_id, days=days, include_daily=daily)
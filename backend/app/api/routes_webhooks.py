@@ -1,17 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Any, Dict, List
+
+import redis
+from fastapi import APIRouter, Body, Depends, HTTPException, Response, status
 from sqlalchemy.orm import Session
 
 from app.db.session import get_db
-from app.schemas.activity import ActivityCreate
-from app.services.activity_service import upsert_activity_from_webhook
+from app.schemas.activity import ActivityBatchResponse, ActivityCreate
+from app.services.activity_service import bulk_upsert_activities, upsert_activity_from_webhook
+from app.services.ingest_service import enqueue_activity, write_behind_enabled
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 
+MAX_BATCH_SIZE = 1000
+
 
 @router.post("/strava", status_code=status.HTTP_201_CREATED)
-def receive_strava_webhook(payload: ActivityCreate, db: Session = Depends(get_db)):
+def receive_strava_webhook(payload: ActivityCreate, response: Response, db: Session = Depends(get_db)):
+    """Upsert an activity and return its id; 200 instead of 201 if it was already stored unchanged.
+
+    With WEBHOOK_INGEST_MODE=write-behind the validated payload is queued on
+    the ingest stream instead and 202 returned straight away, with the stream
+    entry id; the ingest consumer writes it in its next batch. If Redis can't
+    take the payload it is written here as usual.
+    """
+
+    if write_behind_enabled():
+        try:
+            ingest_id = enqueue_activity(payload)
+        except redis.RedisError as exc:
+            print(f"Failed to queue webhook payload, writing it directly: {exc}")
+        else:
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"external_id": payload.external_id, "ingest_id": ingest_id}
+
     try:
-        activity = upsert_activity_from_webhook(db, payload.dict())
+        result = upsert_activity_from_webhook(db, payload)
     except Exception as exc:  # pragma: no cover - generic safety
         raise HTTPException(status_code=400, detail=str(exc))
-    return {"id": str(activity.id), "external_id": activity.external_id}
+    if result.status == "unchanged":
+        response.status_code = status.HTTP_200_OK
+    return {"id": str(result.id), "external_id": result.external_id, "status": result.status}
+
+
+@router.post("/strava/batch", response_model=ActivityBatchResponse)
+def receive_strava_webhook_batch(
+    payloads: List[Dict[str, Any]] = Body(..., max_length=MAX_BATCH_SIZE),
+    db: Session = Depends(get_db),
+):
+    """Upsert up to MAX_BATCH_SIZE ActivityCreate payloads.
+
+    Items are validated individually, so one bad payload is reported in its
+    result entry instead of rejecting the whole batch.
+    """
+
+    results = bulk_upsert_activities(db, payloads)
+    return ActivityBatchResponse(
+        created=sum(1 for r in results if r.status == "created"),
+        updated=sum(1 for r in results if r.status == "updated"),
+        unchanged=sum(1 for r in results if r.status == "unchanged"),
+        failed=sum(1 for r in results if r.status == "error"),
+        results=results,
+    )
@@ -0,0 +1,171 @@
+"""SQLAlchemy engine and pool instrumentation.
+
+Cursor-execute hooks time every statement. Each statement goes into a
+per-engine histogram and into the ``QueryStats`` of whatever request is
+tracking queries at the time (``track_queries``). Statements slower than
+SLOW_QUERY_MS are printed with a fingerprint: the statement with literals and
+bind parameters replaced by ``?``, so one slow query shape is recognisable
+whatever its arguments or the length of its IN lists.
+
+The pool subclasses time ``connect()``. That is how long a caller waited for a
+connection, including the pre-ping. Pool sizes are read at scrape time.
+"""
+
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing one SQL statement",
+    ["engine"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SLOW_QUERIES = Counter(
+    "db_slow_queries_total",
+    "Statements slower than SLOW_QUERY_MS, by statement fingerprint",
+    ["fingerprint"],
+)
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Count the statements executed, and the time spent in them, by the enclosed code.
+
+    The stats object is shared through a context variable, so statements run
+    from threadpool handlers, ``asyncio.to_thread`` and the async engine's
+    greenlets are all counted.
+    """
+    stats = QueryStats()
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|\$\d+")
+_VALUE_LISTS = re.compile(r"\(\?(?:, \?)+\)")
+_VALUE_ROWS = re.compile(r"\((?:\?|\?, \.\.\.)\)(?:, \((?:\?|\?, \.\.\.)\))+")
+
+
+def statement_fingerprint(statement: str) -> Tuple[str, str]:
+    """Return ``(fingerprint, normalised statement)`` for a SQL statement."""
+    normalised = _WHITESPACE.sub(" ", statement).strip()
+    normalised = _LITERALS.sub("?", normalised)
+    normalised = _VALUE_LISTS.sub("(?, ...)", normalised)
+    normalised = _VALUE_ROWS.sub("(?, ...), ...", normalised)
+    return hashlib.sha1(normalised.encode()).hexdigest()[:12], normalised
+
+
+class InstrumentedQueuePool(QueuePool):
+    metrics_label = "sync"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_SECONDS.labels(self.metrics_label).observe(time.perf_counter() - start)
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CHECKOUT_SECONDS.labels(self.metrics_label).observe(time.perf_counter() - start)
+
+
+class _PoolCollector(Collector):
+    """Report each instrumented engine's pool occupancy when scraped."""
+
+    def __init__(self) -> None:
+        self.engines: Dict[str, Engine] = {}
+
+    def collect(self):
+        size = GaugeMetricFamily("db_pool_size", "Configured pool size", labels=["pool"])
+        connections = GaugeMetricFamily(
+            "db_pool_connections", "Pooled connections by state", labels=["pool", "state"]
+        )
+        for label, engine in self.engines.items():
+            # engine.pool, not a saved reference: dispose() replaces the pool
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            size.add_metric([label], pool.size())
+            connections.add_metric([label, "checked_out"], pool.checkedout())
+            connections.add_metric([label, "idle"], pool.checkedin())
+            connections.add_metric([label, "overflow"], max(pool.overflow(), 0))
+        yield size
+        yield connections
+
+
+_pool_collector = _PoolCollector()
+REGISTRY.register(_pool_collector)
+
+
+def instrument_engine(engine: Engine, label: str) -> None:
+    """Attach the query timing hooks to ``engine`` (an AsyncEngine's ``sync_engine``) and report its pool."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _record_query(conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        QUERY_SECONDS.labels(label).observe(elapsed)
+
+        stats = _query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            fingerprint, normalised = statement_fingerprint(statement)
+            SLOW_QUERIES.labels(fingerprint).inc()
+            print(f"Slow query {fingerprint} took {elapsed * 1000:.0f} ms: {normalised[:500]}")
+
+    @event.listens_for(engine, "handle_error")
+    def _discard_timer(exception_context) -> None:
+        # A failed statement never reaches after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    _pool_collector.engines[label] = engine
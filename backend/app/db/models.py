@@ -2,9 +2,21 @@ import uuid
 from datetime import datetime
 
 from geoalchemy2 import Geography
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    PrimaryKeyConstraint,
+    SmallInteger,
+    String,
+    Text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.orm import deferred, relationship
 
 from .session import Base
 
@@ -20,21 +32,112 @@ class User(Base):
     strava_accounts = relationship("StravaAccount", back_populates="user")
 
 
+class ActivityKey(Base):
+    """Identity of every activity.
+
+    ``activities`` is range-partitioned by ``start_time`` (see app.db.partitions),
+    and Postgres can only enforce uniqueness there together with the partition
+    key, so the globally unique id and external_id live in this table instead.
+    It is also what insight reports reference.
+    """
+
+    __tablename__ = "activity_keys"
+
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    external_id = Column(String, unique=True, nullable=False)
+    # Which partition currently holds the activity
+    start_time = Column(DateTime, nullable=False)
+    # Hash of the payload the activity was last written from (activity_service.activity_content_hash);
+    # a resend with the same hash is skipped. Null for rows written before it was recorded.
+    content_hash = Column(String(64), nullable=True)
+
+
 class Activity(Base):
     __tablename__ = "activities"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # The table's primary key is (id, start_time); the ORM identifies rows by id alone
+    id = Column(UUID(as_uuid=True), nullable=False, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
-    external_id = Column(String, unique=True, nullable=False, index=True)
+    external_id = Column(String, nullable=False, index=True)
     source = Column(String, nullable=False)
     start_time = Column(DateTime, nullable=False)
     duration_seconds = Column(Integer, nullable=False)
     distance_meters = Column(Integer, nullable=False)
     avg_heart_rate = Column(Integer, nullable=True)
     route = Column(Geography(geometry_type="LINESTRING", srid=4326), nullable=False)
+    # Douglas–Peucker simplified copies of route (see app.geo.simplify.ROUTE_LODS), computed at ingest.
+    # Deferred: they are only read by explicit spatial/tile queries, never when loading Activity objects.
+    route_lod_low = deferred(
+        Column(Geography(geometry_type="LINESTRING", srid=4326, spatial_index=False), nullable=False)
+    )
+    route_lod_medium = deferred(
+        Column(Geography(geometry_type="LINESTRING", srid=4326, spatial_index=False), nullable=False)
+    )
+    route_lod_high = deferred(
+        Column(Geography(geometry_type="LINESTRING", srid=4326, spatial_index=False), nullable=False)
+    )
+    # MinHash signature of the grid cells the route visits and its LSH band hashes (see app.geo.fingerprint)
+    route_minhash = deferred(Column(ARRAY(BigInteger), nullable=False))
+    route_bands = deferred(Column(ARRAY(BigInteger), nullable=False))
 
     user = relationship("User", back_populates="activities")
-    insights = relationship("InsightReport", back_populates="activity")
+    insights = relationship(
+        "InsightReport",
+        primaryjoin="Activity.id == foreign(InsightReport.activity_id)",
+        back_populates="activity",
+    )
+
+    __table_args__ = (
+        PrimaryKeyConstraint(id, start_time),
+        # Composite indexes backing the (start_time, id) keyset pagination in list_activities
+        Index("ix_activities_start_time_id", start_time.desc(), id.desc()),
+        Index("ix_activities_user_start_time_id", user_id, start_time.desc(), id.desc()),
+        Index("ix_activities_source_start_time_id", source, start_time.desc(), id.desc()),
+        # Partitions are appended to in roughly start_time order, so a BRIN index serves time windows cheaply
+        Index("ix_activities_start_time_brin", start_time, postgresql_using="brin"),
+        # Similar-route candidates: routes sharing any band hash with the one looked up (route_bands && ...)
+        Index("ix_activities_route_bands", "route_bands", postgresql_using="gin"),
+        {"postgresql_partition_by": "RANGE (start_time)"},
+    )
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class UserDailyStats(Base):
+    """Per-user, per-day activity totals, maintained incrementally on every activity upsert."""
+
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    activity_count = Column(Integer, nullable=False, default=0)
+    distance_meters = Column(BigInteger, nullable=False, default=0)
+    duration_seconds = Column(BigInteger, nullable=False, default=0)
+    # Sum and count of per-activity average HR, over activities that report one
+    heart_rate_sum = Column(BigInteger, nullable=False, default=0)
+    heart_rate_count = Column(Integer, nullable=False, default=0)
+
+
+class HeatmapCell(Base):
+    """How many of a user's activities passed through a Web Mercator grid cell, maintained on every upsert."""
+
+    __tablename__ = "heatmap_cells"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    zoom = Column(SmallInteger, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    visits = Column(Integer, nullable=False, default=0)
+
+
+class HeatmapTotalCell(Base):
+    """Visits to a grid cell summed over all users, kept in step with heatmap_cells by the same upsert."""
+
+    __tablename__ = "heatmap_total_cells"
+
+    zoom = Column(SmallInteger, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    visits = Column(Integer, nullable=False, default=0)
 
 
 class InsightStatusEnum(str):
@@ -48,12 +151,33 @@ class InsightReport(Base):
     __tablename__ = "insight_reports"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    activity_id = Column(UUID(as_uuid=True), ForeignKey("activities.id"), nullable=False, index=True)
+    activity_id = Column(UUID(as_uuid=True), ForeignKey("activity_keys.id"), nullable=False, index=True)
     status = Column(String, nullable=False, default=InsightStatusEnum.PENDING)
     summary = Column(Text, nullable=True)
+    # Fingerprint of the activity fields and rolling context the summary was generated from
+    input_hash = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.now(), nullable=False)
 
-    activity = relationship("Activity", back_populates="insights")
+    activity = relationship(
+        "Activity",
+        primaryjoin="foreign(InsightReport.activity_id) == Activity.id",
+        back_populates="insights",
+    )
+
+    __table_args__ = (
+        # At most one in-flight report per activity; concurrent requests coalesce onto it
+        Index(
+            "uq_insight_reports_in_flight_activity",
+            activity_id,
+            unique=True,
+            postgresql_where=status.in_([InsightStatusEnum.PENDING, InsightStatusEnum.PROCESSING]),
+        ),
+        Index(
+            "ix_insight_reports_done_input_hash",
+            input_hash,
+            postgresql_where=status == InsightStatusEnum.DONE,
+        ),
+    )
 
 
 class StravaAccount(Base):
@@ -65,5 +189,7 @@ class StravaAccount(Base):
     access_token = Column(String, nullable=False)
     refresh_token = Column(String, nullable=False)
     expires_at = Column(Integer, nullable=False)
+    # Epoch start time of the newest imported activity; incremental syncs ask Strava for activities after it
+    activities_synced_until = Column(Integer, nullable=True)
 
     user = relationship("User", back_populates="strava_accounts")
@@ -0,0 +1,115 @@
+"""Monthly range partitions of the ``activities`` table.
+
+``activities`` is partitioned on ``start_time``, one partition per calendar
+month named ``activities_yYYYYmMM``. There is no default partition: writers
+call ``ensure_activity_partitions`` for the months they are about to write,
+before their own transaction touches ``activities``, and old months can be
+detached (see ``scripts/activity_partitions.py``) without touching the rest
+of the table. A write that finds a remembered month detached forgets it
+(``forget_activity_partitions``) and retries, which recreates the partition.
+"""
+
+import os
+import threading
+from datetime import date, datetime
+from typing import Iterable, List, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+from app.db.session import engine
+
+
+PARENT_TABLE = "activities"
+# How long creating a partition may wait for the lock on activities before giving up
+PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("PARTITION_LOCK_TIMEOUT_MS", "5000"))
+
+# Months this process has already seen a partition for, so writes skip the catalog lookup
+_known_months: Set[date] = set()
+_known_lock = threading.Lock()
+
+
+def month_of(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def create_partition_sql(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def existing_partitions(conn: Connection) -> List[str]:
+    """Names of the partitions currently attached to ``activities``, oldest first."""
+
+    return list(
+        conn.scalars(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:parent AS regclass) ORDER BY c.relname"
+            ),
+            {"parent": PARENT_TABLE},
+        )
+    )
+
+
+def create_partitions(conn: Connection, months: Iterable[date]) -> List[str]:
+    """Create the partitions for ``months`` that don't exist yet; returns the names created."""
+
+    # Serialise creators so two processes adding the same month can't race in the catalog
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": f"{PARENT_TABLE}_partitions"})
+    existing = set(existing_partitions(conn))
+    created = []
+    for month in sorted(set(months)):
+        if partition_name(month) not in existing:
+            conn.execute(text(create_partition_sql(month)))
+            created.append(partition_name(month))
+    return created
+
+
+def ensure_activity_partitions(start_times: Iterable[datetime]) -> None:
+    """Make sure a partition exists for the month of every ``start_time`` about to be written.
+
+    Missing partitions are created in a short transaction of their own and
+    committed straight away, so the ACCESS EXCLUSIVE lock the DDL takes on
+    ``activities`` is held for milliseconds rather than for the whole write.
+    Call it before the caller's transaction touches ``activities``: the DDL
+    would otherwise wait on the caller's own locks, which it does for at most
+    PARTITION_LOCK_TIMEOUT_MS before failing.
+    """
+
+    months = {month_of(start_time) for start_time in start_times}
+    with _known_lock:
+        missing = months - _known_months
+    if not missing:
+        return
+
+    with engine.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = {PARTITION_LOCK_TIMEOUT_MS}"))
+        create_partitions(conn, missing)
+    with _known_lock:
+        _known_months.update(missing)
+
+
+def forget_activity_partitions(start_times: Iterable[datetime]) -> None:
+    """Stop assuming partitions exist for these months, so the next write checks the catalog again."""
+
+    with _known_lock:
+        _known_months.difference_update(month_of(start_time) for start_time in start_times)
+
+
+def is_missing_partition_error(exc: DBAPIError) -> bool:
+    """Whether ``exc`` is Postgres rejecting a row no attached partition accepts (e.g. its month was detached)."""
+
+    return getattr(exc.orig, "sqlstate", None) == "23514" and "no partition of relation" in str(exc.orig)
@@ -0,0 +1,24 @@
+import os
+from functools import lru_cache
+
+import redis
+import redis.asyncio
+
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+
+@lru_cache(maxsize=1)
+def get_redis() -> redis.Redis:
+    """Return the process-wide Redis client.
+
+    The client's connection pool is thread-safe, so API handlers and worker
+    threads share it instead of opening a new pool per call.
+    """
+    return redis.from_url(REDIS_URL)
+
+
+@lru_cache(maxsize=1)
+def get_async_redis() -> redis.asyncio.Redis:
+    """Return the process-wide asyncio Redis client, for ``async def`` handlers."""
+    return redis.asyncio.from_url(REDIS_URL)
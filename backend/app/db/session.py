@@ -1,15 +1,32 @@
 import os
+from typing import AsyncIterator
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
+from app.db.instrumentation import InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_engine
+
 
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "postgresql+psycopg://postgres:postgres@db:5432/geo_activities",
 )
 
+# Size the pool for the number of threads sharing it (e.g. WORKER_CONCURRENCY in the worker)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
 # Shared engine instance used across the application
-engine = create_engine(DATABASE_URL, future=True)
+engine = create_engine(
+    DATABASE_URL,
+    future=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    poolclass=InstrumentedQueuePool,
+)
+instrument_engine(engine, "sync")
 
 # Session factory
 SessionLocal = sessionmaker(
@@ -19,6 +36,24 @@ SessionLocal = sessionmaker(
     class_=Session,
 )
 
+# Async engine for `async def` routes, so database round trips never block the event loop.
+# The psycopg dialect picks its asyncio driver from the same URL; the pool is separate from the sync one.
+async_engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    poolclass=InstrumentedAsyncQueuePool,
+)
+instrument_engine(async_engine.sync_engine, "async")
+
+# Objects stay loaded after commit: an expired attribute would need a lazy load, which async sessions can't do implicitly
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 # Base declarative class
 Base = declarative_base()
 
@@ -30,3 +65,9 @@ def get_db() -> Session:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Yield an AsyncSession for `async def` FastAPI dependencies."""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,72 @@
+"""Route fingerprints for finding activities that follow the same route.
+
+A route is reduced to the set of Web Mercator cells it passes through (the
+finest heatmap grid, cells of ~610 m at the equator), and that set to a
+MinHash signature: for each of ``MINHASH_SIZE`` hash functions, the smallest
+hash of any cell. Two signatures agree in a given position with probability
+equal to the Jaccard similarity of the cell sets, so the fraction of equal
+positions estimates how much two routes overlap without comparing them.
+
+For lookups the signature is cut into ``LSH_BANDS`` bands of ``LSH_ROWS``
+values and each band is hashed to one integer (locality-sensitive hashing).
+Routes sharing any band hash are candidates; with 10 bands of 3 that catches
+~74% of pairs at Jaccard 0.5, ~98% at 0.7, and only ~24% at 0.3.
+
+Changing any constant here changes every fingerprint; stored ones must then be
+recomputed (in a new migration; 0010 keeps a snapshot of the current scheme).
+"""
+
+import hashlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from app.geo.heatmap import HEATMAP_ZOOMS, route_cells
+
+
+FINGERPRINT_ZOOM = max(HEATMAP_ZOOMS)
+LSH_BANDS = 10
+LSH_ROWS = 3
+MINHASH_SIZE = LSH_BANDS * LSH_ROWS
+
+# Fixed so every process, and every past ingest, hashes cells the same way
+_SEEDS = np.random.default_rng(0x5EED_F1A9).integers(0, 2**64, size=MINHASH_SIZE, dtype=np.uint64)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    # splitmix64 finaliser; uint64 arithmetic wraps, which is what it relies on
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def minhash_signature(cells: np.ndarray) -> List[int]:
+    """MinHash of a non-empty ``(N, 2)`` array of ``(x, y)`` cells, as ``MINHASH_SIZE`` 32-bit values."""
+
+    keys = (cells[:, 0].astype(np.uint64) << np.uint64(32)) | cells[:, 1].astype(np.uint64)
+    hashes = _mix(keys[np.newaxis, :] ^ _SEEDS[:, np.newaxis])
+    return (hashes.min(axis=1) >> np.uint64(32)).astype(np.int64).tolist()
+
+
+def lsh_bands(signature: Sequence[int]) -> List[int]:
+    """One signed 64-bit hash per band of ``signature``; the band index is hashed in so bands never collide."""
+
+    bands = []
+    for band in range(LSH_BANDS):
+        values = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(repr((band, *values)).encode(), digest_size=8).digest()
+        bands.append(int.from_bytes(digest, "big", signed=True))
+    return bands
+
+
+def route_fingerprint(coords: np.ndarray) -> Tuple[List[int], List[int]]:
+    """Return ``(minhash signature, LSH band hashes)`` for an ``(N, 2)`` lon/lat route."""
+
+    signature = minhash_signature(route_cells(coords)[FINGERPRINT_ZOOM])
+    return signature, lsh_bands(signature)
+
+
+def estimated_overlap(a: Sequence[int], b: Sequence[int]) -> float:
+    """Jaccard similarity of two routes' cell sets, estimated from their signatures."""
+
+    return sum(x == y for x, y in zip(a, b)) / MINHASH_SIZE
@@ -0,0 +1,52 @@
+"""Heatmap grid cells visited by a route.
+
+Cells are Web Mercator tiles (x, y) at a few fixed zoom levels. A route is
+sampled at half-cell spacing on the finest grid and the coarser grids are
+derived by bit-shifting, so every level agrees on what the route touched.
+"""
+
+from typing import Dict
+
+import numpy as np
+
+from app.geo.tiles import tile_coords
+
+
+# Grid levels stored in heatmap_cells: cells of roughly 39 km, 4.9 km and 610 m at the equator
+HEATMAP_ZOOMS = (10, 13, 16)
+# Route copy the grid is sampled from; its ~1 m tolerance is far below the finest cell
+HEATMAP_ROUTE_LOD = "high"
+
+# Sample spacing, in cells of the finest grid
+_SAMPLE_STEP = 0.5
+
+
+def heatmap_zoom_for(zoom: int) -> int:
+    """Finest stored grid level not deeper than ``zoom`` (the coarsest one below it)."""
+
+    return max((z for z in HEATMAP_ZOOMS if z <= zoom), default=HEATMAP_ZOOMS[0])
+
+
+def route_cells(coords: np.ndarray) -> Dict[int, np.ndarray]:
+    """Return the distinct ``(x, y)`` cells a ``(N, 2)`` lon/lat route passes through, per grid level."""
+
+    finest = max(HEATMAP_ZOOMS)
+    n = 2**finest
+    x, y = tile_coords(coords[:, 0], coords[:, 1], finest)
+
+    dx, dy = np.diff(x), np.diff(y)
+    steps = np.maximum(np.ceil(np.hypot(dx, dy) / _SAMPLE_STEP), 1).astype(np.int64)
+    # A jump over half the world is an antimeridian crossing, not a segment to walk
+    steps[np.abs(dx) > n / 2] = 1
+
+    # Interpolate every segment at once: sample k of a segment sits at k/steps along it
+    segment = np.repeat(np.arange(len(steps)), steps)
+    offsets = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    fraction = offsets / steps[segment]
+    xs = np.concatenate([x[segment] + dx[segment] * fraction, x[-1:]])
+    ys = np.concatenate([y[segment] + dy[segment] * fraction, y[-1:]])
+
+    cells = np.stack([np.clip(np.floor(xs), 0, n - 1), np.clip(np.floor(ys), 0, n - 1)], axis=1).astype(np.int64)
+    cells = np.unique(cells, axis=0)
+    return {zoom: np.unique(cells >> (finest - zoom), axis=0) for zoom in HEATMAP_ZOOMS}
+
@@ -0,0 +1,56 @@
+"""Douglas–Peucker levels of detail for activity routes.
+
+Each route is stored at full resolution plus a few simplified copies. Map
+views and tiles read the copy whose tolerance is below a pixel at the
+requested zoom, and spatial queries can reject candidates against the coarse
+copy before testing the exact route.
+"""
+
+from typing import Dict, Optional
+
+from shapely.geometry import LineString
+
+
+# (name, tolerance in degrees, lowest web-map zoom served from it), coarsest first.
+# A degree of latitude is ~111 km, so the tolerances are ~110 m, ~11 m and ~1 m.
+ROUTE_LODS = (
+    ("low", 1e-3, 0),
+    ("medium", 1e-4, 11),
+    ("high", 1e-5, 14),
+)
+# From this zoom on the full-resolution route is served
+FULL_RESOLUTION_MIN_ZOOM = 16
+
+_METERS_PER_DEGREE = 111_320.0
+# Slack for geodesic vs planar distance on long simplified segments
+_GEODESIC_SLACK = 1.1
+
+
+def simplify_route(line: LineString) -> Dict[str, LineString]:
+    """Return one Douglas–Peucker simplification of ``line`` per level of detail."""
+
+    simplified = {}
+    for name, tolerance, _ in ROUTE_LODS:
+        candidate = line.simplify(tolerance, preserve_topology=False)
+        # DP keeps both endpoints, but guard against degenerate output anyway
+        simplified[name] = candidate if isinstance(candidate, LineString) and len(candidate.coords) >= 2 else line
+    return simplified
+
+
+def lod_for_zoom(zoom: int) -> Optional[str]:
+    """Name of the level of detail to serve at ``zoom``, or None for full resolution."""
+
+    if zoom >= FULL_RESOLUTION_MIN_ZOOM:
+        return None
+    chosen = ROUTE_LODS[0][0]
+    for name, _, min_zoom in ROUTE_LODS:
+        if zoom >= min_zoom:
+            chosen = name
+    return chosen
+
+
+def lod_tolerance_meters(name: str) -> float:
+    """Upper bound, in meters, on how far the ``name`` copy strays from the full route."""
+
+    tolerance = next(tol for lod, tol, _ in ROUTE_LODS if lod == name)
+    return tolerance * _METERS_PER_DEGREE * _GEODESIC_SLACK
@@ -0,0 +1,62 @@
+"""Web Mercator (XYZ / slippy map) tile arithmetic."""
+
+import math
+from typing import Iterator, Tuple
+
+import numpy as np
+
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_coords(lon, lat, zoom: int):
+    """Fractional tile coordinates of lon/lat at ``zoom``; y grows southwards."""
+
+    n = 2**zoom
+    lat_rad = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * n
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def lonlat_to_tile(lon, lat, zoom: int):
+    """Return the (x, y) tile indices containing each lon/lat at ``zoom``.
+
+    Accepts scalars or NumPy arrays; results are clamped to the valid range.
+    """
+
+    n = 2**zoom
+    x, y = tile_coords(lon, lat, zoom)
+    return np.clip(np.floor(x), 0, n - 1).astype(np.int64), np.clip(np.floor(y), 0, n - 1).astype(np.int64)
+
+
+def tile_range_for_bounds(
+    bounds: Tuple[float, float, float, float], zoom: int, buffer: float = 0.0
+) -> Tuple[int, int, int, int]:
+    """Return inclusive ``(min_x, min_y, max_x, max_y)`` tile indices covering lon/lat ``bounds``.
+
+    ``buffer`` widens the box by that fraction of a tile on every side, to catch
+    neighbouring tiles whose rendering buffer reaches into ``bounds``.
+    """
+
+    min_lon, min_lat, max_lon, max_lat = bounds
+    n = 2**zoom
+    # The northern edge gives the smallest y
+    left, top = tile_coords(min_lon, max_lat, zoom)
+    right, bottom = tile_coords(max_lon, min_lat, zoom)
+    return (
+        int(np.clip(np.floor(left - buffer), 0, n - 1)),
+        int(np.clip(np.floor(top - buffer), 0, n - 1)),
+        int(np.clip(np.floor(right + buffer), 0, n - 1)),
+        int(np.clip(np.floor(bottom + buffer), 0, n - 1)),
+    )
+
+
+def tiles_for_bounds(
+    bounds: Tuple[float, float, float, float], zoom: int, buffer: float = 0.0
+) -> Iterator[Tuple[int, int]]:
+    min_x, min_y, max_x, max_y = tile_range_for_bounds(bounds, zoom, buffer)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield x, y
@@ -1,12 +1,27 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
  
 from app.api.routes_activities import router as activities_router
+from app.api.metrics import MetricsMiddleware
+from app.api.routes_heatmap import router as heatmap_router
 from app.api.routes_insights import router as insights_router
+from app.api.routes_metrics import router as metrics_router
 from app.api.routes_webhooks import router as webhooks_router
 from app.api.routes_oauth import router as oauth_router
- 
-app = FastAPI(title="Geo Activity Insights API")
+from app.api.routes_tiles import router as tiles_router
+from app.api.routes_users import router as users_router
+from app.services.strava_service import close_strava_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_strava_client()
+
+
+app = FastAPI(title="Geo Activity Insights API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,8 +30,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it is the outermost middleware and also times responses CORS answers itself
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(webhooks_router)
 app.include_router(activities_router)
 app.include_router(insights_router)
 app.include_router(oauth_router)
+app.include_router(users_router)
+app.include_router(tiles_router)
+app.include_router(heatmap_router)
+app.include_router(metrics_router)
@@ -1,8 +1,8 @@
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import List, Literal, Optional, Union
 from uuid import UUID
 
-from pydantic import BaseModel, Field, ConfigDict, field_validator
+from pydantic import BaseModel, Field, ConfigDict, field_validator, model_validator
 
 
 class RoutePoint(BaseModel):
@@ -18,7 +18,15 @@ class ActivityBase(BaseModel):
     duration_seconds: int
     distance_meters: int
     avg_heart_rate: Optional[Union[int, float]]
-    route: List[RoutePoint]
+    route: Optional[List[RoutePoint]] = None
+    # Google encoded polyline (e.g. Strava's map.polyline); takes precedence over route when both are given
+    polyline: Optional[str] = None
+
+    @model_validator(mode='after')
+    def require_route_or_polyline(self):
+        if not self.route and not self.polyline:
+            raise ValueError("either route or polyline is required")
+        return self
 
     @field_validator('avg_heart_rate', mode='before')
     @classmethod
@@ -33,6 +41,22 @@ class ActivityCreate(ActivityBase):
     pass
 
 
+class ActivityUpsertResult(BaseModel):
+    index: int
+    external_id: Optional[str] = None
+    id: Optional[UUID] = None
+    status: Literal["created", "updated", "unchanged", "duplicate", "error"]
+    error: Optional[str] = None
+
+
+class ActivityBatchResponse(BaseModel):
+    created: int
+    updated: int
+    unchanged: int
+    failed: int
+    results: List[ActivityUpsertResult]
+
+
 class ActivityRead(BaseModel):
     id: UUID
     user_id: UUID
@@ -46,7 +70,37 @@ class ActivityRead(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class ActivityPage(BaseModel):
+    items: List[ActivityRead]
+    next_cursor: Optional[str] = None
+
+
+class ActivityListQuery(BaseModel):
+    limit: int = Field(50, ge=1, le=500)
+    cursor: Optional[str] = None
+    user_id: Optional[UUID] = None
+    source: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+
 class ActivityNearbyQuery(BaseModel):
-    lat: float
-    lon: float
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
     radius_meters: int = 1000
+    limit: int = Field(100, ge=1, le=1000)
+    user_id: Optional[UUID] = None
+    order: Literal["recent", "nearest"] = "recent"
+
+
+class ActivitySimilarQuery(BaseModel):
+    limit: int = Field(10, ge=1, le=50)
+    max_hausdorff_meters: int = Field(200, ge=1, le=5000)
+    user_id: Optional[UUID] = None
+
+
+class SimilarActivityRead(ActivityRead):
+    # Largest distance from any point of either route to the other one
+    hausdorff_meters: float
+    # Estimated share of grid cells the two routes have in common (Jaccard similarity)
+    overlap: float
@@ -0,0 +1,17 @@
+from typing import List, Optional
+from uuid import UUID
+
+from pydantic import BaseModel
+
+
+class HeatmapCellRead(BaseModel):
+    x: int
+    y: int
+    visits: int
+
+
+class HeatmapRead(BaseModel):
+    # Web Mercator tile zoom of the grid the cells belong to
+    zoom: int
+    user_id: Optional[UUID] = None
+    cells: List[HeatmapCellRead] = []
@@ -0,0 +1,26 @@
+from datetime import date
+from typing import List, Optional
+from uuid import UUID
+
+from pydantic import BaseModel, ConfigDict
+
+
+class UserDailyStatsRead(BaseModel):
+    day: date
+    activity_count: int
+    distance_meters: int
+    duration_seconds: int
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class UserStatsRead(BaseModel):
+    user_id: UUID
+    days: int
+    since: date
+    activity_count: int
+    distance_meters: int
+    duration_seconds: int
+    avg_distance_meters: float
+    avg_heart_rate: Optional[float]
+    daily: List[UserDailyStatsRead] = []
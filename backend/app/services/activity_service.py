@@ -1,90 +1,911 @@
-from datetime import datetime
-from typing import Iterable, List, Optional
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
 from uuid import UUID
 
-from geoalchemy2.shape import from_shape
+import numpy as np
+import shapely
+from geoalchemy2 import Geometry
+from geoalchemy2.elements import WKTElement
 from shapely.geometry import LineString
-from sqlalchemy import func, select
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, case, cast, column, delete, func, select, table, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
 
-from app.db.models import Activity, InsightReport, InsightStatusEnum
-from app.schemas.activity import ActivityCreate
+from app.db.models import Activity, ActivityKey
+from app.db.partitions import ensure_activity_partitions, forget_activity_partitions, is_missing_partition_error
+from app.geo.fingerprint import estimated_overlap, route_fingerprint
+from app.geo.heatmap import HEATMAP_ROUTE_LOD
+from app.geo.polyline import decode_polyline
+from app.geo.simplify import lod_for_zoom, lod_tolerance_meters, simplify_route
+from app.schemas.activity import (
+    ActivityCreate,
+    ActivityListQuery,
+    ActivityPage,
+    ActivityRead,
+    ActivitySimilarQuery,
+    ActivityUpsertResult,
+    SimilarActivityRead,
+)
+from app.services.cache_service import (
+    READ_CACHE_TTL_SECONDS,
+    CacheEntry,
+    Rendered,
+    activity_list_cache_keys,
+    cached_read,
+    invalidate_activity_lists,
+)
+from app.services.heatmap_service import HeatmapDeltas, heatmap_deltas, write_heatmap_deltas
+from app.services.stats_service import apply_activity_deltas
+from app.services.tile_service import Bounds, invalidate_tiles_for_bounds
 
 
-def _route_to_linestring(route_points: Iterable[dict]) -> LineString:
-    coords = [(p["lon"], p["lat"]) for p in route_points]
+UPSERT_CHUNK_SIZE = int(os.getenv("ACTIVITY_UPSERT_CHUNK_SIZE", "500"))
+# Bump when ingest derives something new from a payload, so resent activities are rewritten once
+CONTENT_HASH_VERSION = 1
+# Routes sharing a band hash that are ranked by their signatures; the best few get an exact comparison
+SIMILAR_ROUTE_CANDIDATES = int(os.getenv("SIMILAR_ROUTE_CANDIDATES", "500"))
+# Candidates whose estimated cell overlap is below this can't be the same route
+SIMILAR_ROUTE_MIN_OVERLAP = float(os.getenv("SIMILAR_ROUTE_MIN_OVERLAP", "0.3"))
+
+
+def _route_coords(activity_data: ActivityCreate) -> np.ndarray:
+    """Return the route as an ``(N, 2)`` array of ``(lon, lat)``, preferring the encoded polyline."""
+    if activity_data.polyline:
+        return decode_polyline(activity_data.polyline)
+    return np.array([(p.lon, p.lat) for p in activity_data.route], dtype=np.float64)
+
+
+def _route_to_linestring(coords: np.ndarray) -> LineString:
     return LineString(coords)
 
 
-def upsert_activity_from_webhook(db: Session, payload: dict) -> Activity:
-    activity_data = ActivityCreate(**payload)
+def _to_geography(line: LineString) -> WKTElement:
+    # Bind as EWKT directly: a WKBElement would be parsed back into a shape and re-serialised to WKT per row
+    return WKTElement(shapely.to_wkt(line, rounding_precision=7), srid=4326)
 
-    existing: Optional[Activity] = db.scalars(
-        select(Activity).where(Activity.external_id == activity_data.external_id)
-    ).one_or_none()
 
-    line = _route_to_linestring([p.dict() for p in activity_data.route])
-    geo = from_shape(line, srid=4326)
-
-    if existing:
-        existing.user_id = activity_data.user_id
-        existing.source = activity_data.source
-        existing.start_time = activity_data.start_time
-        existing.duration_seconds = activity_data.duration_seconds
-        existing.distance_meters = activity_data.distance_meters
-        existing.avg_heart_rate = activity_data.avg_heart_rate
-        existing.route = geo
-        db.add(existing)
-        db.commit()
-        db.refresh(existing)
-        return existing
-
-    activity = Activity(
-        user_id=activity_data.user_id,
-        external_id=activity_data.external_id,
-        source=activity_data.source,
-        start_time=activity_data.start_time,
-        duration_seconds=activity_data.duration_seconds,
-        distance_meters=activity_data.distance_meters,
-        avg_heart_rate=activity_data.avg_heart_rate,
-        route=geo,
+_UPSERT_COLUMNS = (
+    "user_id",
+    "source",
+    "start_time",
+    "duration_seconds",
+    "distance_meters",
+    "avg_heart_rate",
+    "route",
+    "route_lod_low",
+    "route_lod_medium",
+    "route_lod_high",
+    "route_minhash",
+    "route_bands",
+)
+
+
+def _naive_utc(start_time: datetime) -> datetime:
+    # start_time is a naive UTC column; normalise here so daily rollups bucket the same way Postgres does
+    if start_time.tzinfo is not None:
+        return start_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return start_time
+
+
+def activity_content_hash(
+    *,
+    user_id: UUID,
+    external_id: str,
+    source: str,
+    start_time: datetime,
+    duration_seconds: int,
+    distance_meters: int,
+    avg_heart_rate: Optional[int],
+    coords: np.ndarray,
+) -> str:
+    """Hash everything an activity row is built from, so a resent activity that hasn't changed can be skipped."""
+
+    fields = [
+        CONTENT_HASH_VERSION,
+        str(user_id),
+        external_id,
+        source,
+        _naive_utc(start_time).isoformat(),
+        duration_seconds,
+        distance_meters,
+        avg_heart_rate,
+    ]
+    digest = hashlib.sha256(json.dumps(fields).encode())
+    # Routes are stored rounded to 7 decimals, so finer differences wouldn't change the row
+    digest.update(np.round(np.asarray(coords, dtype=np.float64), 7).tobytes())
+    return digest.hexdigest()
+
+
+def build_activity_values(
+    *,
+    user_id: UUID,
+    external_id: str,
+    source: str,
+    start_time: datetime,
+    duration_seconds: int,
+    distance_meters: int,
+    avg_heart_rate: Optional[int],
+    coords: np.ndarray,
+) -> dict:
+    """Build the ``activities`` row for an activity whose route is an ``(N, 2)`` lon/lat array.
+
+    ``content_hash`` is not an ``activities`` column; the upsert stores it in activity_keys.
+    """
+
+    line = _route_to_linestring(coords)
+    route_minhash, route_bands = route_fingerprint(coords)
+    content_hash = activity_content_hash(
+        user_id=user_id,
+        external_id=external_id,
+        source=source,
+        start_time=start_time,
+        duration_seconds=duration_seconds,
+        distance_meters=distance_meters,
+        avg_heart_rate=avg_heart_rate,
+        coords=coords,
+    )
+    return {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "external_id": external_id,
+        "source": source,
+        "start_time": _naive_utc(start_time),
+        "duration_seconds": duration_seconds,
+        "distance_meters": distance_meters,
+        "avg_heart_rate": avg_heart_rate,
+        "route": _to_geography(line),
+        **{f"route_lod_{name}": _to_geography(simple) for name, simple in simplify_route(line).items()},
+        "route_minhash": route_minhash,
+        "route_bands": route_bands,
+        "content_hash": content_hash,
+    }
+
+
+def _activity_fields(activity_data: ActivityCreate) -> dict:
+    """The ``build_activity_values`` arguments for a validated payload."""
+    return {
+        "user_id": activity_data.user_id,
+        "external_id": activity_data.external_id,
+        "source": activity_data.source,
+        "start_time": activity_data.start_time,
+        "duration_seconds": activity_data.duration_seconds,
+        "distance_meters": activity_data.distance_meters,
+        "avg_heart_rate": activity_data.avg_heart_rate,
+        "coords": _route_coords(activity_data),
+    }
+
+
+def _unchanged_activities(db: Session, content_hashes: Mapping[str, str]) -> Dict[str, UUID]:
+    """Map the external_ids in ``content_hashes`` already stored with that content hash to their ids."""
+
+    if not content_hashes:
+        return {}
+    return dict(
+        db.execute(
+            select(ActivityKey.external_id, ActivityKey.id).where(
+                tuple_(ActivityKey.external_id, ActivityKey.content_hash).in_(list(content_hashes.items()))
+            )
+        ).all()
+    )
+
+
+def _on_conflict_update(stmt):
+    """Turn an ``INSERT`` into activities into an upsert on the ``(id, start_time)`` primary key.
+
+    Rows must already carry their registered id (see ``_prepare_write``), which
+    makes this equivalent to an upsert on ``external_id``.
+    """
+    return stmt.on_conflict_do_update(
+        index_elements=[Activity.id, Activity.start_time],
+        set_={column: stmt.excluded[column] for column in _UPSERT_COLUMNS if column != "start_time"},
+    )
+
+
+def by_activity_ids(stmt, activity_ids: Iterable[UUID]):
+    """Restrict a select over activities to ``activity_ids``.
+
+    Goes through activity_keys, whose start_time lets each id be looked up in
+    its own partition rather than probing every month.
+    """
+    return stmt.join(
+        ActivityKey, and_(ActivityKey.id == Activity.id, ActivityKey.start_time == Activity.start_time)
+    ).where(ActivityKey.id.in_(list(activity_ids)))
+
+
+def get_activity(db: Session, activity_id: UUID) -> Optional[Activity]:
+    return db.scalars(by_activity_ids(select(Activity), [activity_id])).one_or_none()
+
+
+def _route_bounds_columns():
+    route = cast(Activity.route, Geometry(srid=4326))
+    return (
+        func.ST_XMin(route).label("min_lon"),
+        func.ST_YMin(route).label("min_lat"),
+        func.ST_XMax(route).label("max_lon"),
+        func.ST_YMax(route).label("max_lat"),
+    )
+
+
+def _bounds(row: Mapping) -> Bounds:
+    return row["min_lon"], row["min_lat"], row["max_lon"], row["max_lat"]
+
+
+class DetachedActivityError(ValueError):
+    """Raised for writes to activities whose stored version is in a detached month.
+
+    The daily rollups and heatmap still count that version, but its row can't
+    be read to subtract it, so the write is rejected instead of counted twice.
+    """
+
+    def __init__(self, external_ids: Iterable[str]) -> None:
+        self.external_ids = sorted(external_ids)
+        super().__init__(
+            "Stored in a detached month partition; reattach it before updating: " + ", ".join(self.external_ids)
+        )
+
+
+def _lock_and_read_previous(db: Session, external_ids: List[str]) -> Tuple[Sequence[Mapping], List[str]]:
+    """Lock ``external_ids`` for this transaction and return the rows currently stored under them.
+
+    Concurrent writers of the same external_ids are serialised with
+    transaction-scoped advisory locks, taken in sorted order, so the read can't
+    miss a row another transaction is writing. Also returns the external_ids
+    registered in activity_keys whose row is missing, i.e. whose month was detached.
+    """
+
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(CAST(:keys AS text[])) AS k ORDER BY k"),
+        {"keys": sorted(external_ids)},
+    )
+    found = db.execute(
+        select(
+            Activity.id,
+            ActivityKey.external_id,
+            Activity.user_id,
+            Activity.start_time,
+            Activity.duration_seconds,
+            Activity.distance_meters,
+            Activity.avg_heart_rate,
+            func.ST_AsBinary(getattr(Activity, f"route_lod_{HEATMAP_ROUTE_LOD}")).label("heatmap_route"),
+            *_route_bounds_columns(),
+        )
+        .select_from(ActivityKey)
+        .outerjoin(Activity, and_(Activity.id == ActivityKey.id, Activity.start_time == ActivityKey.start_time))
+        .where(ActivityKey.external_id.in_(external_ids))
+    ).mappings().all()
+    previous = [row for row in found if row["id"] is not None]
+    detached = [row["external_id"] for row in found if row["id"] is None]
+    return previous, detached
+
+
+def _prepare_write(db: Session, rows: List[dict]) -> Tuple[Sequence[Mapping], List[dict]]:
+    """Get ready to upsert ``rows`` into the partitioned activities table.
+
+    Locks the external_ids and reads their previous rows, and registers the
+    rows in activity_keys, which hands back the id each external_id already
+    has. An activity whose start_time moved to another month is deleted from
+    its old partition, so the insert that follows can upsert on
+    ``(id, start_time)``. Raises ``DetachedActivityError`` if a previous row is
+    in a detached month. The months' partitions must already exist (see
+    ``_retry_detached_partition``).
+
+    Returns the previous rows and ``rows`` with their registered ids, ready
+    to insert into activities.
+    """
+
+    previous, detached = _lock_and_read_previous(db, [row["external_id"] for row in rows])
+    if detached:
+        raise DetachedActivityError(detached)
+
+    stmt = pg_insert(ActivityKey).values(
+        [
+            {
+                "id": row["id"],
+                "external_id": row["external_id"],
+                "start_time": row["start_time"],
+                "content_hash": row.get("content_hash"),
+            }
+            for row in rows
+        ]
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ActivityKey.external_id],
+        set_={"start_time": stmt.excluded.start_time, "content_hash": stmt.excluded.content_hash},
+    ).returning(ActivityKey.external_id, ActivityKey.id)
+    ids = dict(db.execute(stmt).all())
+    rows = [
+        {**{key: value for key, value in row.items() if key != "content_hash"}, "id": ids[row["external_id"]]}
+        for row in rows
+    ]
+
+    start_times = {row["external_id"]: row["start_time"] for row in rows}
+    moved = [(row["id"], row["start_time"]) for row in previous if row["start_time"] != start_times[row["external_id"]]]
+    if moved:
+        db.execute(
+            delete(Activity)
+            .where(tuple_(Activity.id, Activity.start_time).in_(moved))
+            .execution_options(synchronize_session=False)
+        )
+    return previous, rows
+
+
+class TouchedActivities:
+    """Route bounds and users an upsert changed, for invalidating read caches once it commits."""
+
+    def __init__(self, bounds: Iterable[Bounds] = (), user_ids: Iterable[UUID] = ()) -> None:
+        self.bounds: List[Bounds] = list(bounds)
+        self.user_ids: Set[UUID] = set(user_ids)
+
+    def update(self, other: "TouchedActivities") -> None:
+        self.bounds.extend(other.bounds)
+        self.user_ids.update(other.user_ids)
+
+
+def invalidate_read_caches(touched: TouchedActivities) -> None:
+    """Drop cached tiles and activity listings affected by a committed upsert."""
+
+    invalidate_tiles_for_bounds(touched.bounds)
+    invalidate_activity_lists(touched.user_ids)
+
+
+def _heatmap_deltas(previous: Sequence[Mapping], rows: List[dict]) -> HeatmapDeltas:
+    """The heatmap change of replacing the ``previous`` routes with those in ``rows``."""
+    return heatmap_deltas(
+        removed=[(row["user_id"], shapely.get_coordinates(shapely.from_wkb(row["heatmap_route"]))) for row in previous],
+        added=[
+            (row["user_id"], shapely.get_coordinates(shapely.from_wkt(row[f"route_lod_{HEATMAP_ROUTE_LOD}"].data)))
+            for row in rows
+        ],
+    )
+
+
+def _write_upsert(
+    db: Session, stmt, previous: Sequence[Mapping], rows: List[dict], heatmap: Optional[HeatmapDeltas] = None
+) -> Tuple[list, TouchedActivities]:
+    """Run the activities upsert ``stmt`` for ``rows`` and fold the change into derived tables.
+
+    ``heatmap`` is the precomputed ``_heatmap_deltas(previous, rows)``, if the
+    caller already rasterised the routes elsewhere.
+    """
+
+    # Under the advisory locks, an external_id without a previous row is a create
+    stmt = stmt.returning(
+        Activity.id,
+        Activity.external_id,
+        Activity.external_id.not_in([row["external_id"] for row in previous]).label("inserted"),
+        *_route_bounds_columns(),
+    )
+    written = db.execute(stmt).all()
+
+    apply_activity_deltas(db, removed=previous, added=rows)
+    write_heatmap_deltas(db, _heatmap_deltas(previous, rows) if heatmap is None else heatmap)
+    return written, TouchedActivities(
+        bounds=[_bounds(row._mapping) for row in written] + [_bounds(row) for row in previous],
+        user_ids=[row["user_id"] for row in rows] + [row["user_id"] for row in previous],
+    )
+
+
+def _upsert_rows(db: Session, rows: List[dict]) -> Tuple[list, TouchedActivities]:
+    """Upsert ``rows`` and keep derived tables in step, without committing.
+
+    The previous version of each row is read first so the daily rollup and the
+    heatmap grid can subtract what an updated activity used to contribute.
+
+    Returns the written rows and what they touched (the bounds of every old
+    and new route and their users), for the caller to pass to
+    ``invalidate_read_caches`` once the transaction commits.
+    """
+
+    return _retry_detached_partition(db, _insert_rows, rows)
+
+
+def _insert_rows(db: Session, rows: List[dict]) -> Tuple[list, TouchedActivities]:
+    previous, rows = _prepare_write(db, rows)
+    return _insert_prepared(db, previous, rows)
+
+
+def _insert_prepared(
+    db: Session, previous: Sequence[Mapping], rows: List[dict], heatmap: Optional[HeatmapDeltas] = None
+) -> Tuple[list, TouchedActivities]:
+    return _write_upsert(db, _on_conflict_update(pg_insert(Activity).values(rows)), previous, rows, heatmap)
+
+
+async def _upsert_rows_async(db: AsyncSession, rows: List[dict]) -> Tuple[list, TouchedActivities]:
+    """``_upsert_rows`` for an async session, rasterising the heatmap change in a worker thread.
+
+    Only the statements run on the event loop; the previous routes are read
+    under the locks first, and the new and old routes are turned into heatmap
+    deltas off the loop before the writes.
+    """
+
+    start_times = [row["start_time"] for row in rows]
+
+    async def write() -> Tuple[list, TouchedActivities]:
+        previous, prepared = await db.run_sync(_prepare_write, rows)
+        heatmap = await asyncio.to_thread(_heatmap_deltas, previous, prepared)
+        return await db.run_sync(_insert_prepared, previous, prepared, heatmap)
+
+    await asyncio.to_thread(ensure_activity_partitions, start_times)
+    try:
+        async with db.begin_nested():
+            return await write()
+    except DBAPIError as exc:
+        if not is_missing_partition_error(exc):
+            raise
+        forget_activity_partitions(start_times)
+    await asyncio.to_thread(ensure_activity_partitions, start_times)
+    return await write()
+
+
+def _retry_detached_partition(
+    db: Session, write: Callable[[Session, List[dict]], Tuple[list, TouchedActivities]], rows: List[dict]
+) -> Tuple[list, TouchedActivities]:
+    """Create the partitions ``rows`` need, then run ``write(db, rows)``.
+
+    Partitions are created in their own short transaction, so this must run
+    before the caller's transaction touches activities. If a month's partition
+    was detached since this process saw it, the write is retried once with the
+    month forgotten and its partition recreated. The first attempt runs in a
+    savepoint, whose rollback also drops the locks it took on activities.
+    """
+
+    start_times = [row["start_time"] for row in rows]
+    ensure_activity_partitions(start_times)
+    try:
+        with db.begin_nested():
+            return write(db, rows)
+    except DBAPIError as exc:
+        if not is_missing_partition_error(exc):
+            raise
+        forget_activity_partitions(start_times)
+    ensure_activity_partitions(start_times)
+    return write(db, rows)
+
+
+_STAGING_TABLE = "activity_import_staging"
+_STAGING_COLUMNS = ("id", "external_id", *_UPSERT_COLUMNS)
+
+
+def _copy_value(value):
+    # COPY sends text, so geography values go as EWKT
+    if isinstance(value, WKTElement):
+        return f"SRID={value.srid};{value.data}"
+    return value
+
+
+def copy_upsert_rows(db: Session, rows: List[dict]) -> Tuple[list, TouchedActivities]:
+    """Like ``_upsert_rows``, but stages ``rows`` with ``COPY`` and merges them in one statement.
+
+    For large imports: COPY skips per-row parameter binding, and the merge is a
+    single ``INSERT ... SELECT ... ON CONFLICT`` from a temp table dropped at
+    commit, so call it once per transaction. ``rows`` must have distinct
+    external_ids. Does not commit.
+    """
+
+    return _retry_detached_partition(db, _copy_rows, rows)
+
+
+def _copy_rows(db: Session, rows: List[dict]) -> Tuple[list, TouchedActivities]:
+    previous, rows = _prepare_write(db, rows)
+
+    db.execute(
+        text(
+            f"CREATE TEMP TABLE {_STAGING_TABLE} ON COMMIT DROP AS "
+            f"SELECT {', '.join(_STAGING_COLUMNS)} FROM activities WITH NO DATA"
+        )
     )
-    db.add(activity)
+    raw = db.connection().connection.driver_connection
+    with raw.cursor() as cursor:
+        with cursor.copy(f"COPY {_STAGING_TABLE} ({', '.join(_STAGING_COLUMNS)}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row([_copy_value(row[column]) for column in _STAGING_COLUMNS])
+
+    staged = table(_STAGING_TABLE, *(column(name) for name in _STAGING_COLUMNS))
+    stmt = _on_conflict_update(pg_insert(Activity).from_select(list(_STAGING_COLUMNS), select(staged)))
+    return _write_upsert(db, stmt, previous, rows)
+
+
+def upsert_activity_from_webhook(db: Session, payload: Union[dict, ActivityCreate]) -> ActivityUpsertResult:
+    """Upsert one activity and commit.
+
+    A resent activity whose content hash matches the stored one is reported as
+    unchanged without building its route or writing anything.
+    """
+
+    # Routes that already validated the body pass the model through rather than re-validating every point
+    activity_data = payload if isinstance(payload, ActivityCreate) else ActivityCreate(**payload)
+    fields = _activity_fields(activity_data)
+
+    unchanged = _unchanged_activities(db, {activity_data.external_id: activity_content_hash(**fields)})
+    if unchanged:
+        return ActivityUpsertResult(
+            index=0, external_id=activity_data.external_id, id=unchanged[activity_data.external_id], status="unchanged"
+        )
+
+    written, touched = _upsert_rows(db, [build_activity_values(**fields)])
     db.commit()
-    db.refresh(activity)
-    return activity
+    invalidate_read_caches(touched)
+    row = written[0]
+    return ActivityUpsertResult(
+        index=0, external_id=row.external_id, id=row.id, status="created" if row.inserted else "updated"
+    )
+
+
+def _prepare_bulk_upsert(payloads: Sequence[dict]) -> Tuple[List[ActivityUpsertResult], List[Tuple[int, dict, str]]]:
+    """Validate ``payloads``, keyed back to their input index.
+
+    Returns the result list, pre-filled for invalid and superseded payloads,
+    and ``(index, build_activity_values fields, content hash)`` for the rest.
+    """
+
+    results: List[ActivityUpsertResult] = [None] * len(payloads)  # type: ignore[list-item]
+    pending: Dict[str, Tuple[int, dict, str]] = {}
+
+    for index, payload in enumerate(payloads):
+        external_id = payload.get("external_id") if isinstance(payload, dict) else None
+        try:
+            fields = _activity_fields(ActivityCreate(**payload))
+            content_hash = activity_content_hash(**fields)
+        except Exception as exc:
+            results[index] = ActivityUpsertResult(index=index, external_id=external_id, status="error", error=str(exc))
+            continue
+
+        # A statement can't touch the same conflict row twice, so the last payload for an external_id wins
+        previous = pending.pop(fields["external_id"], None)
+        if previous is not None:
+            results[previous[0]] = ActivityUpsertResult(
+                index=previous[0],
+                external_id=fields["external_id"],
+                status="duplicate",
+                error="superseded by a later item with the same external_id",
+            )
+        pending[fields["external_id"]] = (index, fields, content_hash)
+
+    return results, list(pending.values())
+
+
+def _skip_unchanged(
+    db: Session, results: List[ActivityUpsertResult], items: List[Tuple[int, dict, str]]
+) -> List[Tuple[int, dict, str]]:
+    """Report items whose stored content hash matches as unchanged; returns the items still to write."""
+
+    unchanged = _unchanged_activities(db, {fields["external_id"]: content_hash for _, fields, content_hash in items})
+    changed = []
+    for item in items:
+        index, fields, _ = item
+        activity_id = unchanged.get(fields["external_id"])
+        if activity_id is None:
+            changed.append(item)
+        else:
+            results[index] = ActivityUpsertResult(
+                index=index, external_id=fields["external_id"], id=activity_id, status="unchanged"
+            )
+    return changed
+
+
+def _build_rows(results: List[ActivityUpsertResult], items: List[Tuple[int, dict, str]]) -> List[Tuple[int, dict]]:
+    """Build the row values of ``items``, reporting those whose route can't be built."""
+
+    rows = []
+    for index, fields, _ in items:
+        try:
+            rows.append((index, build_activity_values(**fields)))
+        except Exception as exc:
+            results[index] = ActivityUpsertResult(
+                index=index, external_id=fields["external_id"], status="error", error=str(exc)
+            )
+    return rows
+
+
+def _chunk_error(index: int, values: dict, exc: Exception) -> ActivityUpsertResult:
+    error = str(exc.orig) if isinstance(exc, DBAPIError) else str(exc)
+    return ActivityUpsertResult(index=index, external_id=values["external_id"], status="error", error=error)
+
+
+def _record_written(results: List[ActivityUpsertResult], chunk: List[Tuple[int, dict]], rows: list) -> None:
+    index_by_external_id = {values["external_id"]: index for index, values in chunk}
+    for row in rows:
+        index = index_by_external_id[row.external_id]
+        results[index] = ActivityUpsertResult(
+            index=index,
+            external_id=row.external_id,
+            id=row.id,
+            status="created" if row.inserted else "updated",
+        )
+
+
+def bulk_upsert_activities(
+    db: Session,
+    payloads: Sequence[dict],
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+) -> List[ActivityUpsertResult]:
+    """Validate and upsert many activity payloads, one statement and commit per chunk.
+
+    Returns one result per input payload, in input order. Invalid payloads are
+    reported without aborting the batch; when a chunk is rejected (e.g. an
+    unknown user_id, or an activity stored in a detached month) its rows are
+    retried one by one so only the offending items fail. Payloads matching the stored content hash are
+    reported unchanged and never built or written.
+    """
+
+    results, items = _prepare_bulk_upsert(payloads)
+    items = _build_rows(results, _skip_unchanged(db, results, items))
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start : start + chunk_size]
+        try:
+            rows, touched = _upsert_rows(db, [values for _, values in chunk])
+            db.commit()
+        except (DBAPIError, DetachedActivityError):
+            db.rollback()
+            rows, touched = [], TouchedActivities()
+            for index, values in chunk:
+                try:
+                    with db.begin_nested():
+                        written, written_touched = _upsert_rows(db, [values])
+                    rows.extend(written)
+                    touched.update(written_touched)
+                except (DBAPIError, DetachedActivityError) as exc:
+                    results[index] = _chunk_error(index, values, exc)
+            db.commit()
+        invalidate_read_caches(touched)
+        _record_written(results, chunk, rows)
+
+    return results
+
 
+async def bulk_upsert_activities_async(
+    db: AsyncSession,
+    payloads: Sequence[dict],
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+) -> List[ActivityUpsertResult]:
+    """Async counterpart of :func:`bulk_upsert_activities` for ``async def`` callers.
 
-def list_activities(db: Session) -> List[Activity]:
-    return db.scalars(
-        select(Activity).order_by(Activity.start_time.desc())
-    ).all()
+    Validation, polyline decoding, simplification, fingerprinting and heatmap
+    rasterisation are CPU-bound and the cache clients are synchronous, so they
+    run in worker threads; only the statements run on the event loop, through
+    the async session's connection.
+    """
 
+    results, items = await asyncio.to_thread(_prepare_bulk_upsert, payloads)
+    items = await db.run_sync(_skip_unchanged, results, items)
+    items = await asyncio.to_thread(_build_rows, results, items)
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start : start + chunk_size]
+        try:
+            rows, touched = await _upsert_rows_async(db, [values for _, values in chunk])
+            await db.commit()
+        except (DBAPIError, DetachedActivityError):
+            await db.rollback()
+            rows, touched = [], TouchedActivities()
+            for index, values in chunk:
+                try:
+                    async with db.begin_nested():
+                        written, written_touched = await _upsert_rows_async(db, [values])
+                    rows.extend(written)
+                    touched.update(written_touched)
+                except (DBAPIError, DetachedActivityError) as exc:
+                    results[index] = _chunk_error(index, values, exc)
+            await db.commit()
+        await asyncio.to_thread(invalidate_read_caches, touched)
+        _record_written(results, chunk, rows)
 
+    return results
 
-def find_activities_nearby(db: Session, lat: float, lon: float, radius_meters: int) -> List[Activity]:
-    point_wkt = f"POINT({lon} {lat})"
+
+def encode_activity_cursor(activity: Activity) -> str:
+    """Encode the (start_time, id) keyset position of ``activity`` as an opaque cursor."""
+    raw = f"{activity.start_time.isoformat()}|{activity.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_activity_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        start_time, activity_id = raw.split("|", 1)
+        return datetime.fromisoformat(start_time), UUID(activity_id)
+    except ValueError as exc:
+        raise ValueError("Invalid activity cursor") from exc
+
+
+def list_activities(
+    db: Session,
+    *,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    user_id: Optional[UUID] = None,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[List[Activity], Optional[str]]:
+    """Return one page of activities, newest first, plus the cursor of the next page.
+
+    Pages are keyed on ``(start_time, id)`` so every page is a range scan on the
+    matching composite index instead of an OFFSET over the whole table.
+    """
+
+    stmt = select(Activity).options(defer(Activity.route))
+    if user_id is not None:
+        stmt = stmt.where(Activity.user_id == user_id)
+    if source is not None:
+        stmt = stmt.where(Activity.source == source)
+    if since is not None:
+        stmt = stmt.where(Activity.start_time >= since)
+    if until is not None:
+        stmt = stmt.where(Activity.start_time < until)
+    if cursor is not None:
+        cursor_time, cursor_id = decode_activity_cursor(cursor)
+        stmt = stmt.where(tuple_(Activity.start_time, Activity.id) < tuple_(cursor_time, cursor_id))
+
+    stmt = stmt.order_by(Activity.start_time.desc(), Activity.id.desc()).limit(limit + 1)
+    activities = list(db.scalars(stmt).all())
+
+    next_cursor = None
+    if len(activities) > limit:
+        activities = activities[:limit]
+        next_cursor = encode_activity_cursor(activities[-1])
+    return activities, next_cursor
+
+
+def get_activity_page(db: Session, query: ActivityListQuery) -> CacheEntry:
+    """Return the serialized ``ActivityPage`` for ``query`` through the read cache.
+
+    Entries are dropped by ``invalidate_read_caches`` after every activity
+    write, so a page can be cached for as long as ``READ_CACHE_TTL_SECONDS``.
+    """
+
+    def build() -> Rendered:
+        activities, next_cursor = list_activities(db, **query.model_dump())
+        page = ActivityPage(items=activities, next_cursor=next_cursor)
+        return Rendered(page.model_dump_json().encode(), READ_CACHE_TTL_SECONDS)
+
+    return cached_read(*activity_list_cache_keys(query.model_dump_json(), query.user_id), build)
+
+
+_METERS_PER_DEGREE_LAT = 111_320.0
+
+
+def find_activities_nearby(
+    db: Session,
+    lat: float,
+    lon: float,
+    radius_meters: int,
+    *,
+    limit: int = 100,
+    user_id: Optional[UUID] = None,
+    order: str = "recent",
+) -> List[Activity]:
+    """Return activities whose route passes within ``radius_meters`` of (lat, lon).
+
+    Geography ST_DWithin adds its own index-backed ``&&`` against the point's
+    box expanded by the radius, so candidates come from the GiST index. The
+    cheap coarse route copy then rules out near misses before the exact
+    ST_DWithin check on the full route. With ``order="nearest"`` results are
+    ordered by the ``<->`` KNN operator so the index returns them nearest-first.
+    """
+
+    point = func.ST_GeogFromText(f"SRID=4326;POINT({lon} {lat})")
+    # Routes are not part of ActivityRead, so don't ship them back for every match
     stmt = (
         select(Activity)
+        .options(defer(Activity.route))
         .where(
-            func.ST_DWithin(
-                Activity.route,
-                func.ST_GeogFromText(point_wkt),
-                radius_meters,
-            )
+            # The coarse copy is within its tolerance of the full route, so this never drops a true match
+            func.ST_DWithin(Activity.route_lod_low, point, radius_meters + lod_tolerance_meters("low")),
+            func.ST_DWithin(Activity.route, point, radius_meters),
+        )
+    )
+
+    if user_id is not None:
+        stmt = stmt.where(Activity.user_id == user_id)
+
+    if order == "nearest":
+        stmt = stmt.order_by(Activity.route.op("<->")(point))
+    else:
+        stmt = stmt.order_by(Activity.start_time.desc(), Activity.id.desc())
+
+    return db.scalars(stmt.limit(limit)).all()
+
+
+def get_activity_route_geojson(db: Session, activity_id: UUID, zoom: Optional[int] = None) -> Optional[Tuple[str, str]]:
+    """Return ``(lod, geometry GeoJSON)`` for an activity's route at the detail suited to ``zoom``.
+
+    Without a zoom the full-resolution route is returned. The GeoJSON is
+    produced by PostGIS so the route never goes through Python objects.
+    """
+
+    lod = lod_for_zoom(zoom) if zoom is not None else None
+    column = getattr(Activity, f"route_lod_{lod}") if lod else Activity.route
+    geojson = db.scalar(by_activity_ids(select(func.ST_AsGeoJSON(column)), [activity_id]))
+    if geojson is None:
+        return None
+    return lod or "full", geojson
+
+
+# Shapely's Hausdorff distance only measures between vertices; densifying
+# segments to quarters keeps long straight segments from hiding a deviation
+_HAUSDORFF_DENSIFY = 0.25
+
+
+def _local_meters(coords: np.ndarray, origin_lat: float) -> np.ndarray:
+    """Project lon/lat ``coords`` onto a plane in meters, accurate near ``origin_lat``."""
+
+    scale = _METERS_PER_DEGREE_LAT * np.array([math.cos(math.radians(origin_lat)), 1.0])
+    return coords * scale
+
+
+def find_similar_activities(
+    db: Session, activity_id: UUID, query: ActivitySimilarQuery
+) -> Optional[List[SimilarActivityRead]]:
+    """Return activities that follow the same route as ``activity_id``, closest first, or None if it is missing.
+
+    Candidates are the routes sharing at least one LSH band with it, found
+    through the GIN index on ``route_bands`` instead of comparing every route
+    (see app.geo.fingerprint). They are ranked by estimated cell overlap, and
+    only a short list of the best has its Hausdorff distance to the route
+    measured, on the ~1 m ``high`` copies.
+    """
+
+    target = db.execute(
+        by_activity_ids(
+            select(Activity.route_minhash, Activity.route_bands, func.ST_AsBinary(Activity.route_lod_high)),
+            [activity_id],
         )
-        .order_by(Activity.start_time.desc())
+    ).one_or_none()
+    if target is None:
+        return None
+    signature, bands, route = target
+
+    # Routes sharing more bands are likelier matches, so they survive the candidate cap.
+    # Each band hash includes its position, so comparing position by position counts them.
+    shared_bands = sum(case((Activity.route_bands[i + 1] == band, 1), else_=0) for i, band in enumerate(bands))
+    stmt = (
+        select(Activity.id, Activity.route_minhash)
+        .where(Activity.route_bands.overlap(bands), Activity.id != activity_id)
+        .order_by(shared_bands.desc())
+        .limit(SIMILAR_ROUTE_CANDIDATES)
     )
-    return db.scalars(stmt).all()
+    if query.user_id is not None:
+        stmt = stmt.where(Activity.user_id == query.user_id)
 
+    overlaps = {
+        candidate_id: overlap
+        for candidate_id, candidate_signature in db.execute(stmt)
+        if (overlap := estimated_overlap(signature, candidate_signature)) >= SIMILAR_ROUTE_MIN_OVERLAP
+    }
+    # Near-duplicates of the route can still fail the distance check, so measure a few more than asked for
+    shortlist = sorted(overlaps, key=overlaps.get, reverse=True)[: query.limit * 4]
+    if not shortlist:
+        return []
 
-def create_insight_report(db: Session, activity_id: UUID) -> InsightReport:
-    report = InsightReport(
-        activity_id=activity_id,
-        status=InsightStatusEnum.PENDING,
-        created_at=datetime.now(),
+    coords = shapely.get_coordinates(shapely.from_wkb(route))
+    origin_lat = float(coords[:, 1].mean())
+    line = LineString(_local_meters(coords, origin_lat))
+    matches = []
+    rows = db.execute(
+        by_activity_ids(
+            select(Activity, func.ST_AsBinary(Activity.route_lod_high)).options(defer(Activity.route)), shortlist
+        )
     )
-    db.add(report)
-    db.commit()
-    db.refresh(report)
-    return report
+    for activity, candidate_route in rows:
+        candidate = LineString(_local_meters(shapely.get_coordinates(shapely.from_wkb(candidate_route)), origin_lat))
+        distance = shapely.hausdorff_distance(line, candidate, densify=_HAUSDORFF_DENSIFY)
+        if distance <= query.max_hausdorff_meters:
+            matches.append(
+                SimilarActivityRead(
+                    **ActivityRead.model_validate(activity).model_dump(),
+                    hausdorff_meters=round(distance, 1),
+                    overlap=overlaps[activity.id],
+                )
+            )
+
+    matches.sort(key=lambda match: match.hausdorff_meters)
+    return matches[: query.limit]
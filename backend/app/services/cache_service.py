@@ -0,0 +1,141 @@
+import hashlib
+import os
+import time
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+import redis
+
+from app.db.redis_client import get_redis
+
+
+READ_CACHE_TTL_SECONDS = int(os.getenv("READ_CACHE_TTL_SECONDS", "300"))
+# DONE insight reports never change again, so they are kept much longer
+INSIGHT_DONE_CACHE_TTL_SECONDS = int(os.getenv("INSIGHT_DONE_CACHE_TTL_SECONDS", "604800"))
+
+_ACTIVITY_LISTS_GENERATION_KEY = "cache:activities:generation"
+
+
+class Rendered(NamedTuple):
+    """A freshly built response body and how long it may be cached."""
+
+    body: bytes
+    ttl: int
+    # Seconds clients may reuse the body without revalidating; 0 means revalidate every time
+    max_age: int = 0
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+    # Unix time, in whole seconds, the body last changed
+    modified_at: int
+    max_age: int
+
+
+def _etag(body: bytes) -> str:
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def cached_read(key: str, generation_key: str, build: Callable[[], Optional[Rendered]]) -> Optional[CacheEntry]:
+    """Return the body cached under ``key``, or ``build()`` it and cache it.
+
+    An entry is only served while the counter at ``generation_key`` still holds
+    the value it was built under, so invalidating is one INCR and a reader that
+    raced an invalidation can't bring a stale body back. ``build`` returning
+    None (nothing to serve) is not cached. Without Redis every read builds.
+    """
+
+    r = get_redis()
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.get(generation_key)
+        pipe.hgetall(key)
+        generation, entry = pipe.execute()
+    except redis.RedisError as exc:
+        print(f"Read cache unavailable, building {key} without it: {exc}")
+        rendered = build()
+        if rendered is None:
+            return None
+        return CacheEntry(rendered.body, _etag(rendered.body), int(time.time()), rendered.max_age)
+
+    generation = generation or b"0"
+    if entry and entry[b"generation"] == generation:
+        return CacheEntry(entry[b"body"], entry[b"etag"].decode(), int(entry[b"modified_at"]), int(entry[b"max_age"]))
+
+    rendered = build()
+    if rendered is None:
+        return None
+    etag = _etag(rendered.body)
+    if entry and entry[b"etag"].decode() == etag:
+        # Invalidated but unchanged: keep the old timestamp so If-Modified-Since still matches
+        modified_at = int(entry[b"modified_at"])
+    else:
+        # Strictly later than the body it replaces, so the two can't share a one-second Last-Modified
+        modified_at = max(int(time.time()), int(entry[b"modified_at"]) + 1 if entry else 0)
+    cached = CacheEntry(rendered.body, etag, modified_at, rendered.max_age)
+
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(
+            key,
+            mapping={
+                "body": cached.body,
+                "etag": cached.etag,
+                "modified_at": cached.modified_at,
+                "max_age": cached.max_age,
+                "generation": generation,
+            },
+        )
+        pipe.expire(key, rendered.ttl)
+        pipe.execute()
+    except redis.RedisError as exc:
+        print(f"Failed to cache {key}: {exc}")
+    return cached
+
+
+def _bump(generation_keys: Iterable[Tuple[str, Optional[int]]]) -> None:
+    """INCR each ``(generation key, entry ttl)``; a None ttl leaves the counter without expiry."""
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for key, ttl in generation_keys:
+            pipe.incr(key)
+            if ttl is not None:
+                # Outlive every entry built under an older value, or a reset counter could match one again
+                pipe.expire(key, 2 * ttl)
+        pipe.execute()
+    except redis.RedisError as exc:
+        print(f"Failed to invalidate read cache: {exc}")
+
+
+def insight_cache_keys(insight_id: UUID) -> Tuple[str, str]:
+    """(entry key, generation key) of a cached insight report."""
+
+    return f"cache:insight:{insight_id}", f"cache:insight:{insight_id}:generation"
+
+
+def invalidate_insights(insight_ids: Iterable) -> None:
+    """Drop cached insight reports. Call after the status write has committed."""
+
+    _bump((insight_cache_keys(insight_id)[1], INSIGHT_DONE_CACHE_TTL_SECONDS) for insight_id in insight_ids)
+
+
+def activity_list_cache_keys(query_key: str, user_id: Optional[UUID]) -> Tuple[str, str]:
+    """(entry key, generation key) of a cached activity listing.
+
+    A listing filtered to one user only goes stale when that user's activities
+    change; any other listing goes stale on every activity write.
+    """
+
+    entry_key = f"cache:activities:list:{hashlib.sha1(query_key.encode()).hexdigest()}"
+    if user_id is None:
+        return entry_key, _ACTIVITY_LISTS_GENERATION_KEY
+    return entry_key, f"cache:activities:user:{user_id}:generation"
+
+
+def invalidate_activity_lists(user_ids: Iterable[UUID]) -> None:
+    """Drop cached activity listings after activities of ``user_ids`` were written and committed."""
+
+    user_keys = [(activity_list_cache_keys("", user_id)[1], READ_CACHE_TTL_SECONDS) for user_id in set(user_ids)]
+    _bump([(_ACTIVITY_LISTS_GENERATION_KEY, None), *user_keys])
@@ -0,0 +1,126 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+from uuid import UUID
+from xml.sax.saxutils import escape
+
+from sqlalchemy import func, select
+
+from app.db.models import Activity
+from app.db.session import SessionLocal
+
+
+# Rows fetched per round trip of the server-side cursor
+EXPORT_FETCH_SIZE = int(os.getenv("ACTIVITY_EXPORT_FETCH_SIZE", "500"))
+# Encoded output is handed to the response in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Matches the precision routes are stored with
+_GEOJSON_DECIMALS = 7
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "geojson": "application/geo+json",
+    "gpx": "application/gpx+xml",
+}
+
+_GPX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<gpx version="1.1" creator="geo-activity-insights" xmlns="http://www.topografix.com/GPX/1/1">\n'
+)
+
+
+def _properties(row) -> Dict:
+    return {
+        "id": str(row.id),
+        "external_id": row.external_id,
+        "user_id": str(row.user_id),
+        "source": row.source,
+        "start_time": row.start_time.isoformat(),
+        "duration_seconds": row.duration_seconds,
+        "distance_meters": row.distance_meters,
+        "avg_heart_rate": row.avg_heart_rate,
+    }
+
+
+def _ndjson_row(row) -> str:
+    # The geometry is already GeoJSON from PostGIS; splice it in rather than parsing and re-encoding it
+    return f'{json.dumps(_properties(row))[:-1]},"route":{row.geometry}}}\n'
+
+
+def _geojson_row(row) -> str:
+    return f'{{"type":"Feature","geometry":{row.geometry},"properties":{json.dumps(_properties(row))}}}'
+
+
+def _gpx_row(row) -> str:
+    (first_lon, first_lat), *rest = json.loads(row.geometry)["coordinates"]
+    # Only the start time is known, so it goes on the first point where importers look for it
+    points = f'<trkpt lat="{first_lat}" lon="{first_lon}"><time>{row.start_time.isoformat()}Z</time></trkpt>'
+    points += "".join(f'<trkpt lat="{lat}" lon="{lon}"/>' for lon, lat in rest)
+    return (
+        f"<trk><name>{escape(row.external_id)}</name><type>{escape(row.source)}</type>"
+        f"<trkseg>{points}</trkseg></trk>\n"
+    )
+
+
+# format -> (prefix, row encoder, separator, suffix)
+_FORMATS: Dict[str, tuple] = {
+    "ndjson": ("", _ndjson_row, "", ""),
+    "geojson": ('{"type":"FeatureCollection","features":[', _geojson_row, ",", "]}\n"),
+    "gpx": (_GPX_HEADER, _gpx_row, "", "</gpx>\n"),
+}
+
+
+def stream_activity_export(
+    fmt: str,
+    *,
+    user_id: Optional[UUID] = None,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[str]:
+    """Yield ``fmt``-encoded activities, newest first, in ~64 KiB chunks.
+
+    Rows come from a server-side cursor, ``EXPORT_FETCH_SIZE`` at a time, with
+    routes encoded by ``ST_AsGeoJSON`` in the database, so memory stays flat
+    however many activities match. The generator opens its own session because
+    it outlives the request handler that returns the streaming response.
+    """
+
+    prefix, encode_row, separator, suffix = _FORMATS[fmt]
+
+    stmt = select(
+        Activity.id,
+        Activity.external_id,
+        Activity.user_id,
+        Activity.source,
+        Activity.start_time,
+        Activity.duration_seconds,
+        Activity.distance_meters,
+        Activity.avg_heart_rate,
+        func.ST_AsGeoJSON(Activity.route, _GEOJSON_DECIMALS).label("geometry"),
+    )
+    if user_id is not None:
+        stmt = stmt.where(Activity.user_id == user_id)
+    if source is not None:
+        stmt = stmt.where(Activity.source == source)
+    if since is not None:
+        stmt = stmt.where(Activity.start_time >= since)
+    if until is not None:
+        stmt = stmt.where(Activity.start_time < until)
+    # Same order as list_activities, so the scan follows the (start_time, id) indexes
+    stmt = stmt.order_by(Activity.start_time.desc(), Activity.id.desc())
+
+    buffer = [prefix]
+    size = len(prefix)
+    with SessionLocal() as db:
+        result = db.execute(stmt.execution_options(yield_per=EXPORT_FETCH_SIZE))
+        for i, row in enumerate(result):
+            encoded = (separator if i else "") + encode_row(row)
+            buffer.append(encoded)
+            size += len(encoded)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield "".join(buffer)
+                buffer, size = [], 0
+    buffer.append(suffix)
+    yield "".join(buffer)
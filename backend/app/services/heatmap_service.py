@@ -0,0 +1,157 @@
+from typing import Iterable, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from app.db.models import HeatmapCell, HeatmapTotalCell
+from app.geo.heatmap import heatmap_zoom_for, route_cells
+from app.geo.tiles import tile_range_for_bounds
+from app.schemas.heatmap import HeatmapCellRead, HeatmapRead
+
+
+# Refuse reads that would return more cells than a client could reasonably draw
+HEATMAP_MAX_CELLS = 250_000
+
+_APPLY_DELTAS_SQL = text(
+    """
+    INSERT INTO heatmap_cells (user_id, zoom, x, y, visits)
+    SELECT * FROM unnest(
+        CAST(:user_ids AS uuid[]),
+        CAST(:zooms AS smallint[]),
+        CAST(:xs AS integer[]),
+        CAST(:ys AS integer[]),
+        CAST(:visits AS integer[])
+    )
+    ON CONFLICT (user_id, zoom, x, y) DO UPDATE SET visits = heatmap_cells.visits + excluded.visits
+    """
+)
+
+_APPLY_TOTAL_DELTAS_SQL = text(
+    """
+    INSERT INTO heatmap_total_cells (zoom, x, y, visits)
+    SELECT * FROM unnest(
+        CAST(:zooms AS smallint[]),
+        CAST(:xs AS integer[]),
+        CAST(:ys AS integer[]),
+        CAST(:visits AS integer[])
+    )
+    ON CONFLICT (zoom, x, y) DO UPDATE SET visits = heatmap_total_cells.visits + excluded.visits
+    """
+)
+
+
+# Parameters for the heatmap_cells and heatmap_total_cells upserts; None when there is nothing to write
+HeatmapDeltas = Tuple[Optional[dict], Optional[dict]]
+
+
+def heatmap_deltas(
+    removed: Iterable[Tuple[UUID, np.ndarray]] = (),
+    added: Iterable[Tuple[UUID, np.ndarray]] = (),
+) -> HeatmapDeltas:
+    """Rasterise route changes and net them into per-cell deltas, without touching the database.
+
+    ``removed`` holds ``(user_id, lon/lat coords)`` for the previous routes of
+    activities being updated and ``added`` the same for their new routes. Each
+    activity counts once per cell it touches; deltas are netted per cell, so a
+    route that didn't change contributes nothing. CPU-bound, so async callers
+    run it in a worker thread and pass the result to ``write_heatmap_deltas``.
+    """
+
+    users = []
+    parts = []
+    for sign, routes in ((-1, removed), (1, added)):
+        for user_id, coords in routes:
+            users.append(user_id)
+            for zoom, cells in route_cells(coords).items():
+                part = np.empty((len(cells), 5), dtype=np.int64)
+                part[:, 0] = len(users) - 1
+                part[:, 1] = zoom
+                part[:, 2:4] = cells
+                part[:, 4] = sign
+                parts.append(part)
+    if not parts:
+        return None, None
+
+    rows = np.concatenate(parts)
+    # Map user ids to ranks of their string form so sorted keys give concurrent writers one lock order
+    user_keys = sorted(set(map(str, users)))
+    rank_of = {key: i for i, key in enumerate(user_keys)}
+    rank = np.array([rank_of[str(user_id)] for user_id in users], dtype=np.int64)
+    rows[:, 0] = rank[rows[:, 0]]
+
+    keys, inverse = np.unique(rows[:, :4], axis=0, return_inverse=True)
+    visits = np.bincount(inverse.ravel(), weights=rows[:, 4], minlength=len(keys)).astype(np.int64)
+    changed = visits != 0
+    keys, visits = keys[changed], visits[changed]
+    if not len(keys):
+        return None, None
+
+    user_params = {
+        "user_ids": [user_keys[i] for i in keys[:, 0]],
+        "zooms": keys[:, 1].tolist(),
+        "xs": keys[:, 2].tolist(),
+        "ys": keys[:, 3].tolist(),
+        "visits": visits.tolist(),
+    }
+
+    # Same netting over (zoom, x, y) alone; unique keys come back sorted, so writers lock totals in one order
+    cells, inverse = np.unique(keys[:, 1:4], axis=0, return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=visits, minlength=len(cells)).astype(np.int64)
+    changed = totals != 0
+    cells, totals = cells[changed], totals[changed]
+    if not len(cells):
+        return user_params, None
+    return user_params, {
+        "zooms": cells[:, 0].tolist(),
+        "xs": cells[:, 1].tolist(),
+        "ys": cells[:, 2].tolist(),
+        "visits": totals.tolist(),
+    }
+
+
+def write_heatmap_deltas(db: Session, deltas: HeatmapDeltas) -> None:
+    """Apply ``heatmap_deltas`` output: one upsert into heatmap_cells and one into heatmap_total_cells, no commit."""
+
+    user_params, total_params = deltas
+    if user_params is not None:
+        db.execute(_APPLY_DELTAS_SQL, user_params)
+    if total_params is not None:
+        db.execute(_APPLY_TOTAL_DELTAS_SQL, total_params)
+
+
+def get_heatmap(
+    db: Session,
+    zoom: int,
+    bounds: Tuple[float, float, float, float],
+    user_id: Optional[UUID] = None,
+) -> HeatmapRead:
+    """Return visit counts for the grid cells inside lon/lat ``bounds``.
+
+    Reads the finest stored grid level not deeper than ``zoom``; without a
+    user_id the counts come from the precomputed all-users totals.
+    """
+
+    grid_zoom = heatmap_zoom_for(zoom)
+    min_x, min_y, max_x, max_y = tile_range_for_bounds(bounds, grid_zoom)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > HEATMAP_MAX_CELLS:
+        raise ValueError("Bounding box covers too many cells at this zoom")
+
+    cell = HeatmapTotalCell if user_id is None else HeatmapCell
+    stmt = (
+        select(cell.x, cell.y, cell.visits)
+        .where(
+            cell.zoom == grid_zoom,
+            cell.x.between(min_x, max_x),
+            cell.y.between(min_y, max_y),
+            # Cells a route has since moved away from stay behind at zero
+            cell.visits > 0,
+        )
+        .order_by(cell.x, cell.y)
+    )
+    if user_id is not None:
+        stmt = stmt.where(HeatmapCell.user_id == user_id)
+
+    cells = [HeatmapCellRead(x=row.x, y=row.y, visits=row.visits) for row in db.execute(stmt)]
+    return HeatmapRead(zoom=grid_zoom, user_id=user_id, cells=cells)
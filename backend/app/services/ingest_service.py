@@ -0,0 +1,27 @@
+import os
+
+from app.db.redis_client import get_redis
+from app.schemas.activity import ActivityCreate
+
+
+# "sync" writes each webhook before answering; "write-behind" validates it, appends it to
+# INGEST_STREAM_KEY and answers 202, leaving the write to the ingest consumer (worker/ingest.py)
+WEBHOOK_INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "sync")
+INGEST_STREAM_KEY = os.getenv("INGEST_STREAM_KEY", "activity_ingest_stream")
+INGEST_CONSUMER_GROUP = os.getenv("INGEST_CONSUMER_GROUP", "activity_ingesters")
+INGEST_DEAD_LETTER_KEY = os.getenv("INGEST_DEAD_LETTER_KEY", "activity_ingest_dead")
+
+
+def write_behind_enabled() -> bool:
+    return WEBHOOK_INGEST_MODE == "write-behind"
+
+
+def enqueue_activity(payload: ActivityCreate) -> str:
+    """Append a validated webhook payload to the ingest stream; returns its stream entry id.
+
+    Entries are only removed once the consumer has written them, so with
+    Redis persistence on (appendonly) an accepted payload survives restarts.
+    """
+    r = get_redis()
+    return r.xadd(INGEST_STREAM_KEY, {"payload": payload.model_dump_json()}).decode()
+
@@ -1,30 +1,282 @@
+import asyncio
+import hashlib
 import json
 import os
-from typing import Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
 from uuid import UUID
 
 import redis
-from sqlalchemy import select
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
-from app.db.models import InsightReport
+from app.db.models import Activity, InsightReport, InsightStatusEnum
+from app.db.redis_client import get_async_redis, get_redis
+from app.db.session import SessionLocal
+from app.schemas.insight import InsightRead
+from app.schemas.stats import UserStatsRead
+from app.services.cache_service import (
+    INSIGHT_DONE_CACHE_TTL_SECONDS,
+    READ_CACHE_TTL_SECONDS,
+    CacheEntry,
+    Rendered,
+    cached_read,
+    insight_cache_keys,
+    invalidate_insights,
+)
+from app.services.stats_service import get_user_stats
 
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-QUEUE_KEY = os.getenv("INSIGHT_QUEUE_KEY", "insight_jobs")
+# Jobs live in a Redis stream read through a consumer group, so a job is only
+# removed once a worker has ACKed it and crashed workers' jobs can be reclaimed.
+STREAM_KEY = os.getenv("INSIGHT_STREAM_KEY", "insight_jobs_stream")
+CONSUMER_GROUP = os.getenv("INSIGHT_CONSUMER_GROUP", "insight_workers")
+DEAD_LETTER_KEY = os.getenv("INSIGHT_DEAD_LETTER_KEY", "insight_jobs_dead")
+# Pub/sub channel the worker announces every report status change on
+STATUS_CHANNEL = os.getenv("INSIGHT_STATUS_CHANNEL", "insight_status")
+# Idle event streams get a comment this often, and re-read the report in case an announcement was lost
+INSIGHT_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("INSIGHT_EVENTS_HEARTBEAT_SECONDS", "15"))
+# Event streams end after this long; EventSource clients reconnect on their own
+INSIGHT_EVENTS_MAX_SECONDS = float(os.getenv("INSIGHT_EVENTS_MAX_SECONDS", "300"))
 
+# Rolling window the summary describes
+INSIGHT_CONTEXT_DAYS = 7
+# Bump whenever the summary generator changes so cached summaries stop matching
+INSIGHT_GENERATOR_VERSION = "mock-llm-1"
 
-def _get_redis() -> redis.Redis:
-    return redis.from_url(REDIS_URL)
+_IN_FLIGHT_STATUSES = (InsightStatusEnum.PENDING, InsightStatusEnum.PROCESSING)
+FINAL_STATUSES = (InsightStatusEnum.DONE, InsightStatusEnum.FAILED)
 
 
 def enqueue_insight_job(report_id: UUID) -> None:
-    r = _get_redis()
-    job = {"insight_id": str(report_id)}
-    r.rpush(QUEUE_KEY, json.dumps(job))
+    r = get_redis()
+    r.xadd(STREAM_KEY, {"insight_id": str(report_id)})
 
 
 def get_insight(db: Session, insight_id: UUID) -> Optional[InsightReport]:
     return db.scalars(
         select(InsightReport).where(InsightReport.id == insight_id)
     ).one_or_none()
+
+
+def get_insight_entry(db: Session, insight_id: UUID) -> Optional[CacheEntry]:
+    """Return the serialized ``InsightRead`` for ``insight_id`` through the read cache, or None if missing.
+
+    DONE reports never change, so they are cached for a week and clients may
+    reuse them without revalidating. Reports still in flight are cached too
+    (the frontend polls them) and dropped whenever the worker writes a new
+    status.
+    """
+
+    def build() -> Optional[Rendered]:
+        insight = get_insight(db, insight_id)
+        if insight is None:
+            return None
+        body = InsightRead.model_validate(insight).model_dump_json().encode()
+        if insight.status == InsightStatusEnum.DONE:
+            return Rendered(body, INSIGHT_DONE_CACHE_TTL_SECONDS, max_age=INSIGHT_DONE_CACHE_TTL_SECONDS)
+        return Rendered(body, READ_CACHE_TTL_SECONDS)
+
+    return cached_read(*insight_cache_keys(insight_id), build)
+
+
+async def read_insight_entry(insight_id: UUID) -> Optional[CacheEntry]:
+    """``get_insight_entry`` for async handlers that hold no session, run in a worker thread."""
+
+    def read() -> Optional[CacheEntry]:
+        with SessionLocal() as db:
+            return get_insight_entry(db, insight_id)
+
+    return await asyncio.to_thread(read)
+
+
+def entry_status(entry: CacheEntry) -> str:
+    return json.loads(entry.body)["status"]
+
+
+def notify_insight_status(changes: Iterable[Tuple[UUID, str]]) -> None:
+    """Announce committed ``(report id, status)`` changes.
+
+    The cached reports are dropped first, so a subscriber that re-reads on the
+    announcement can't be served the previous status.
+    """
+
+    changes = list(changes)
+    if not changes:
+        return
+    invalidate_insights(report_id for report_id, _ in changes)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for report_id, status in changes:
+            pipe.publish(STATUS_CHANNEL, json.dumps({"id": str(report_id), "status": status}))
+        pipe.execute()
+    except redis.RedisError as exc:
+        # Subscribers fall back to re-reading the report on their heartbeat
+        print(f"Failed to publish insight status: {exc}")
+
+
+class InsightStatusListener:
+    """One Redis subscription per API process, fanned out to every request waiting on a report.
+
+    Each waiting request registers an ``asyncio.Event`` for its report id and
+    holds no Redis connection of its own. While Redis is unreachable every
+    waiter is woken once per retry, so callers fall back to re-reading.
+    """
+
+    RETRY_SECONDS = 1.0
+
+    def __init__(self) -> None:
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._subscribed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _wake(self, insight_id: Optional[str] = None) -> None:
+        if insight_id is None:
+            waiters = [event for events in self._waiters.values() for event in events]
+        else:
+            waiters = self._waiters.get(insight_id, ())
+        for event in waiters:
+            event.set()
+
+    async def _run(self) -> None:
+        while True:
+            pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(STATUS_CHANNEL)
+                self._subscribed.set()
+                # Changes published while we were (re)connecting were missed; let everyone re-read
+                self._wake()
+                async for message in pubsub.listen():
+                    try:
+                        self._wake(json.loads(message["data"])["id"])
+                    except (ValueError, KeyError, TypeError):
+                        print(f"Ignoring malformed insight status message {message['data']!r}")
+            except redis.RedisError as exc:
+                print(f"Insight status subscription lost, retrying: {exc}")
+            finally:
+                self._subscribed.clear()
+                await pubsub.aclose()
+            self._wake()
+            await asyncio.sleep(self.RETRY_SECONDS)
+
+    @asynccontextmanager
+    async def watch(self, insight_id: UUID) -> AsyncIterator[asyncio.Event]:
+        """Yield an event that is set whenever ``insight_id`` may have changed.
+
+        Read the report only after entering, so a change between the read and
+        the wait can't be missed. Clear the event before each re-read.
+        """
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            # First use, or a new event loop (e.g. a test client); the old loop's state can't be reused
+            self._subscribed = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=self.RETRY_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+        event = asyncio.Event()
+        key = str(insight_id)
+        self._waiters.setdefault(key, set()).add(event)
+        try:
+            yield event
+        finally:
+            self._waiters[key].discard(event)
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+
+insight_status_listener = InsightStatusListener()
+
+
+def compute_insight_input_hash(activity: Activity, recent: UserStatsRead) -> str:
+    """Hash everything a summary is generated from.
+
+    Two reports with the same hash would get the same summary, so a stored DONE
+    summary can be reused instead of calling the LLM again. The activity and its
+    owner are part of the hash, so a summary is only ever reused for the same
+    activity. The whole rolling context is hashed, not just the fields today's
+    prompt reads.
+    """
+
+    inputs = {
+        "generator": INSIGHT_GENERATOR_VERSION,
+        "activity_id": str(activity.id),
+        "user_id": str(activity.user_id),
+        "source": activity.source,
+        "start_time": activity.start_time.isoformat(),
+        "duration_seconds": activity.duration_seconds,
+        "distance_meters": activity.distance_meters,
+        "avg_heart_rate": activity.avg_heart_rate,
+        "context": recent.model_dump(mode="json"),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def find_done_insight_by_hash(db: Session, activity_id: UUID, input_hash: str) -> Optional[InsightReport]:
+    """Return the latest DONE report of ``activity_id`` generated from ``input_hash``, if any."""
+    return db.scalars(
+        select(InsightReport)
+        .where(
+            InsightReport.activity_id == activity_id,
+            InsightReport.input_hash == input_hash,
+            InsightReport.status == InsightStatusEnum.DONE,
+        )
+        .order_by(InsightReport.created_at.desc())
+        .limit(1)
+    ).first()
+
+
+def request_insight_report(db: Session, activity: Activity) -> Tuple[InsightReport, bool]:
+    """Return the report that will answer an insight request for ``activity``.
+
+    The second element is True only when a new PENDING report was created and
+    still needs a job enqueued. Otherwise the caller gets either this
+    activity's DONE report computed from identical inputs or the report already
+    in flight for it, so duplicate clicks and retries don't add worker load.
+    """
+
+    recent = get_user_stats(db, activity.user_id, days=INSIGHT_CONTEXT_DAYS)
+    input_hash = compute_insight_input_hash(activity, recent)
+
+    cached = find_done_insight_by_hash(db, activity.id, input_hash)
+    if cached is not None:
+        return cached, False
+
+    for _ in range(3):
+        # The partial unique index on in-flight reports makes this insert single-flight
+        stmt = (
+            pg_insert(InsightReport)
+            .values(
+                activity_id=activity.id,
+                status=InsightStatusEnum.PENDING,
+                input_hash=input_hash,
+                created_at=datetime.now(),
+            )
+            .on_conflict_do_nothing(
+                index_elements=[InsightReport.activity_id],
+                # Literal predicate: Postgres can't match a partial index against bound parameters
+                index_where=text("status IN ('pending', 'processing')"),
+            )
+            .returning(InsightReport)
+        )
+        report = db.scalars(stmt).one_or_none()
+        db.commit()
+        if report is not None:
+            return report, True
+
+        in_flight = db.scalars(
+            select(InsightReport).where(
+                InsightReport.activity_id == activity.id,
+                InsightReport.status.in_(_IN_FLIGHT_STATUSES),
+            )
+        ).one_or_none()
+        if in_flight is not None:
+            return in_flight, False
+        # The in-flight report finished between the insert and the lookup; try again
+
+    raise RuntimeError(f"Could not create or find an insight report for activity {activity.id}")
@@ -0,0 +1,132 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.db.models import UserDailyStats
+from app.schemas.stats import UserDailyStatsRead, UserStatsRead
+
+
+_STAT_COLUMNS = ("activity_count", "distance_meters", "duration_seconds", "heart_rate_sum", "heart_rate_count")
+
+
+def _contribution(activity: Mapping) -> Tuple[int, int, int, int, int]:
+    heart_rate = activity["avg_heart_rate"]
+    return (
+        1,
+        activity["distance_meters"],
+        activity["duration_seconds"],
+        heart_rate or 0,
+        1 if heart_rate is not None else 0,
+    )
+
+
+def apply_activity_deltas(
+    db: Session,
+    removed: Iterable[Mapping] = (),
+    added: Iterable[Mapping] = (),
+) -> None:
+    """Fold activity writes into user_daily_stats without committing.
+
+    ``removed`` holds the previous values of activities being updated or deleted
+    and ``added`` their new values; each needs user_id, start_time,
+    distance_meters, duration_seconds and avg_heart_rate. Deltas are netted per
+    (user, day) and applied as atomic increments in a single upsert.
+    """
+
+    deltas: Dict[Tuple[UUID, date], List[int]] = defaultdict(lambda: [0] * len(_STAT_COLUMNS))
+    for sign, activities in ((-1, removed), (1, added)):
+        for activity in activities:
+            totals = deltas[(activity["user_id"], activity["start_time"].date())]
+            for i, value in enumerate(_contribution(activity)):
+                totals[i] += sign * value
+
+    # Sorted keys give concurrent writers a consistent row-lock order
+    rows = [
+        {"user_id": user_id, "day": day, **dict(zip(_STAT_COLUMNS, totals))}
+        for (user_id, day), totals in sorted(deltas.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+        if any(totals)
+    ]
+    if not rows:
+        return
+
+    stmt = pg_insert(UserDailyStats).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserDailyStats.user_id, UserDailyStats.day],
+        set_={column: getattr(UserDailyStats, column) + stmt.excluded[column] for column in _STAT_COLUMNS},
+    )
+    db.execute(stmt)
+
+
+def _window_start(days: int) -> date:
+    # Days are bucketed from start_time, which is stored as naive UTC, so "today" is the UTC date
+    return datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+
+
+def _build_stats(
+    user_id: UUID,
+    days: int,
+    activity_count: int,
+    distance_meters: int,
+    duration_seconds: int,
+    heart_rate_sum: int,
+    heart_rate_count: int,
+    daily: Sequence[UserDailyStatsRead] = (),
+) -> UserStatsRead:
+    return UserStatsRead(
+        user_id=user_id,
+        days=days,
+        since=_window_start(days),
+        activity_count=activity_count,
+        distance_meters=distance_meters,
+        duration_seconds=duration_seconds,
+        avg_distance_meters=distance_meters / activity_count if activity_count else 0.0,
+        avg_heart_rate=heart_rate_sum / heart_rate_count if heart_rate_count else None,
+        daily=list(daily),
+    )
+
+
+def get_user_stats(db: Session, user_id: UUID, days: int = 7, include_daily: bool = False) -> UserStatsRead:
+    """Aggregate the last ``days`` calendar days (including today) from the rollup table."""
+
+    daily = db.scalars(
+        select(UserDailyStats)
+        .where(UserDailyStats.user_id == user_id, UserDailyStats.day >= _window_start(days))
+        .order_by(UserDailyStats.day)
+    ).all()
+
+    return _build_stats(
+        user_id,
+        days,
+        *(sum(getattr(d, column) for d in daily) for column in _STAT_COLUMNS),
+        daily=[UserDailyStatsRead.model_validate(d) for d in daily if d.activity_count] if include_daily else (),
+    )
+
+
+def get_users_stats(db: Session, user_ids: Iterable[UUID], days: int = 7) -> Dict[UUID, UserStatsRead]:
+    """Rolling totals for several users with one grouped query.
+
+    Users without rollup rows in the window get zeroed stats.
+    """
+
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+
+    rows = db.execute(
+        select(
+            UserDailyStats.user_id,
+            *(func.sum(getattr(UserDailyStats, column)) for column in _STAT_COLUMNS),
+        )
+        .where(UserDailyStats.user_id.in_(user_ids), UserDailyStats.day >= _window_start(days))
+        .group_by(UserDailyStats.user_id)
+    ).all()
+
+    stats = {user_id: _build_stats(user_id, days, 0, 0, 0, 0, 0) for user_id in user_ids}
+    for user_id, *totals in rows:
+        stats[user_id] = _build_stats(user_id, days, *(int(total) for total in totals))
+    return stats
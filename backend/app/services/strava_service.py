@@ -1,92 +1,398 @@
 from __future__ import annotations
 
+import asyncio
+import math
 import os
+import random
 import time
-from typing import Any, Dict, List
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from uuid import UUID
 
 import httpx
-from sqlalchemy import select
+import redis
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db.models import Activity, StravaAccount, User
-from app.services.activity_service import upsert_activity_from_webhook
+from app.db.models import StravaAccount, User
+from app.db.redis_client import get_async_redis
+from app.services.activity_service import bulk_upsert_activities_async
 
 
-STRAVA_API_BASE = "https://www.strava.com/api/v3"
+# Overridable so imports can be exercised against a local mock server
+STRAVA_API_BASE = os.getenv("STRAVA_API_BASE", "https://www.strava.com/api/v3")
+STRAVA_OAUTH_TOKEN_URL = os.getenv("STRAVA_OAUTH_TOKEN_URL", "https://www.strava.com/oauth/token")
+STRAVA_TIMEOUT_SECONDS = float(os.getenv("STRAVA_TIMEOUT_SECONDS", "20"))
+# Connections kept to Strava by the shared client; over HTTP/2 one connection carries many requests
+STRAVA_MAX_CONNECTIONS = int(os.getenv("STRAVA_MAX_CONNECTIONS", "20"))
+# Retries of transient failures per request, waiting STRAVA_RETRY_BACKOFF_SECONDS * 2^attempt (jittered)
+STRAVA_MAX_RETRIES = int(os.getenv("STRAVA_MAX_RETRIES", "3"))
+STRAVA_RETRY_BACKOFF_SECONDS = float(os.getenv("STRAVA_RETRY_BACKOFF_SECONDS", "0.5"))
+# How long one process may hold an account's token refresh before the Redis lock lapses
+TOKEN_REFRESH_LOCK_SECONDS = float(os.getenv("STRAVA_TOKEN_REFRESH_LOCK_SECONDS", "60"))
+# Tokens this close to expiry are refreshed before use
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+RATE_LIMIT_WINDOW_SECONDS = 15 * 60
 
+_RETRY_STATUSES = (500, 502, 503, 504)
+_IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
 
-def upsert_strava_account(db: Session, token_payload: Dict[str, Any]) -> StravaAccount:
-    athlete = token_payload["athlete"]
-    athlete_id = int(athlete["id"])
-
-    existing: StravaAccount | None = db.scalars(
-        select(StravaAccount).where(StravaAccount.athlete_id == athlete_id)
-    ).one_or_none()
-
-    if existing:
-        existing.access_token = token_payload["access_token"]
-        existing.refresh_token = token_payload["refresh_token"]
-        existing.expires_at = int(token_payload["expires_at"])
-        db.add(existing)
-        db.commit()
-        db.refresh(existing)
-        return existing
-
-    # Create a synthetic user for this Strava athlete if one does not exist yet
-    email = f"strava_{athlete_id}@example.com"
-    user = db.scalars(select(User).where(User.email == email)).one_or_none()
-    if not user:
-        user = User(email=email)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-
-    account = StravaAccount(
-        user_id=user.id,
-        athlete_id=athlete_id,
-        access_token=token_payload["access_token"],
-        refresh_token=token_payload["refresh_token"],
-        expires_at=int(token_payload["expires_at"]),
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+# One lock per account, so concurrent imports in this process refresh a token once
+_refresh_locks: Dict[UUID, asyncio.Lock] = {}
+
+
+def get_strava_client() -> httpx.AsyncClient:
+    """Return the process-wide HTTP/2 client for Strava, so calls reuse warm connections.
+
+    Closed by ``close_strava_client`` when the app shuts down.
+    """
+
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        # First use, or a new event loop (e.g. a test client); connections can't move between loops
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=STRAVA_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=STRAVA_MAX_CONNECTIONS, max_keepalive_connections=STRAVA_MAX_CONNECTIONS
+            ),
+        )
+        _http_client_loop = loop
+    return _http_client
+
+
+async def close_strava_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def strava_request(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """Send a request over the shared client, retrying transient failures with exponential backoff.
+
+    Failures to connect are retried for any method, as the request never left.
+    Timeouts, dropped connections and 5xx responses are retried only for
+    idempotent methods, so a token exchange or refresh is never sent twice.
+    429s are returned as-is for the caller's rate limiter to handle.
+    """
+
+    idempotent = method.upper() in _IDEMPOTENT_METHODS
+    for attempt in range(STRAVA_MAX_RETRIES):
+        try:
+            resp = await get_strava_client().request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            pass
+        except httpx.TransportError:
+            if not idempotent:
+                raise
+        else:
+            if not idempotent or resp.status_code not in _RETRY_STATUSES:
+                return resp
+        await asyncio.sleep(STRAVA_RETRY_BACKOFF_SECONDS * 2**attempt * random.uniform(0.5, 1.5))
+    return await get_strava_client().request(method, url, **kwargs)
+
+
+def _strava_account_values(token_payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """The athlete id and token columns from an OAuth token payload."""
+    tokens = {
+        "access_token": token_payload["access_token"],
+        "refresh_token": token_payload["refresh_token"],
+        "expires_at": int(token_payload["expires_at"]),
+    }
+    return int(token_payload["athlete"]["id"]), tokens
+
+
+def _user_upsert(athlete_id: int):
+    # Synthetic user per Strava athlete; the no-op update makes RETURNING yield the existing row too
+    stmt = pg_insert(User).values(email=f"strava_{athlete_id}@example.com")
+    return stmt.on_conflict_do_update(index_elements=[User.email], set_={"email": stmt.excluded.email}).returning(
+        User.id
     )
-    db.add(account)
+
+
+def _account_upsert(user_id: UUID, athlete_id: int, tokens: Dict[str, Any]):
+    # An existing account keeps its user and sync watermark; only the tokens change
+    stmt = pg_insert(StravaAccount).values(user_id=user_id, athlete_id=athlete_id, **tokens)
+    return stmt.on_conflict_do_update(
+        index_elements=[StravaAccount.athlete_id], set_={name: stmt.excluded[name] for name in tokens}
+    ).returning(StravaAccount)
+
+
+def upsert_strava_account(db: Session, token_payload: Dict[str, Any]) -> StravaAccount:
+    """Store the tokens for the payload's athlete, creating the account and a synthetic user on first sight.
+
+    One ``INSERT ... ON CONFLICT ... RETURNING`` per table and a single commit.
+    """
+
+    athlete_id, tokens = _strava_account_values(token_payload)
+    user_id = db.execute(_user_upsert(athlete_id)).scalar_one()
+    account = db.scalars(
+        _account_upsert(user_id, athlete_id, tokens), execution_options={"populate_existing": True}
+    ).one()
     db.commit()
-    db.refresh(account)
     return account
 
 
-async def _ensure_valid_access_token(db: Session, account: StravaAccount) -> StravaAccount:
-    """Refresh access token if expired. For now we refresh when expired or about to expire."""
+async def upsert_strava_account_async(db: AsyncSession, token_payload: Dict[str, Any]) -> StravaAccount:
+    """Async counterpart of :func:`upsert_strava_account` for ``async def`` callers."""
+
+    athlete_id, tokens = _strava_account_values(token_payload)
+    user_id = (await db.execute(_user_upsert(athlete_id))).scalar_one()
+    account = (
+        await db.scalars(_account_upsert(user_id, athlete_id, tokens), execution_options={"populate_existing": True})
+    ).one()
+    await db.commit()
+    return account
+
+
+def _token_fresh(account: StravaAccount) -> bool:
+    return account.expires_at > int(time.time()) + TOKEN_REFRESH_MARGIN_SECONDS
+
+
+@asynccontextmanager
+async def _token_refresh_lock(account_id: UUID) -> AsyncIterator[None]:
+    """Hold the account's token refresh lock across processes, or carry on without it if Redis is unavailable."""
+
+    lock = get_async_redis().lock(
+        f"strava_token_refresh:{account_id}",
+        timeout=TOKEN_REFRESH_LOCK_SECONDS,
+        blocking_timeout=TOKEN_REFRESH_LOCK_SECONDS,
+    )
+    try:
+        acquired = await lock.acquire()
+        if not acquired:
+            print(f"Timed out waiting for the token refresh lock of account {account_id}")
+    except redis.RedisError as exc:
+        print(f"Token refresh lock unavailable, refreshing under the process lock only: {exc}")
+        acquired = False
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except redis.RedisError as exc:
+                # The lock lapsed while we held it; it expires by itself
+                print(f"Failed to release the token refresh lock of account {account_id}: {exc}")
+
+
+async def _ensure_valid_access_token(db: AsyncSession, account: StravaAccount) -> StravaAccount:
+    """Return ``account`` with an access token valid for at least another minute, refreshing it if needed.
 
-    if account.expires_at > int(time.time()) + 60:
+    A refresh may hand back a new refresh token, so concurrent refreshes would
+    overwrite each other's. Refreshing is single-flight per account: an
+    asyncio lock within the process and a Redis lock across processes. Whoever
+    gets the locks after a refresh re-reads the account and uses its new token.
+    """
+
+    if _token_fresh(account):
         return account
 
     client_id = os.getenv("STRAVA_CLIENT_ID")
     if not client_id:
         raise RuntimeError("STRAVA_CLIENT_ID must be set in the environment to refresh Strava tokens")
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            "https://www.strava.com/oauth/token",
-            data={
-                "client_id": client_id,
-                "grant_type": "refresh_token",
-                "refresh_token": account.refresh_token,
-            },
-        )
+    async with _refresh_locks.setdefault(account.id, asyncio.Lock()):
+        async with _token_refresh_lock(account.id):
+            # Another caller may have refreshed while we waited for the locks
+            await db.refresh(account)
+            if _token_fresh(account):
+                return account
 
-    resp.raise_for_status()
-    data = resp.json()
+            resp = await strava_request(
+                "POST",
+                STRAVA_OAUTH_TOKEN_URL,
+                data={
+                    "client_id": client_id,
+                    "grant_type": "refresh_token",
+                    "refresh_token": account.refresh_token,
+                },
+            )
+            resp.raise_for_status()
+            data = resp.json()
 
-    account.access_token = data["access_token"]
-    account.refresh_token = data["refresh_token"]
-    account.expires_at = int(data["expires_at"])
-    db.add(account)
-    db.commit()
-    db.refresh(account)
-    return account
+            account.access_token = data["access_token"]
+            account.refresh_token = data["refresh_token"]
+            account.expires_at = int(data["expires_at"])
+            db.add(account)
+            await db.commit()
+            return account
+
+
+def _activity_payload(item: Dict[str, Any], user_id: Any) -> Optional[Dict[str, Any]]:
+    """Map a Strava activity JSON object onto an ActivityCreate payload, or None if it has no location.
+
+    The route comes from the encoded polyline (full ``map.polyline`` when the
+    item has one, else ``map.summary_polyline``), falling back to the
+    start/end latlng pair.
+    """
+
+    # Use Strava activity ID as our external_id
+    external_id = f"strava-{item['id']}"
 
+    payload: Dict[str, Any] = {
+        "user_id": str(user_id),
+        "external_id": external_id,
+        "source": "strava",
+        "start_time": item["start_date"],
+        "duration_seconds": item["elapsed_time"],
+        "distance_meters": int(item["distance"]),
+        "avg_heart_rate": item.get("average_heartrate"),
+    }
 
-async def import_recent_activities(db: Session, account: StravaAccount, per_page: int = 10) -> int:
+    activity_map = item.get("map") or {}
+    polyline = activity_map.get("polyline") or activity_map.get("summary_polyline")
+    if polyline:
+        payload["polyline"] = polyline
+        return payload
+
+    start = item.get("start_latlng")
+    end = item.get("end_latlng") or start
+    if not start:
+        # Skip activities without location for this prototype
+        return None
+
+    route = [
+        {"lat": start[0], "lon": start[1]},
+    ]
+    if end and end != start:
+        route.append({"lat": end[0], "lon": end[1]})
+    payload["route"] = route
+    return payload
+
+
+async def _upsert_strava_activities(
+    db: AsyncSession, user_id: Any, activities: List[Dict[str, Any]]
+) -> Tuple[int, Set[str]]:
+    """Upsert Strava activity objects; returns (imported/updated count, external ids the upsert rejected)."""
+    payloads = [p for p in (_activity_payload(item, user_id) for item in activities) if p is not None]
+    results = await bulk_upsert_activities_async(db, payloads)
+    imported = sum(1 for r in results if r.status in ("created", "updated"))
+    failed = {payloads[r.index]["external_id"] for r in results if r.status == "error"}
+    return imported, failed
+
+
+class StravaRateLimitExceeded(RuntimeError):
+    """Strava's rate limit is used up; ``retry_after`` is the seconds until it resets."""
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _next_reset(period_seconds: int) -> float:
+    """The next multiple of ``period_seconds`` since the epoch; Strava's limits reset on these (in UTC)."""
+    now = time.time()
+    return now - now % period_seconds + period_seconds + 1
+
+
+class StravaRateLimiter:
+    """Async token bucket kept in step with Strava's rate-limit headers.
+
+    Strava reports ``<15-minute>,<daily>`` pairs in ``X-RateLimit-Limit`` and
+    ``X-RateLimit-Usage`` (and ``X-ReadRateLimit-*`` for read endpoints). The
+    bucket holds the requests left in the current 15-minute window and refills
+    at the window's average rate, so concurrent page fetches spread out instead
+    of bursting into a 429. Once a window or the day is used up it raises
+    ``StravaRateLimitExceeded`` rather than waiting for the reset, which can be
+    up to 15 minutes (or a day) away.
+    """
+
+    def __init__(self, capacity: int = 100, window_seconds: int = RATE_LIMIT_WINDOW_SECONDS):
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Why and until when (epoch seconds) Strava will refuse requests, once a limit is used up
+        self.blocked: Optional[Tuple[str, float]] = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        rate = self.capacity / self.window_seconds
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def check(self) -> None:
+        """Raise ``StravaRateLimitExceeded`` if a used-up limit hasn't reset yet."""
+        if self.blocked is not None:
+            reason, until = self.blocked
+            if time.time() < until:
+                raise StravaRateLimitExceeded(reason, math.ceil(until - time.time()))
+            self.blocked = None
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self.check()
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) * self.window_seconds / self.capacity)
+                self._refill()
+            self.tokens -= 1
+
+    def reject(self, resp: httpx.Response) -> None:
+        """Raise for a 429 response, blocking further requests until the limit it hit resets."""
+        self.update_from_headers(resp.headers)
+        if self.blocked is None:
+            # No usable headers; assume the 15-minute window
+            self.blocked = ("Strava rate limit exceeded", _next_reset(self.window_seconds))
+        self.check()
+
+    def update_from_headers(self, headers: httpx.Headers) -> None:
+        for prefix in ("X-ReadRateLimit", "X-RateLimit"):
+            limit_header = headers.get(f"{prefix}-Limit")
+            usage_header = headers.get(f"{prefix}-Usage")
+            if limit_header and usage_header:
+                break
+        else:
+            return
+
+        try:
+            short_limit, daily_limit = (int(v) for v in limit_header.split(",")[:2])
+            short_usage, daily_usage = (int(v) for v in usage_header.split(",")[:2])
+        except ValueError:
+            return
+
+        # The response itself still counts; only later requests are refused
+        if daily_usage >= daily_limit:
+            self.blocked = ("Strava daily rate limit exhausted", _next_reset(24 * 60 * 60))
+        elif short_usage >= short_limit:
+            # Windows start on the quarter hour
+            self.blocked = ("Strava 15-minute rate limit exhausted", _next_reset(self.window_seconds))
+
+        self._refill()
+        self.capacity = short_limit
+        self.tokens = min(self.tokens, float(max(short_limit - short_usage, 0)))
+
+
+async def _fetch_activities_page(
+    headers: Dict[str, str],
+    limiter: StravaRateLimiter,
+    page: int,
+    per_page: int,
+    after: int | None = None,
+) -> List[Dict[str, Any]]:
+    params: Dict[str, Any] = {"per_page": per_page, "page": page}
+    # after=0 still matters: with after set Strava returns activities oldest first
+    if after is not None:
+        params["after"] = after
+
+    await limiter.acquire()
+    resp = await strava_request("GET", f"{STRAVA_API_BASE}/athlete/activities", params=params, headers=headers)
+    if resp.status_code == 429:
+        limiter.reject(resp)
+    limiter.update_from_headers(resp.headers)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def import_recent_activities(db: AsyncSession, account: StravaAccount, per_page: int = 10) -> int:
     """Fetch recent Strava activities and upsert them into our Activity table.
 
     Returns the number of activities imported/updated.
@@ -95,43 +401,77 @@ async def import_recent_activities(db: Session, account: StravaAccount, per_page
     account = await _ensure_valid_access_token(db, account)
 
     headers = {"Authorization": f"Bearer {account.access_token}"}
-    params = {"per_page": per_page, "page": 1}
+    activities = await _fetch_activities_page(headers, StravaRateLimiter(), page=1, per_page=per_page)
 
-    async with httpx.AsyncClient(base_url=STRAVA_API_BASE, headers=headers) as client:
-        resp = await client.get("/athlete/activities", params=params)
-    resp.raise_for_status()
-    activities: List[Dict[str, Any]] = resp.json()
+    imported, _ = await _upsert_strava_activities(db, account.user_id, activities)
+    return imported
+
+
+async def sync_activity_history(
+    db: AsyncSession,
+    account: StravaAccount,
+    *,
+    full_history: bool = False,
+    per_page: int = 200,
+    concurrency: int = 4,
+) -> int:
+    """Import every Strava activity newer than the account's sync watermark.
+
+    With ``after`` set Strava returns activities oldest first, so pages are
+    fetched ``concurrency`` at a time over the shared client and the watermark
+    (``activities_synced_until``) advances after each window is stored, up to
+    the last activity before the first one the upsert rejected. An interrupted
+    sync resumes where it stopped, a sync with rejected activities retries
+    from the first of them next time, and later syncs only fetch new
+    activities. ``full_history`` ignores the watermark and re-imports
+    everything. When Strava's rate limit runs out the sync stops with
+    ``StravaRateLimitExceeded`` instead of waiting, and is resumed by calling
+    it again after ``retry_after`` seconds.
+
+    Returns the number of activities imported/updated.
+    """
+
+    account = await _ensure_valid_access_token(db, account)
+    # A rolled-back chunk expires the account, and an async session can't lazily reload it, so read it up front
+    user_id = account.user_id
+
+    watermark = 0 if full_history else (account.activities_synced_until or 0)
+    # Strava's after is exclusive; step back a second so activities sharing the watermark second aren't skipped
+    after = max(watermark - 1, 0)
+
+    headers = {"Authorization": f"Bearer {account.access_token}"}
+    limiter = StravaRateLimiter()
 
     imported = 0
-    for item in activities:
-        # Use Strava activity ID as our external_id
-        external_id = f"strava-{item['id']}"
-
-        # Build a simple route from start/end latlng if available
-        start = item.get("start_latlng")
-        end = item.get("end_latlng") or start
-        if not start:
-            # Skip activities without location for this prototype
-            continue
-
-        route = [
-            {"lat": start[0], "lon": start[1]},
-        ]
-        if end and end != start:
-            route.append({"lat": end[0], "lon": end[1]})
-
-        payload = {
-            "user_id": str(account.user_id),
-            "external_id": external_id,
-            "source": "strava",
-            "start_time": item["start_date"],
-            "duration_seconds": item["elapsed_time"],
-            "distance_meters": int(item["distance"]),
-            "avg_heart_rate": item.get("average_heartrate"),
-            "route": route,
-        }
-
-        upsert_activity_from_webhook(db, payload)
-        imported += 1
+    # Set once an activity fails, so the watermark never moves past it
+    stalled = False
+    page = 1
+    while True:
+        pages = await asyncio.gather(
+            *(_fetch_activities_page(headers, limiter, p, per_page, after) for p in range(page, page + concurrency))
+        )
 
-    return imported
+        activities: List[Dict[str, Any]] = []
+        last_page_reached = False
+        for items in pages:
+            activities.extend(items)
+            if len(items) < per_page:
+                last_page_reached = True
+                break
+
+        window_imported, failed = await _upsert_strava_activities(db, user_id, activities)
+        imported += window_imported
+        for item in activities:
+            if stalled or f"strava-{item['id']}" in failed:
+                stalled = True
+                break
+            started = int(datetime.fromisoformat(item["start_date"].replace("Z", "+00:00")).timestamp())
+            watermark = max(watermark, started)
+
+        account.activities_synced_until = watermark
+        db.add(account)
+        await db.commit()
+
+        if last_page_reached:
+            return imported
+        page += concurrency
@@ -0,0 +1,219 @@
+import os
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+from uuid import UUID
+
+import redis
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.db.redis_client import get_redis
+from app.geo.simplify import lod_for_zoom
+from app.geo.tiles import tile_range_for_bounds
+
+
+TILE_EXTENT = 4096
+# Lines are clipped a little outside the tile so strokes join up across tile edges
+TILE_BUFFER = 64
+TILE_LAYER_NAME = "activities"
+
+TILE_CACHE_TTL_SECONDS = int(os.getenv("TILE_CACHE_TTL_SECONDS", "86400"))
+# Deeper tiles are cheap to render and rarely revisited, so they are not cached
+TILE_CACHE_MAX_ZOOM = int(os.getenv("TILE_CACHE_MAX_ZOOM", "14"))
+# Past this many tiles per zoom, an edit bumps that zoom's generation instead of each tile's
+TILE_INVALIDATION_MAX_TILES = int(os.getenv("TILE_INVALIDATION_MAX_TILES", "2048"))
+
+# Bounds as (min_lon, min_lat, max_lon, max_lat)
+Bounds = Tuple[float, float, float, float]
+
+# At zooms 0 and 1 a tile spans 180 degrees or more of longitude, which a
+# geography envelope can't represent, so those tiles skip the index prefilter.
+_PREFILTER_MIN_ZOOM = 2
+
+_TILE_SQL = """
+WITH tile AS (
+    SELECT
+        ST_TileEnvelope(CAST(:z AS integer), CAST(:x AS integer), CAST(:y AS integer)) AS envelope,
+        -- Segmentize so the geography edges follow the tile's parallels rather than great circles
+        ST_Segmentize(
+            ST_Transform(
+                ST_TileEnvelope(
+                    CAST(:z AS integer), CAST(:x AS integer), CAST(:y AS integer),
+                    margin => CAST(:margin AS double precision)
+                ),
+                4326
+            ),
+            0.5
+        )::geography AS search_area
+)
+SELECT ST_AsMVT(features, CAST(:layer AS text), CAST(:extent AS integer), 'geom')
+FROM (
+    SELECT
+        a.id::text AS id,
+        a.user_id::text AS user_id,
+        a.source,
+        extract(epoch FROM a.start_time)::bigint AS start_time,
+        a.distance_meters,
+        a.duration_seconds,
+        ST_AsMVTGeom(
+            ST_Transform(a.{column}::geometry, 3857), tile.envelope, CAST(:extent AS integer), CAST(:buffer AS integer), true
+        ) AS geom
+    FROM activities AS a, tile
+    WHERE {conditions}
+) AS features
+WHERE features.geom IS NOT NULL
+"""
+
+
+def _tile_key(z: int, x: int, y: int, zoom_generation: int, tile_generation: int) -> str:
+    return f"tiles:{z}:{zoom_generation}:{x}:{y}:{tile_generation}"
+
+
+def _generation_key(z: int) -> str:
+    return f"tiles:generation:{z}"
+
+
+def _tile_generation_key(z: int, x: int, y: int) -> str:
+    return f"tiles:generation:{z}:{x}:{y}"
+
+
+def _filter_field(user_id: Optional[UUID], since: Optional[datetime], until: Optional[datetime]) -> str:
+    # One hash per tile, one field per filter combination, so invalidating a tile drops every variant
+    return "|".join(
+        [
+            str(user_id) if user_id else "*",
+            since.isoformat() if since else "",
+            until.isoformat() if until else "",
+        ]
+    )
+
+
+def render_tile(
+    db: Session,
+    z: int,
+    x: int,
+    y: int,
+    *,
+    user_id: Optional[UUID] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> bytes:
+    """Render one Mapbox Vector Tile of activity routes in PostGIS.
+
+    Geometry is taken from the route level of detail suited to ``z``; candidate
+    rows are found with ``&&`` on the GiST-indexed full route.
+    """
+
+    lod = lod_for_zoom(z)
+    column = f"route_lod_{lod}" if lod else "route"
+
+    conditions = []
+    params = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "margin": TILE_BUFFER / TILE_EXTENT,
+        "layer": TILE_LAYER_NAME,
+        "extent": TILE_EXTENT,
+        "buffer": TILE_BUFFER,
+    }
+    if z >= _PREFILTER_MIN_ZOOM:
+        conditions.append("a.route && tile.search_area")
+    if user_id is not None:
+        conditions.append("a.user_id = :user_id")
+        params["user_id"] = user_id
+    if since is not None:
+        conditions.append("a.start_time >= :since")
+        params["since"] = since
+    if until is not None:
+        conditions.append("a.start_time < :until")
+        params["until"] = until
+
+    sql = _TILE_SQL.format(column=column, conditions=" AND ".join(conditions) or "true")
+    tile = db.execute(text(sql), params).scalar()
+    return bytes(tile) if tile is not None else b""
+
+
+def get_tile(
+    db: Session,
+    z: int,
+    x: int,
+    y: int,
+    *,
+    user_id: Optional[UUID] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> bytes:
+    """Return a rendered tile, serving it from the Redis tile cache when possible.
+
+    Cached tiles are keyed by the zoom's and the tile's generation as read
+    before rendering. A tile rendered from data that an invalidation has since
+    replaced is therefore stored under a retired key, and nobody reads it again.
+    """
+
+    if z > TILE_CACHE_MAX_ZOOM:
+        return render_tile(db, z, x, y, user_id=user_id, since=since, until=until)
+
+    r = get_redis()
+    field = _filter_field(user_id, since, until)
+    try:
+        zoom_generation, tile_generation = r.mget([_generation_key(z), _tile_generation_key(z, x, y)])
+        key = _tile_key(z, x, y, int(zoom_generation or 0), int(tile_generation or 0))
+        cached = r.hget(key, field)
+    except redis.RedisError as exc:
+        print(f"Tile cache unavailable, rendering without it: {exc}")
+        return render_tile(db, z, x, y, user_id=user_id, since=since, until=until)
+    if cached is not None:
+        return cached
+
+    tile = render_tile(db, z, x, y, user_id=user_id, since=since, until=until)
+    try:
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(key, field, tile)
+        pipe.expire(key, TILE_CACHE_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError as exc:
+        print(f"Failed to cache tile {z}/{x}/{y}: {exc}")
+    return tile
+
+
+def invalidate_tiles_for_bounds(bounds: Iterable[Optional[Bounds]]) -> None:
+    """Retire cached tiles that intersect any of the given route bounding boxes.
+
+    Call this after the transaction that changed the routes has committed, with
+    the bounds of both the old and the new route. Each affected tile's
+    generation is bumped rather than its key deleted. A tile being rendered
+    concurrently from the old geometry is then written under the retired
+    generation and never served.
+    """
+
+    boxes = [box for box in bounds if box is not None and None not in box]
+    if not boxes:
+        return
+
+    r = get_redis()
+    try:
+        pipe = r.pipeline(transaction=False)
+        for z in range(TILE_CACHE_MAX_ZOOM + 1):
+            # Tiles render a buffer past their edges, so a route near a tile boundary also shows up next door
+            ranges = [tile_range_for_bounds(box, z, TILE_BUFFER / TILE_EXTENT) for box in boxes]
+            tile_count = sum((max_x - min_x + 1) * (max_y - min_y + 1) for min_x, min_y, max_x, max_y in ranges)
+            if tile_count > TILE_INVALIDATION_MAX_TILES:
+                # Very long routes would touch too many keys; retire the whole zoom level instead
+                pipe.incr(_generation_key(z))
+                continue
+
+            tiles = {
+                (x, y)
+                for min_x, min_y, max_x, max_y in ranges
+                for x in range(min_x, max_x + 1)
+                for y in range(min_y, max_y + 1)
+            }
+            for x, y in tiles:
+                pipe.incr(_tile_generation_key(z, x, y))
+                # Outlive every tile cached under an older value, or a reset counter could match one again
+                pipe.expire(_tile_generation_key(z, x, y), 2 * TILE_CACHE_TTL_SECONDS)
+        pipe.execute()
+    except redis.RedisError as exc:
+        # Stale tiles expire with the TTL; a cache outage must not fail the write that triggered this
+        print(f"Failed to invalidate cached tiles: {exc}")
@@ -0,0 +1,69 @@
+"""Compare two benchmark result files written by ``python -m benchmarks.run``.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json --fail-over 10
+
+Prints p50, p99 and throughput changes per size and benchmark. With
+``--fail-over`` the exit status is 1 when any p50 or p99 got slower by more
+than that many percent, so it can gate a CI job.
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Optional, Tuple
+
+
+def _load(path: str) -> Tuple[Dict, Dict[Tuple[int, str], Dict]]:
+    with open(path) as fh:
+        report = json.load(fh)
+    benchmarks = {
+        (entry["size"], name): summary
+        for entry in report["results"]
+        for name, summary in entry["benchmarks"].items()
+    }
+    return report, benchmarks
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100.0
+
+
+def _fmt(change: Optional[float]) -> str:
+    return "     n/a" if change is None else f"{change:+7.1f}%"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", help="Earlier results file")
+    parser.add_argument("candidate", help="Later results file")
+    parser.add_argument("--fail-over", type=float, help="Exit 1 if any p50/p99 regressed by more than this percent")
+    args = parser.parse_args()
+
+    old_report, old = _load(args.baseline)
+    new_report, new = _load(args.candidate)
+    print(f"baseline:  {old_report['environment'].get('git_commit')} ({old_report['started_at']})")
+    print(f"candidate: {new_report['environment'].get('git_commit')} ({new_report['started_at']})")
+    print(f"{'size':>9}  {'benchmark':45} {'p50':>8} {'p99':>8} {'ops/s':>8}")
+
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        size, name = key
+        p50 = _change(old[key]["p50_ms"], new[key]["p50_ms"])
+        p99 = _change(old[key]["p99_ms"], new[key]["p99_ms"])
+        throughput = _change(old[key]["ops_per_sec"], new[key]["ops_per_sec"])
+        print(f"{size:>9}  {name:45} {_fmt(p50)} {_fmt(p99)} {_fmt(throughput)}")
+        if args.fail_over is not None and any(c is not None and c > args.fail_over for c in (p50, p99)):
+            regressions.append(key)
+
+    for size, name in sorted(old.keys() ^ new.keys()):
+        print(f"{size:>9}  {name:45} only in {'baseline' if (size, name) in old else 'candidate'}")
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.fail_over}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
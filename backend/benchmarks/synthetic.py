@@ -0,0 +1,153 @@
+"""Synthetic users and activity routes for benchmarks.
+
+Routes are heading-persistent random walks that start near a set of hotspots
+(real city centres), so spatial density is uneven the way real data is:
+dense around popular areas and sparse elsewhere. Every activity is generated
+from its own seeded RNG, so a dataset can be topped up or regenerated in
+parallel and always comes out the same.
+"""
+
+import math
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.activity_service import build_activity_values
+
+
+EXTERNAL_ID_PREFIX = "bench-seed-"
+SOURCE = "benchmark"
+_USER_NAMESPACE = uuid.UUID("6f1c7a3e-3d0b-4a51-9b8e-0c1f4d2a9e10")
+_METERS_PER_DEGREE = 111_320.0
+_EPOCH = datetime(2024, 1, 1)
+
+# (lon, lat) of the cities hotspots are drawn around
+CITIES: Sequence[Tuple[float, float]] = (
+    (8.5417, 47.3769),  # Zurich
+    (-0.1276, 51.5072),  # London
+    (-73.9857, 40.7484),  # New York
+    (-122.4194, 37.7749),  # San Francisco
+    (139.6917, 35.6895),  # Tokyo
+    (151.2093, -33.8688),  # Sydney
+    (18.4241, -33.9249),  # Cape Town
+    (-46.6333, -23.5505),  # São Paulo
+)
+
+
+class SyntheticConfig:
+    """Shape of a synthetic dataset; the same config and seed always produce the same data."""
+
+    def __init__(
+        self,
+        *,
+        users: int = 100,
+        hotspots: int = 24,
+        spread_meters: float = 15_000.0,
+        points: int = 500,
+        step_meters: float = 20.0,
+        seed: int = 42,
+    ) -> None:
+        self.users = users
+        self.hotspots = hotspots
+        self.spread_meters = spread_meters
+        self.points = points
+        self.step_meters = step_meters
+        self.seed = seed
+
+    def as_dict(self) -> Dict:
+        return dict(vars(self))
+
+
+def user_id_for(index: int) -> uuid.UUID:
+    return uuid.uuid5(_USER_NAMESPACE, f"bench-user-{index}")
+
+
+def user_email_for(index: int) -> str:
+    return f"bench-user-{index}@example.com"
+
+
+def hotspot_centers(config: SyntheticConfig) -> np.ndarray:
+    """``(hotspots, 2)`` lon/lat centres, scattered up to ~30 km around the cities."""
+
+    rng = np.random.default_rng([config.seed, 0])
+    cities = np.array(CITIES)[rng.integers(0, len(CITIES), config.hotspots)]
+    offsets = rng.normal(0.0, 30_000.0 / 3, size=(config.hotspots, 2))
+    return _offset(cities, offsets)
+
+
+def _offset(origin: np.ndarray, meters: np.ndarray) -> np.ndarray:
+    """Move lon/lat points by (east, north) meter offsets (equirectangular, fine at these scales)."""
+
+    lat = origin[..., 1]
+    dlon = meters[..., 0] / (_METERS_PER_DEGREE * np.cos(np.radians(lat)))
+    dlat = meters[..., 1] / _METERS_PER_DEGREE
+    return np.stack([origin[..., 0] + dlon, np.clip(lat + dlat, -85.0, 85.0)], axis=-1)
+
+
+def synthetic_route(rng: np.random.Generator, start: np.ndarray, points: int, step_meters: float) -> np.ndarray:
+    """``(points, 2)`` lon/lat random walk from ``start`` that mostly keeps its heading, like a real track."""
+
+    heading = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0.0, 0.25, points - 1))
+    steps = step_meters * rng.uniform(0.5, 1.5, points - 1)
+    moves = np.stack([np.cos(heading) * steps, np.sin(heading) * steps], axis=1)
+    meters = np.vstack([np.zeros((1, 2)), np.cumsum(moves, axis=0)])
+    return _offset(np.broadcast_to(start, meters.shape), meters)
+
+
+def _path_length_meters(route: np.ndarray) -> float:
+    lat = np.radians(route[:, 1])
+    dx = np.diff(route[:, 0]) * np.cos(lat[:-1])
+    dy = np.diff(route[:, 1])
+    return float(np.sum(np.hypot(dx, dy)) * _METERS_PER_DEGREE)
+
+
+def synthetic_activity(config: SyntheticConfig, index: int, centers: np.ndarray, variant: int = 0) -> Dict:
+    """Field values for synthetic activity ``index``, with the route as an ``(N, 2)`` array under ``coords``.
+
+    ``variant`` re-rolls the route and metrics while keeping the identity, to
+    simulate an activity being edited.
+    """
+
+    rng = np.random.default_rng([config.seed, 1, index, variant])
+    center = centers[rng.integers(0, len(centers))]
+    start = _offset(center, rng.normal(0.0, config.spread_meters / 2, 2))
+    points = max(2, int(rng.normal(config.points, config.points / 4)))
+    coords = synthetic_route(rng, start, points, config.step_meters)
+
+    distance = _path_length_meters(coords)
+    speed = rng.uniform(2.5, 9.0)  # m/s, running to cycling
+    return {
+        # Fixed per index, so an edited variant stays with the same user
+        "user_id": user_id_for(index % config.users),
+        "external_id": f"{EXTERNAL_ID_PREFIX}{index}",
+        "source": SOURCE,
+        "start_time": _EPOCH + timedelta(seconds=int(rng.integers(0, 2 * 365 * 86_400))),
+        "duration_seconds": int(distance / speed) + 1,
+        "distance_meters": int(distance),
+        "avg_heart_rate": int(rng.integers(100, 175)) if rng.random() < 0.8 else None,
+        "coords": coords,
+    }
+
+
+def webhook_payload(activity: Dict, external_id: Optional[str] = None) -> Dict:
+    """ActivityCreate JSON body for a synthetic activity, as a webhook would send it."""
+
+    return {
+        "user_id": str(activity["user_id"]),
+        "external_id": external_id or activity["external_id"],
+        "source": activity["source"],
+        "start_time": activity["start_time"].isoformat() + "Z",
+        "duration_seconds": activity["duration_seconds"],
+        "distance_meters": activity["distance_meters"],
+        "avg_heart_rate": activity["avg_heart_rate"],
+        "route": [{"lat": float(lat), "lon": float(lon)} for lon, lat in activity["coords"]],
+    }
+
+
+def seed_rows(config: SyntheticConfig, start: int, stop: int) -> List[Dict]:
+    """``activities`` rows for synthetic activities ``start`` to ``stop - 1``. Safe to run in a worker process."""
+
+    centers = hotspot_centers(config)
+    return [build_activity_values(**synthetic_activity(config, index, centers)) for index in range(start, stop)]
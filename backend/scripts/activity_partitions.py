@@ -0,0 +1,130 @@
+"""Manage the monthly partitions of the ``activities`` table.
+
+``activities`` is range-partitioned on ``start_time`` with one partition per
+month. Ingest creates partitions on demand, so this script is only needed to
+pre-create upcoming months and to retire old ones.
+
+Commands:
+- ``list`` shows the attached partitions with their bounds and row estimates.
+- ``create --months-ahead N`` creates partitions up to N months past the
+  current one.
+- ``detach YYYY-MM`` detaches that month's partition and renames it to
+  ``activities_yYYYYmMM_detached``. The table and its data stay in place,
+  ready to be archived, dumped or dropped; queries on ``activities`` no longer
+  see it. ``--concurrently`` uses ``DETACH ... CONCURRENTLY`` so readers and
+  writers of other months are not blocked.
+
+Detaching only removes the raw activities. Their ``activity_keys`` rows stay,
+so ids remain stable and insight reports keep their foreign keys, and the
+daily rollups and heatmap cells still count them. Because their rows can't be
+read to subtract them, a changed resend of a detached activity is rejected
+as an error and not written; resends with the same content are still
+reported unchanged. To put a month back:
+
+    ALTER TABLE activities_y2023m01_detached RENAME TO activities_y2023m01;
+    ALTER TABLE activities ATTACH PARTITION activities_y2023m01
+        FOR VALUES FROM ('2023-01-01') TO ('2023-02-01');
+
+API and worker processes remember which months have partitions. A write
+into a month detached since then fails once, which makes the process forget
+the month and retry, recreating an empty partition for it. Writers create
+partitions in a short transaction of their own, but ``create`` ahead of time
+keeps even that off the write path.
+
+Run from the backend directory with DATABASE_URL pointing at the database:
+
+    cd backend
+    python scripts/activity_partitions.py list
+    python scripts/activity_partitions.py detach 2023-01 --concurrently
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+# Make the "app" package importable when run as a script from the backend directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from app.db.partitions import (  # noqa: E402
+    PARENT_TABLE,
+    add_months,
+    create_partitions,
+    existing_partitions,
+    month_of,
+    partition_name,
+)
+from app.db.session import engine  # noqa: E402
+
+
+def list_partitions() -> None:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:parent AS regclass) ORDER BY c.relname"
+            ),
+            {"parent": PARENT_TABLE},
+        ).all()
+    for name, bounds, estimate in rows:
+        # reltuples is -1 until the partition has been vacuumed or analyzed
+        print(f"{name}  {bounds}  ~{max(estimate, 0)} rows")
+    print(f"{len(rows)} partitions")
+
+
+def create_ahead(months_ahead: int) -> None:
+    this_month = month_of(datetime.now())
+    months = [add_months(this_month, offset) for offset in range(months_ahead + 1)]
+    with engine.begin() as conn:
+        created = create_partitions(conn, months)
+    print(f"Created {', '.join(created)}" if created else "All partitions already exist")
+
+
+def detach(month: date, concurrently: bool) -> None:
+    name = partition_name(month)
+    # DETACH ... CONCURRENTLY refuses to run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if name not in existing_partitions(conn):
+            raise SystemExit(f"{name} is not attached to {PARENT_TABLE}")
+        mode = " CONCURRENTLY" if concurrently else ""
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}{mode}"))
+        # Free the name, or on-demand creation would find it taken and writes to this month would fail
+        conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_detached"))
+    print(f"Detached {name} as {name}_detached")
+
+
+def _month(value: str) -> date:
+    try:
+        return month_of(datetime.strptime(value, "%Y-%m"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM, got {value!r}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Show attached partitions")
+    create = commands.add_parser("create", help="Create partitions for upcoming months")
+    create.add_argument("--months-ahead", type=int, default=3, help="Months past the current one")
+    detach_parser = commands.add_parser("detach", help="Detach one month's partition")
+    detach_parser.add_argument("month", type=_month, help="Month to detach, as YYYY-MM")
+    detach_parser.add_argument("--concurrently", action="store_true", help="Don't block other queries")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        list_partitions()
+    elif args.command == "create":
+        create_ahead(args.months_ahead)
+    else:
+        detach(args.month, args.concurrently)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Import a Strava bulk-export archive straight into the database.
+
+The archive is the one Strava emails from "Download or Delete Your Account":
+a directory or zip holding ``activities.csv`` plus one GPX or TCX file (often
+gzipped) per activity under ``activities/``. FIT files are not supported and
+are reported as skipped.
+
+This script:
+- Parses the track files in a process pool.
+- Stages each batch into a temp table with PostgreSQL ``COPY``.
+- Merges the batch into ``activities`` on ``external_id`` (``strava-<id>``, the
+  same key the API import uses), keeping the daily rollup and heatmap in step
+  and invalidating cached tiles and activity listings.
+- Reports progress and throughput in activities per second.
+
+Run from the backend directory with DATABASE_URL pointing at the database:
+
+    cd backend
+    python scripts/import_strava_archive.py ~/Downloads/export_12345.zip --user-id <uuid>
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import gzip
+import io
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+from xml.etree import ElementTree
+
+import numpy as np
+
+# Make the "app" package importable when run as a script from the backend directory
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from app.db.models import User  # noqa: E402
+from app.db.session import SessionLocal  # noqa: E402
+from app.services.activity_service import (  # noqa: E402
+    build_activity_values,
+    copy_upsert_rows,
+    invalidate_read_caches,
+)
+
+
+CSV_NAME = "activities.csv"
+CSV_DATE_FORMAT = "%b %d, %Y, %I:%M:%S %p"
+EARTH_RADIUS_METERS = 6_371_000.0
+
+# Parsed-but-unwritten activities kept in flight per worker process
+_PENDING_PER_WORKER = 8
+
+# Per-process handle on the zip being imported, so each task doesn't reopen it
+_archive: Optional[zipfile.ZipFile] = None
+
+
+def _open_member(archive_path: str, name: str) -> bytes:
+    global _archive
+    if os.path.isdir(archive_path):
+        with open(os.path.join(archive_path, name), "rb") as fh:
+            data = fh.read()
+    else:
+        if _archive is None or _archive.filename != archive_path:
+            _archive = zipfile.ZipFile(archive_path)
+        data = _archive.read(name)
+    return gzip.decompress(data) if name.endswith(".gz") else data
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+
+
+def _parse_track(data: bytes, kind: str) -> Tuple[List[Tuple[float, float]], List[datetime], List[float]]:
+    """Return the (lon, lat) points, timestamps and heart rates of a GPX or TCX track."""
+
+    points: List[Tuple[float, float]] = []
+    times: List[datetime] = []
+    heart_rates: List[float] = []
+    point_tag = "trkpt" if kind == "gpx" else "Trackpoint"
+
+    # Namespaces differ between exporters, so match on local names only
+    for _, elem in ElementTree.iterparse(io.BytesIO(data.lstrip())):
+        if _local(elem.tag) != point_tag:
+            continue
+        lat = lon = None
+        if kind == "gpx":
+            lat, lon = elem.get("lat"), elem.get("lon")
+        for child in elem.iter():
+            name = _local(child.tag)
+            if name == "LatitudeDegrees":
+                lat = child.text
+            elif name == "LongitudeDegrees":
+                lon = child.text
+            elif name in ("time", "Time") and child.text:
+                times.append(_parse_time(child.text))
+            elif name == "hr" and child.text:
+                heart_rates.append(float(child.text))
+            elif name == "HeartRateBpm":
+                value = next((c.text for c in child if _local(c.tag) == "Value"), None)
+                if value:
+                    heart_rates.append(float(value))
+        if lat is not None and lon is not None:
+            points.append((float(lon), float(lat)))
+        # Trackpoints are self-contained; dropping them keeps memory flat on long tracks
+        elem.clear()
+
+    return points, times, heart_rates
+
+
+def _track_length_meters(coords: np.ndarray) -> float:
+    lon, lat = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    dlat, dlon = np.diff(lat), np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return float(np.sum(2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))))
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def parse_activity(task: Tuple[str, Dict[str, Any], str]) -> Tuple[str, str, Any]:
+    """Parse one archive activity into an ``activities`` row.
+
+    Runs in a worker process. Returns ``(status, external_id, row or reason)``
+    with status ``ok``, ``skipped`` or ``error``.
+    """
+
+    archive_path, record, user_id = task
+    external_id = f"strava-{record['id']}"
+    filename = record["filename"]
+    if not filename:
+        return "skipped", external_id, "no track file (manual activity)"
+
+    kind = filename.removesuffix(".gz").rsplit(".", 1)[-1].lower()
+    if kind not in ("gpx", "tcx"):
+        return "skipped", external_id, f"unsupported file type {kind!r}"
+
+    try:
+        points, times, heart_rates = _parse_track(_open_member(archive_path, filename), kind)
+        if not points:
+            return "skipped", external_id, "track has no positions"
+        if len(points) == 1:
+            points.append(points[0])
+        coords = np.array(points, dtype=np.float64)
+
+        if times:
+            start_time = times[0]
+        else:
+            start_time = datetime.strptime(record["date"], CSV_DATE_FORMAT).replace(tzinfo=timezone.utc)
+        duration = record["elapsed_time"]
+        if duration is None:
+            duration = (times[-1] - times[0]).total_seconds() if len(times) > 1 else 0
+        distance = record["distance_meters"]
+        if distance is None:
+            distance = _track_length_meters(coords)
+        avg_heart_rate = record["avg_heart_rate"]
+        if avg_heart_rate is None and heart_rates:
+            avg_heart_rate = sum(heart_rates) / len(heart_rates)
+
+        row = build_activity_values(
+            user_id=UUID(user_id),
+            external_id=external_id,
+            source="strava",
+            start_time=start_time,
+            duration_seconds=int(duration),
+            distance_meters=int(distance),
+            avg_heart_rate=round(avg_heart_rate) if avg_heart_rate is not None else None,
+            coords=coords,
+        )
+    except Exception as exc:
+        return "error", external_id, f"{filename}: {exc}"
+    return "ok", external_id, row
+
+
+def read_activity_records(archive_path: str) -> List[Dict[str, Any]]:
+    """Read activities.csv into one small record per activity.
+
+    The export repeats some headers: the first ``Distance`` is in the
+    athlete's display unit and a later one in meters, so only a repeated
+    ``Distance`` is trusted as meters (otherwise it is measured from the track).
+    """
+
+    raw = _open_member(archive_path, CSV_NAME)
+    reader = csv.reader(io.StringIO(raw.decode("utf-8-sig")))
+    header = next(reader)
+    first = {}
+    for i, name in enumerate(header):
+        first.setdefault(name, i)
+    distance_columns = [i for i, name in enumerate(header) if name == "Distance"]
+    meters_column = distance_columns[-1] if len(distance_columns) > 1 else None
+
+    def cell(row: List[str], index: Optional[int]) -> Optional[str]:
+        return row[index] if index is not None and index < len(row) else None
+
+    records = []
+    for row in reader:
+        if not row:
+            continue
+        records.append(
+            {
+                "id": cell(row, first.get("Activity ID")),
+                "date": cell(row, first.get("Activity Date")),
+                "filename": cell(row, first.get("Filename")) or "",
+                "elapsed_time": _number(cell(row, first.get("Elapsed Time"))),
+                "distance_meters": _number(cell(row, meters_column)),
+                "avg_heart_rate": _number(cell(row, first.get("Average Heart Rate"))),
+            }
+        )
+    return records
+
+
+def _parsed(executor: ProcessPoolExecutor, tasks: List[Tuple], window: int) -> Iterator[Tuple[str, str, Any]]:
+    """Yield parse results in task order, with at most ``window`` tasks outstanding."""
+
+    pending: Deque[Future] = deque()
+    for task in tasks:
+        pending.append(executor.submit(parse_activity, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ImportStats:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.created = self.updated = self.skipped = self.failed = 0
+        self.started = time.perf_counter()
+
+    @property
+    def processed(self) -> int:
+        return self.created + self.updated + self.skipped + self.failed
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return (self.created + self.updated) / elapsed if elapsed > 0 else 0.0
+
+    def report(self, prefix: str = "Progress") -> None:
+        print(
+            f"{prefix}: {self.processed}/{self.total} processed, created={self.created}, "
+            f"updated={self.updated}, skipped={self.skipped}, failed={self.failed}, "
+            f"{self.rate():.1f} activities/s"
+        )
+
+
+def write_batch(batch: Dict[str, dict], stats: ImportStats) -> None:
+    rows = list(batch.values())
+    db = SessionLocal()
+    try:
+        written, touched = copy_upsert_rows(db, rows)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        stats.failed += len(rows)
+        print(f"Batch of {len(rows)} failed: {exc}")
+        return
+    finally:
+        db.close()
+
+    invalidate_read_caches(touched)
+    for row in written:
+        if row.inserted:
+            stats.created += 1
+        else:
+            stats.updated += 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archive", help="Strava export directory or .zip")
+    parser.add_argument("--user-id", required=True, help="User the activities belong to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Parser processes")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Activities per COPY and merge")
+    args = parser.parse_args()
+
+    user_id = str(UUID(args.user_id))
+    with SessionLocal() as db:
+        if db.get(User, UUID(user_id)) is None:
+            raise SystemExit(f"User {user_id} does not exist")
+
+    records = read_activity_records(args.archive)
+    print(f"Found {len(records)} activities in {args.archive}; parsing with {args.workers} processes")
+
+    stats = ImportStats(total=len(records))
+    tasks = [(args.archive, record, user_id) for record in records]
+    batch: Dict[str, dict] = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for status, external_id, result in _parsed(executor, tasks, args.workers * _PENDING_PER_WORKER):
+            if status == "ok":
+                # A merge can't touch the same row twice, so the last copy of an activity wins
+                if external_id in batch:
+                    stats.skipped += 1
+                batch[external_id] = result
+                if len(batch) >= args.batch_size:
+                    write_batch(batch, stats)
+                    batch = {}
+                    stats.report()
+            elif status == "skipped":
+                stats.skipped += 1
+            else:
+                stats.failed += 1
+                print(f"Failed to parse {external_id}: {result}")
+        if batch:
+            write_batch(batch, stats)
+
+    stats.report("Done")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@
 This script:
 - Uses your Strava access token to call the Strava API.
 - Transforms a few recent activities into the webhook payload shape.
-- POSTs them to the local backend `/webhooks/strava` endpoint.
+- POSTs them in one request to the local backend `/webhooks/strava/batch` endpoint.
 
 Run from the repo root with your virtualenv active:
 
@@ -37,16 +37,33 @@ def build_webhook_payload(activity: Dict[str, Any], user_id: str) -> Dict[str, A
     - duration_seconds: activity["elapsed_time"]
     - distance_meters: activity["distance"]
     - avg_heart_rate: activity.get("average_heartrate")
-    - route: built from start/end latlng if present
+    - polyline: activity["map"]["polyline"] or ["summary_polyline"], decoded by the backend
+    - route: built from start/end latlng when there is no polyline
     """
 
     external_id = f"strava-{activity['id']}"
 
+    payload: Dict[str, Any] = {
+        "user_id": user_id,
+        "external_id": external_id,
+        "source": "strava",
+        "start_time": activity["start_date"],
+        "duration_seconds": int(activity["elapsed_time"]),
+        "distance_meters": int(activity["distance"]),
+        "avg_heart_rate": activity.get("average_heartrate"),
+    }
+
+    activity_map = activity.get("map") or {}
+    polyline = activity_map.get("polyline") or activity_map.get("summary_polyline")
+    if polyline:
+        payload["polyline"] = polyline
+        return payload
+
     start = activity.get("start_latlng")
     end = activity.get("end_latlng") or start
     if not start:
         # Skip activities without any location
-        raise ValueError("activity has no start_latlng; skipping")
+        raise ValueError("activity has no polyline or start_latlng; skipping")
 
     route = [
         {"lat": start[0], "lon": start[1]},
@@ -54,16 +71,7 @@ def build_webhook_payload(activity: Dict[str, Any], user_id: str) -> Dict[str, A
     if end and end != start:
         route.append({"lat": end[0], "lon": end[1]})
 
-    payload: Dict[str, Any] = {
-        "user_id": user_id,
-        "external_id": external_id,
-        "source": "strava",
-        "start_time": activity["start_date"],
-        "duration_seconds": int(activity["elapsed_time"]),
-        "distance_meters": int(activity["distance"]),
-        "avg_heart_rate": activity.get("average_heartrate"),
-        "route": route,
-    }
+    payload["route"] = route
     return payload
 
 
@@ -87,27 +95,39 @@ def main() -> None:
     print(f"Fetched {len(activities)} activities from Strava")
 
     imported = 0
+    unchanged = 0
     errors = 0
 
-    with httpx.Client(base_url=api_base, timeout=20.0) as backend:
-        for act in activities:
-            try:
-                payload = build_webhook_payload(act, user_id=user_id)
-            except ValueError as exc:
-                print(f"Skipping activity {act.get('id')}: {exc}")
+    payloads: List[Dict[str, Any]] = []
+    source_ids: List[Any] = []
+    for act in activities:
+        try:
+            payloads.append(build_webhook_payload(act, user_id=user_id))
+        except ValueError as exc:
+            print(f"Skipping activity {act.get('id')}: {exc}")
+            errors += 1
+            continue
+        source_ids.append(act.get("id"))
+
+    if payloads:
+        with httpx.Client(base_url=api_base, timeout=60.0) as backend:
+            r = backend.post("/webhooks/strava/batch", json=payloads)
+        if r.status_code >= 400:
+            raise SystemExit(f"Batch import failed: {r.status_code} {r.text}")
+
+        for result in r.json()["results"]:
+            strava_id = source_ids[result["index"]]
+            if result["status"] in ("created", "updated"):
+                print(f"Imported activity {strava_id} as {result['id']} ({result['status']})")
+                imported += 1
+            elif result["status"] == "error":
+                print(f"Failed to import activity {strava_id}: {result['error']}")
                 errors += 1
-                continue
-
-            r = backend.post("/webhooks/strava", json=payload)
-            if r.status_code >= 400:
-                print(f"Failed to import activity {act.get('id')}: {r.status_code} {r.text}")
-                errors += 1
-                continue
-
-            print(f"Imported activity {act.get('id')} as {r.json().get('id')}")
-            imported += 1
+            else:
+                # unchanged resends, and duplicates superseded by a later item in the batch
+                unchanged += 1
 
-    print(f"Done. Imported={imported}, skipped/failed={errors}")
+    print(f"Done. Imported={imported}, unchanged={unchanged}, skipped/failed={errors}")
 
 
 if __name__ == "__main__":
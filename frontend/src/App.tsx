@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { useMutation, useQuery, useQueryClient } from '@tanstack/react-query';
 
 const API_BASE = import.meta.env.VITE_API_BASE ?? 'http://localhost:8000';
@@ -22,10 +22,16 @@ interface Insight {
   created_at: string;
 }
 
+interface ActivityPage {
+  items: Activity[];
+  next_cursor?: string | null;
+}
+
 async function fetchActivities(): Promise<Activity[]> {
   const res = await fetch(`${API_BASE}/activities/`);
   if (!res.ok) throw new Error('Failed to fetch activities');
-  return res.json();
+  const page: ActivityPage = await res.json();
+  return page.items;
 }
 
 async function fetchNearby(lat: number, lon: number, radius_meters: number): Promise<Activity[]> {
@@ -112,12 +118,20 @@ const App: React.FC = () => {
     queryKey: ['insight', selectedInsightId],
     queryFn: () => fetchInsight(selectedInsightId as string),
     enabled: !!selectedInsightId,
-    refetchInterval: (data) => {
-      if (!data) return 3000;
-      return data.status === 'done' || data.status === 'failed' ? false : 3000;
-    },
   });
 
+  // Status changes are pushed over Server-Sent Events instead of polling
+  useEffect(() => {
+    if (!selectedInsightId) return;
+    const source = new EventSource(`${API_BASE}/insights/${selectedInsightId}/events`);
+    source.addEventListener('insight', (event) => {
+      const insight: Insight = JSON.parse((event as MessageEvent).data);
+      queryClient.setQueryData(['insight', selectedInsightId], insight);
+      if (insight.status === 'done' || insight.status === 'failed') source.close();
+    });
+    return () => source.close();
+  }, [selectedInsightId, queryClient]);
+
   return (
     <div style={{ maxWidth: 960, margin: '0 auto', padding: '1.5rem', fontFamily: 'system-ui, sans-serif' }}>
       <h1>Geo Activity Insights</h1>
@@ -0,0 +1,164 @@
+"""Consumer for write-behind webhook ingestion.
+
+With WEBHOOK_INGEST_MODE=write-behind the webhook route only validates each
+payload and appends it to the ingest stream. This process drains the stream
+through a consumer group in micro-batches: every read returns whatever has
+arrived, up to INGEST_BATCH_SIZE entries, and the batch goes through
+``bulk_upsert_activities``. Quiet periods give small batches and little
+delay; bursts give large ones, so the database sees a steady number of
+statements however spiky the webhook traffic is.
+
+Entries are ACKed and deleted only once their batch has committed. Payloads
+the upsert rejects are moved to the dead-letter stream with the error. A batch
+whose upsert raises is split until the payload responsible is found, and only
+that payload is dead-lettered. Entries left pending by a crashed consumer are reclaimed after
+INGEST_CLAIM_IDLE_MS (or dead-lettered after INGEST_MAX_DELIVERIES attempts).
+
+Consumers can be scaled out, but two consumers may then apply updates to the
+same activity out of order; run a single consumer if senders resend edits in
+quick succession.
+"""
+
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Dict, List, Sequence
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from app.db.redis_client import get_redis
+from app.db.session import SessionLocal
+from app.schemas.activity import ActivityUpsertResult
+from app.services.activity_service import bulk_upsert_activities
+from app.services.ingest_service import INGEST_CONSUMER_GROUP, INGEST_DEAD_LETTER_KEY, INGEST_STREAM_KEY
+from worker.metrics import JOBS, StreamBacklogCollector, observe_jobs, start_metrics_server
+from worker.streams import Message, StreamConsumer, decode_fields
+
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+BLOCK_TIMEOUT_SECONDS = int(os.getenv("INGEST_BLOCK_TIMEOUT", "5"))
+POLL_INTERVAL_SECONDS = int(os.getenv("INGEST_POLL_INTERVAL", "2"))
+CONSUMER_NAME = os.getenv("INGEST_CONSUMER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+# A pending entry idle for longer than this is assumed to belong to a dead consumer and is reclaimed
+CLAIM_IDLE_MS = int(os.getenv("INGEST_CLAIM_IDLE_MS", "60000"))
+RECLAIM_INTERVAL_SECONDS = int(os.getenv("INGEST_RECLAIM_INTERVAL", "30"))
+MAX_DELIVERIES = int(os.getenv("INGEST_MAX_DELIVERIES", "5"))
+# Port for this process's Prometheus /metrics; 0 disables the endpoint
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "9102"))
+
+def _payload(fields: Dict[str, str]) -> object:
+    try:
+        return json.loads(fields["payload"])
+    except (KeyError, ValueError):
+        # Left for the upsert's validation to reject and report
+        return {}
+
+
+def _upsert_isolating_failures(payloads: List[object]) -> List[ActivityUpsertResult]:
+    """``bulk_upsert_activities``, bisecting the batch whenever it raises instead of reporting per-item errors.
+
+    Only a payload that still raises on its own is reported as an error, so
+    one poison entry can't hold back or dead-letter the rest of its batch.
+    Halves that already went in are reported unchanged when retried. Lost
+    database connections are raised instead, leaving the batch pending for a
+    later retry.
+    """
+
+    try:
+        with SessionLocal() as session:
+            return bulk_upsert_activities(session, payloads)
+    except (OperationalError, InterfaceError):
+        raise
+    except Exception as exc:
+        if len(payloads) == 1:
+            return [ActivityUpsertResult(index=0, status="error", error=f"{type(exc).__name__}: {exc}")]
+        middle = len(payloads) // 2
+        head = _upsert_isolating_failures(payloads[:middle])
+        tail = _upsert_isolating_failures(payloads[middle:])
+        return head + [result.model_copy(update={"index": result.index + middle}) for result in tail]
+
+
+def write_batch(consumer: StreamConsumer, messages: Sequence[Message]) -> None:
+    """Upsert one micro-batch of stream entries, then ACK them or move the rejected ones to the dead-letter stream."""
+
+    started = time.perf_counter()
+    entries = [(message_id, decode_fields(fields)) for message_id, fields in messages]
+    try:
+        results = _upsert_isolating_failures([_payload(fields) for _, fields in entries])
+    except Exception:
+        JOBS.labels("ingest", "failed").inc(len(entries))
+        raise
+
+    failed = {result.index: result.error or "rejected" for result in results if result.status == "error"}
+    if failed:
+        consumer.dead_letter(
+            [(entries[index][0], {**entries[index][1], "error": error}) for index, error in failed.items()]
+        )
+    consumer.ack([message_id for index, (message_id, _) in enumerate(entries) if index not in failed])
+
+    for result in results:
+        if result.status != "error":
+            JOBS.labels("ingest", result.status).inc()
+    observe_jobs("ingest", started, [message_id for message_id, _ in entries])
+
+    written = sum(1 for result in results if result.status in ("created", "updated"))
+    print(f"Ingested {written} of {len(entries)} activities")
+
+
+def run_ingest(batch_size: int = INGEST_BATCH_SIZE) -> None:
+    """Drain the ingest stream in batches of up to ``batch_size`` until SIGTERM/SIGINT.
+
+    A batch being written when the signal arrives is finished first.
+    """
+
+    consumer = StreamConsumer(
+        get_redis(),
+        "ingest",
+        INGEST_STREAM_KEY,
+        INGEST_CONSUMER_GROUP,
+        INGEST_DEAD_LETTER_KEY,
+        CONSUMER_NAME,
+        claim_idle_ms=CLAIM_IDLE_MS,
+        max_deliveries=MAX_DELIVERIES,
+    )
+    consumer.ensure_group()
+    start_metrics_server(
+        INGEST_METRICS_PORT,
+        StreamBacklogCollector("ingest", INGEST_STREAM_KEY, INGEST_CONSUMER_GROUP, INGEST_DEAD_LETTER_KEY),
+    )
+
+    stop = threading.Event()
+
+    def _request_stop(signum, frame) -> None:
+        print(f"Received signal {signum}, finishing the current batch...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    print(f"Ingest consumer {CONSUMER_NAME} started with batch_size={batch_size}, waiting for activities...")
+
+    last_reclaim = 0.0
+    while not stop.is_set():
+        try:
+            if time.monotonic() - last_reclaim >= RECLAIM_INTERVAL_SECONDS:
+                last_reclaim = time.monotonic()
+                reclaimed, _ = consumer.reclaim_idle(count=batch_size)
+                for start in range(0, len(reclaimed), batch_size):
+                    write_batch(consumer, reclaimed[start : start + batch_size])
+
+            messages = consumer.read(batch_size, BLOCK_TIMEOUT_SECONDS)
+            if messages:
+                write_batch(consumer, messages)
+        except Exception as exc:  # pragma: no cover - log and retry; unACKed entries are reclaimed later
+            print(f"Ingest error: {exc}")
+            stop.wait(POLL_INTERVAL_SECONDS)
+
+    print("Ingest consumer stopped")
+
+
+if __name__ == "__main__":
+    run_ingest()
@@ -0,0 +1,117 @@
+"""Redis Streams consumer-group plumbing shared by the insight worker and the ingest consumer.
+
+Entries are read through a consumer group and only ACKed (and deleted) once
+their work has committed. Entries another consumer left pending for longer
+than the claim idle time are reclaimed. Entries that have already been
+delivered the maximum number of times are moved to a dead-letter stream
+instead, with the id they had and why they failed.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import redis
+
+from worker.metrics import JOBS
+
+
+Message = Tuple[bytes, Dict[bytes, bytes]]
+# A stream entry with its fields decoded
+Entry = Tuple[bytes, Dict[str, str]]
+
+
+def decode_fields(fields: Dict[bytes, bytes]) -> Dict[str, str]:
+    return {k.decode(): v.decode() for k, v in fields.items()}
+
+
+class StreamConsumer:
+    """One consumer in ``group`` on ``stream_key``, dead-lettering to ``dead_letter_key``.
+
+    ``queue`` labels the consumer's metrics.
+    """
+
+    def __init__(
+        self,
+        r: redis.Redis,
+        queue: str,
+        stream_key: str,
+        group: str,
+        dead_letter_key: str,
+        consumer_name: str,
+        *,
+        claim_idle_ms: int,
+        max_deliveries: int,
+    ) -> None:
+        self.r = r
+        self.queue = queue
+        self.stream_key = stream_key
+        self.group = group
+        self.dead_letter_key = dead_letter_key
+        self.consumer_name = consumer_name
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+
+    def ensure_group(self) -> None:
+        """Create the stream and its consumer group if they don't exist yet."""
+        try:
+            self.r.xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except redis.ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+    def read(self, count: int, block_seconds: int) -> List[Message]:
+        """Read up to ``count`` new entries, waiting up to ``block_seconds`` for the first one."""
+        response = self.r.xreadgroup(
+            self.group, self.consumer_name, {self.stream_key: ">"}, count=count, block=block_seconds * 1000
+        )
+        return [message for _, stream_messages in response for message in stream_messages]
+
+    def ack(self, message_ids: Sequence[bytes]) -> None:
+        """ACK and delete entries whose work has committed."""
+        if not message_ids:
+            return
+        pipe = self.r.pipeline()
+        pipe.xack(self.stream_key, self.group, *message_ids)
+        pipe.xdel(self.stream_key, *message_ids)
+        pipe.execute()
+
+    def dead_letter(self, entries: Sequence[Entry]) -> None:
+        """Move entries to the dead-letter stream, keeping their fields plus the id they had as ``source_id``."""
+        if not entries:
+            return
+        pipe = self.r.pipeline()
+        for message_id, fields in entries:
+            pipe.xadd(self.dead_letter_key, {**fields, "source_id": message_id.decode()})
+            pipe.xack(self.stream_key, self.group, message_id)
+            pipe.xdel(self.stream_key, message_id)
+        pipe.execute()
+        JOBS.labels(self.queue, "dead_lettered").inc(len(entries))
+        print(f"Dead-lettered {len(entries)} {self.queue} entries")
+
+    def reclaim_idle(self, count: int) -> Tuple[List[Message], List[Entry]]:
+        """Claim up to ``count`` entries left pending by crashed or stuck consumers.
+
+        Entries delivered ``max_deliveries`` times are dead-lettered instead.
+        Returns the claimed messages and the dead-lettered entries, so the
+        caller can record those as failed.
+        """
+
+        pending = self.r.xpending_range(
+            self.stream_key, self.group, min="-", max="+", count=count, idle=self.claim_idle_ms
+        )
+        dead, to_claim = [], []
+        for entry in pending:
+            if entry["times_delivered"] >= self.max_deliveries:
+                found = self.r.xrange(self.stream_key, min=entry["message_id"], max=entry["message_id"])
+                fields = decode_fields(found[0][1]) if found else {}
+                dead.append((entry["message_id"], {**fields, "deliveries": str(entry["times_delivered"])}))
+            else:
+                to_claim.append(entry["message_id"])
+        self.dead_letter(dead)
+
+        if not to_claim:
+            return [], dead
+        claimed = self.r.xclaim(
+            self.stream_key, self.group, self.consumer_name, min_idle_time=self.claim_idle_ms, message_ids=to_claim
+        )
+        # Entries deleted from the stream since they were read come back without fields
+        return [(message_id, fields) for message_id, fields in claimed if fields], dead
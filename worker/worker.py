@@ -1,31 +1,55 @@
 import json
 import os
+import signal
+import socket
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Sequence
+from uuid import UUID
 
 import redis
-from sqlalchemy import select
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, defer
 
 from app.db.models import Activity, InsightReport, InsightStatusEnum
+from app.db.redis_client import get_redis
 from app.db.session import SessionLocal
+from app.schemas.stats import UserStatsRead
+from app.services.activity_service import by_activity_ids, get_activity
+from app.services.insight_service import (
+    CONSUMER_GROUP,
+    DEAD_LETTER_KEY,
+    INSIGHT_CONTEXT_DAYS,
+    STREAM_KEY,
+    compute_insight_input_hash,
+    find_done_insight_by_hash,
+    notify_insight_status,
+)
+from app.services.stats_service import get_user_stats, get_users_stats
+from worker.metrics import JOBS, StreamBacklogCollector, observe_jobs, start_metrics_server
+from worker.streams import Entry, Message, StreamConsumer, decode_fields
 
 
-REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
-QUEUE_KEY = os.getenv("INSIGHT_QUEUE_KEY", "insight_jobs")
+# Pre-streams list queue; anything left in it is moved onto the stream at startup
+LEGACY_QUEUE_KEY = os.getenv("INSIGHT_QUEUE_KEY", "insight_jobs")
 POLL_INTERVAL_SECONDS = int(os.getenv("WORKER_POLL_INTERVAL", "2"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))
+BLOCK_TIMEOUT_SECONDS = int(os.getenv("WORKER_BLOCK_TIMEOUT", "5"))
+CONSUMER_NAME = os.getenv("WORKER_CONSUMER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+# A pending job idle for longer than this is assumed to belong to a dead consumer and is reclaimed
+CLAIM_IDLE_MS = int(os.getenv("INSIGHT_CLAIM_IDLE_MS", "300000"))
+RECLAIM_INTERVAL_SECONDS = int(os.getenv("INSIGHT_RECLAIM_INTERVAL", "30"))
+MAX_DELIVERIES = int(os.getenv("INSIGHT_MAX_DELIVERIES", "5"))
+# Jobs read per XREADGROUP; above 1 each read is processed as one batch (useful for backfills)
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "1"))
+# Port for this process's Prometheus /metrics; 0 disables the endpoint
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
 
 
-def _get_redis() -> redis.Redis:
-    return redis.from_url(REDIS_URL)
-
-
-def _mock_llm_call(activity: Activity, recent_activities: List[Activity]) -> str:
-    recent_count = len(recent_activities)
-    avg_distance = 0
-    if recent_activities:
-        avg_distance = sum(a.distance_meters for a in recent_activities) / recent_count
+def _mock_llm_call(activity: Activity, recent: UserStatsRead) -> str:
+    recent_count = recent.activity_count
+    avg_distance = recent.avg_distance_meters
 
     summary = (
         f"Workout on {activity.start_time.date()} from source {activity.source}. "
@@ -41,58 +65,270 @@ def process_insight_job(session: Session, insight_id: str) -> None:
     report: InsightReport | None = session.get(InsightReport, insight_id)
     if not report:
         return
+    # A reclaimed job may already have been finished by the consumer that lost it
+    if report.status == InsightStatusEnum.DONE:
+        return
 
     report.status = InsightStatusEnum.PROCESSING
     session.add(report)
     session.commit()
+    # Every status write is announced, which also drops the cached report
+    notify_insight_status([(insight_id, InsightStatusEnum.PROCESSING)])
 
-    activity: Activity | None = session.get(Activity, report.activity_id)
+    activity: Activity | None = get_activity(session, report.activity_id)
     if not activity:
         report.status = InsightStatusEnum.FAILED
         session.add(report)
         session.commit()
+        notify_insight_status([(insight_id, InsightStatusEnum.FAILED)])
         return
 
-    one_week_ago = datetime.now() - timedelta(days=7)
-    recent_activities = list(
-        session.execute(
-            select(Activity).where(
-                Activity.user_id == activity.user_id,
-                Activity.start_time >= one_week_ago,
-            )
-        ).scalars()
-    )
+    # Rolling context comes from the per-day rollup rows rather than the activities themselves
+    recent = get_user_stats(session, activity.user_id, days=INSIGHT_CONTEXT_DAYS)
+    input_hash = compute_insight_input_hash(activity, recent)
 
-    # Simulate a call to an external LLM provider
-    summary = _mock_llm_call(activity, recent_activities)
+    cached = find_done_insight_by_hash(session, activity.id, input_hash)
+    if cached is not None:
+        summary = cached.summary
+    else:
+        # Simulate a call to an external LLM provider
+        summary = _mock_llm_call(activity, recent)
 
     report.summary = summary
+    report.input_hash = input_hash
     report.status = InsightStatusEnum.DONE
     session.add(report)
     session.commit()
+    notify_insight_status([(insight_id, InsightStatusEnum.DONE)])
 
 
-def run_worker() -> None:
-    r = _get_redis()
-    print("Insight worker started, waiting for jobs...")
+def process_insight_jobs_batch(session: Session, insight_ids: Sequence[str]) -> None:
+    """Process many insight jobs with a fixed number of round trips.
 
-    while True:
+    All reports are claimed with one UPDATE, their activities, every affected
+    user's rolling context and any reusable summaries are loaded with one query
+    each, and all results are written back in a single commit.
+    """
+
+    report_ids = set()
+    for insight_id in insight_ids:
         try:
-            job_data = r.lpop(QUEUE_KEY)
-            if not job_data:
-                time.sleep(POLL_INTERVAL_SECONDS)
-                continue
+            report_ids.add(UUID(insight_id))
+        except ValueError:
+            print(f"Skipping malformed insight id {insight_id!r}")
+    if not report_ids:
+        return
 
-            job = json.loads(job_data)
-            insight_id = job.get("insight_id")
-            if not insight_id:
-                continue
+    claimed = session.execute(
+        update(InsightReport)
+        .where(InsightReport.id.in_(report_ids), InsightReport.status != InsightStatusEnum.DONE)
+        .values(status=InsightStatusEnum.PROCESSING)
+        .returning(InsightReport.id, InsightReport.activity_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    session.commit()
+    if not claimed:
+        return
+    notify_insight_status((report_id, InsightStatusEnum.PROCESSING) for report_id, _ in claimed)
+
+    activities = {
+        activity.id: activity
+        for activity in session.scalars(
+            by_activity_ids(
+                select(Activity).options(defer(Activity.route)), {activity_id for _, activity_id in claimed}
+            )
+        )
+    }
+    recent_by_user = get_users_stats(
+        session, {a.user_id for a in activities.values()}, days=INSIGHT_CONTEXT_DAYS
+    )
+    input_hashes = {
+        activity_id: compute_insight_input_hash(activity, recent_by_user[activity.user_id])
+        for activity_id, activity in activities.items()
+    }
+    cached_summaries = dict(
+        session.execute(
+            select(InsightReport.input_hash, InsightReport.summary).where(
+                InsightReport.activity_id.in_(input_hashes.keys()),
+                InsightReport.input_hash.in_(set(input_hashes.values())),
+                InsightReport.status == InsightStatusEnum.DONE,
+            )
+        ).all()
+    )
 
+    results = []
+    for report_id, activity_id in claimed:
+        activity = activities.get(activity_id)
+        if activity is None:
+            results.append(
+                {"id": report_id, "status": InsightStatusEnum.FAILED, "summary": None, "input_hash": None}
+            )
+            continue
+
+        input_hash = input_hashes[activity_id]
+        summary = cached_summaries.get(input_hash)
+        if summary is None:
+            # Simulate a call to an external LLM provider
+            summary = _mock_llm_call(activity, recent_by_user[activity.user_id])
+            cached_summaries[input_hash] = summary
+        results.append(
+            {"id": report_id, "status": InsightStatusEnum.DONE, "summary": summary, "input_hash": input_hash}
+        )
+
+    # ORM bulk UPDATE by primary key: one executemany for the whole batch
+    session.execute(update(InsightReport), results)
+    session.commit()
+    notify_insight_status((result["id"], result["status"]) for result in results)
+
+
+def _handle_jobs(consumer: StreamConsumer, messages: Sequence[Message]) -> None:
+    insight_ids = [decode_fields(fields).get("insight_id") for _, fields in messages]
+    insight_ids = [insight_id for insight_id in insight_ids if insight_id]
+
+    started = time.perf_counter()
+    try:
+        # Each task gets its own pooled session; sessions are not shared across threads
+        if len(insight_ids) == 1:
+            with SessionLocal() as session:
+                process_insight_job(session, insight_ids[0])
+        elif insight_ids:
             with SessionLocal() as session:
-                process_insight_job(session, insight_id)
-        except Exception as exc:  # pragma: no cover - log and continue
+                process_insight_jobs_batch(session, insight_ids)
+    except Exception:
+        JOBS.labels("insight", "failed").inc(len(messages))
+        raise
+
+    # Only ACK once the jobs succeeded; on an exception they stay pending and are retried via reclaim
+    message_ids = [message_id for message_id, _ in messages]
+    consumer.ack(message_ids)
+    JOBS.labels("insight", "done").inc(len(messages))
+    observe_jobs("insight", started, message_ids)
+
+
+def _fail_dead_lettered(entries: Sequence[Entry]) -> None:
+    """Mark the reports of dead-lettered jobs failed, unless they were finished after all."""
+    for _, fields in entries:
+        insight_id = fields.get("insight_id")
+        if not insight_id:
+            continue
+        with SessionLocal() as session:
+            report = session.get(InsightReport, insight_id)
+            if report and report.status != InsightStatusEnum.DONE:
+                report.status = InsightStatusEnum.FAILED
+                session.add(report)
+                session.commit()
+                notify_insight_status([(insight_id, InsightStatusEnum.FAILED)])
+
+
+def _reclaim_idle_jobs(consumer: StreamConsumer) -> List[Message]:
+    """Claim jobs left pending by crashed or stuck consumers.
+
+    Jobs delivered MAX_DELIVERIES times are moved to the dead-letter stream and
+    their report is marked failed; the rest are claimed by this consumer and
+    returned for processing.
+    """
+
+    claimed, dead = consumer.reclaim_idle(count=100)
+    _fail_dead_lettered(dead)
+    return claimed
+
+
+def _migrate_legacy_queue(r: redis.Redis) -> None:
+    moved = 0
+    while True:
+        job_data = r.lpop(LEGACY_QUEUE_KEY)
+        if not job_data:
+            break
+        insight_id = json.loads(job_data).get("insight_id")
+        if insight_id:
+            r.xadd(STREAM_KEY, {"insight_id": insight_id})
+            moved += 1
+    if moved:
+        print(f"Moved {moved} jobs from legacy list {LEGACY_QUEUE_KEY} to stream {STREAM_KEY}")
+
+
+def run_worker(concurrency: int = WORKER_CONCURRENCY, batch_size: int = WORKER_BATCH_SIZE) -> None:
+    """Consume insight jobs from the stream's consumer group, ``concurrency`` at a time.
+
+    Jobs are only read once a thread is free to run them, up to ``batch_size``
+    per read, and are ACKed after they complete. Every RECLAIM_INTERVAL_SECONDS the worker also claims jobs that
+    other consumers left idle. On SIGTERM/SIGINT it stops reading, lets
+    in-flight jobs finish and then exits; unfinished jobs stay pending.
+    """
+
+    r = get_redis()
+    consumer = StreamConsumer(
+        r,
+        "insight",
+        STREAM_KEY,
+        CONSUMER_GROUP,
+        DEAD_LETTER_KEY,
+        CONSUMER_NAME,
+        claim_idle_ms=CLAIM_IDLE_MS,
+        max_deliveries=MAX_DELIVERIES,
+    )
+    consumer.ensure_group()
+    _migrate_legacy_queue(r)
+    start_metrics_server(
+        WORKER_METRICS_PORT, StreamBacklogCollector("insight", STREAM_KEY, CONSUMER_GROUP, DEAD_LETTER_KEY)
+    )
+
+    stop = threading.Event()
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def _request_stop(signum, frame) -> None:
+        print(f"Received signal {signum}, finishing in-flight jobs...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+
+    def _on_done(future: Future) -> None:
+        slots.release()
+        exc = future.exception()
+        if exc is not None:
             print(f"Worker error: {exc}")
-            time.sleep(POLL_INTERVAL_SECONDS)
+
+    print(
+        f"Insight worker {CONSUMER_NAME} started with concurrency={concurrency}, "
+        f"batch_size={batch_size}, waiting for jobs..."
+    )
+
+    def _submit(messages: Sequence[Message]) -> None:
+        pool.submit(_handle_jobs, consumer, messages).add_done_callback(_on_done)
+
+    last_reclaim = 0.0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="insight-worker") as pool:
+        while not stop.is_set():
+            if time.monotonic() - last_reclaim >= RECLAIM_INTERVAL_SECONDS:
+                last_reclaim = time.monotonic()
+                try:
+                    reclaimed = _reclaim_idle_jobs(consumer)
+                except redis.RedisError as exc:  # pragma: no cover - log and retry next interval
+                    print(f"Worker error: {exc}")
+                    reclaimed = []
+                for start in range(0, len(reclaimed), batch_size):
+                    slots.acquire()
+                    _submit(reclaimed[start : start + batch_size])
+
+            if not slots.acquire(timeout=1):
+                continue
+
+            try:
+                messages = consumer.read(batch_size, BLOCK_TIMEOUT_SECONDS)
+            except redis.RedisError as exc:  # pragma: no cover - log and retry
+                slots.release()
+                print(f"Worker error: {exc}")
+                stop.wait(POLL_INTERVAL_SECONDS)
+                continue
+
+            if not messages:
+                slots.release()
+                continue
+
+            _submit(messages)
+
+    print("Insight worker stopped")
 
 
 if __name__ == "__main__":